@@ -0,0 +1,207 @@
+from decimal import ROUND_HALF_UP, Decimal
+import math
+import sys
+
+# ISO 4217 minor units; everything not listed uses 2
+CURRENCY_EXPONENTS = {
+    **dict.fromkeys(["BIF", "CLP", "DJF", "GNF", "ISK", "JPY", "KMF", "KRW", "PYG", "RWF", "UGX", "VND", "VUV", "XAF", "XOF", "XPF"], 0),
+    **dict.fromkeys(["BHD", "IQD", "JOD", "KWD", "LYD", "OMR", "TND"], 3),
+    "BTC": 8,
+}
+
+CARD_FIELDS = ("number", "expiration", "card", "type", "CVC")
+
+
+def exponent(currency):
+    return CURRENCY_EXPONENTS.get(currency, 2)
+
+
+def to_minor(amount, currency):
+    """Amount in major units (float/str/Decimal) -> integer minor units, rounded half-up."""
+    if isinstance(amount, (int, float)):
+        # rounding to 6 places first strips binary noise such as 0.285 * 100 == 28.499999999999996
+        scaled = round(amount * 10 ** exponent(currency), 6)
+        return int(math.copysign(math.floor(abs(scaled) + 0.5), scaled))
+    return int((Decimal(str(amount)) * 10 ** exponent(currency)).to_integral_value(ROUND_HALF_UP))
+
+
+def from_minor(units, currency):
+    exp = exponent(currency)
+    return units if exp == 0 else units / 10**exp
+
+
+class Account:
+    """Compact in-memory account: integer minor-unit balance, packed card tuple."""
+
+    __slots__ = ("password", "currency", "balance_minor", "activated", "is_admin", "_card")
+
+    def __init__(self, password, currency="USD", balance_minor=0, activated=True, is_admin=False, card=None):
+        self.password = password
+        self.currency = currency
+        self.balance_minor = balance_minor
+        self.activated = activated
+        self.is_admin = is_admin
+        self._card = self._pack_card(card)
+
+    @staticmethod
+    def _pack_card(card):
+        if card is None or isinstance(card, tuple):
+            return card
+        number, expiration, brand, kind, cvc = (card.get(field) for field in CARD_FIELDS)
+        # brand/type repeat across millions of accounts; share one string object each
+        return number, expiration, sys.intern(brand) if brand else brand, sys.intern(kind) if kind else kind, cvc
+
+    @classmethod
+    def from_dict(cls, acct):
+        currency = sys.intern(acct.get("currency", "USD"))
+        return cls(
+            acct["password"],
+            currency,
+            to_minor(acct.get("balance", 0), currency),
+            acct.get("activated", True),
+            acct.get("is_admin", False),
+            acct.get("card"),
+        )
+
+    @property
+    def balance(self):
+        return from_minor(self.balance_minor, self.currency)
+
+    @property
+    def card(self):
+        # the dict is only materialised when a caller actually looks at the card
+        return dict(zip(CARD_FIELDS, self._card)) if self._card is not None else None
+
+    def update(self, fields):
+        # currency first, so a balance in the same update is rounded to the new exponent
+        if "currency" in fields and fields["currency"] != self.currency:
+            if "balance" not in fields:
+                self.balance_minor = to_minor(self.balance, fields["currency"])
+            self.currency = fields["currency"]
+        for name, value in fields.items():
+            if name == "balance":
+                self.balance_minor = to_minor(value, self.currency)
+            elif name == "card":
+                self._card = self._pack_card(value)
+            elif name in ("password", "activated", "is_admin"):
+                setattr(self, name, value)
+
+    def export(self):
+        """The account as a dict whose card is only built when someone reads it."""
+        view = AccountDict(password=self.password, currency=self.currency, balance=self.balance, activated=self.activated, is_admin=self.is_admin)
+        view._card = self._card
+        return view
+
+    def to_dict(self):
+        return {
+            "password": self.password,
+            "currency": self.currency,
+            "balance": self.balance,
+            "activated": self.activated,
+            "is_admin": self.is_admin,
+            "card": self.card,
+        }
+
+
+class AccountDict(dict):
+    """Account dict from CompactStore: the card entry is added on first use.
+
+    Reading any other field is a plain dict lookup; reading the card, or the dict as a
+    whole (iteration, items(), comparison, copying, JSON), builds the card dict first.
+    """
+
+    __slots__ = ("_card",)
+    _NOT_LOADED = object()
+
+    def _load(self):
+        card = self._card
+        if card is not AccountDict._NOT_LOADED:
+            self._card = AccountDict._NOT_LOADED
+            dict.__setitem__(self, "card", dict(zip(CARD_FIELDS, card)) if card is not None else None)
+
+    def __getitem__(self, key):
+        if key == "card":
+            self._load()
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        if key == "card":
+            self._load()
+        return dict.get(self, key, default)
+
+    def __setitem__(self, key, value):
+        if key == "card":
+            self._card = AccountDict._NOT_LOADED
+        dict.__setitem__(self, key, value)
+
+    def __contains__(self, key):
+        self._load()
+        return dict.__contains__(self, key)
+
+    def __iter__(self):
+        self._load()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self._load()
+        return dict.__len__(self)
+
+    def __eq__(self, other):
+        self._load()
+        if isinstance(other, AccountDict):
+            other._load()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        self._load()
+        if isinstance(other, AccountDict):
+            other._load()
+        return dict.__ne__(self, other)
+
+    def __repr__(self):
+        self._load()
+        return dict.__repr__(self)
+
+    def __or__(self, other):
+        return self.copy() | other
+
+    def __reduce__(self):
+        return dict, (self.copy(),)
+
+    def copy(self):
+        self._load()
+        return dict(dict.items(self))
+
+    def keys(self):
+        self._load()
+        return dict.keys(self)
+
+    def values(self):
+        self._load()
+        return dict.values(self)
+
+    def items(self):
+        self._load()
+        return dict.items(self)
+
+    def pop(self, key, *default):
+        self._load()
+        return dict.pop(self, key, *default)
+
+    def popitem(self):
+        self._load()
+        return dict.popitem(self)
+
+    def setdefault(self, key, default=None):
+        self._load()
+        return dict.setdefault(self, key, default)
+
+    def update(self, *args, **kwargs):
+        self._load()
+        dict.update(self, *args, **kwargs)
+
+    def __delitem__(self, key):
+        self._load()
+        dict.__delitem__(self, key)
+
+    __hash__ = None
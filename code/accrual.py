@@ -0,0 +1,208 @@
+"""End-of-day interest and maintenance-fee accrual over every account, vectorized with NumPy.
+
+    python accrual.py [--dry-run] [--date YYYY-MM-DD] [--schedule FILE] [--db-dir ../db]
+
+A schedule maps currency codes to {"tiers": [[from, annual rate], ...], "fee": daily fee,
+"fee_waived_from": balance}. Tiers are marginal: each slice of a balance earns its own
+tier's rate. The "*" entry applies to currencies without one of their own; its amounts
+are in the converter's base currency and are converted per currency. Only activated,
+non-admin accounts accrue. Fees never take a balance below zero.
+
+Accounts are streamed into NumPy arrays CHUNK at a time; the new balances are written
+back with one update_many and the ledger gets one interest/fee record per account. The
+date of the last run is kept in db/accrual.json: a run covers every day since then, and
+a second run for the same day is refused.
+"""
+from pathlib import Path
+import argparse
+import datetime
+import json
+import sys
+import numpy as np
+from accounts import exponent
+from currency_exchange import CurrencyConverter
+from ledger import open_ledger
+from locks import open_locks
+from storage import open_store, write_json_atomic
+
+BASE_DIR = Path(__file__).resolve().parent
+DB_DIR = BASE_DIR.parent / "db"
+CHUNK = 100_000
+DEFAULT_SCHEDULE = {
+    "*": {"tiers": [[0, 0.0], [1_000, 0.005], [10_000, 0.01]], "fee": 0.05, "fee_waived_from": 500},
+}
+
+
+class RateSchedule:
+    """A schedule compiled to arrays indexed by currency id (converter order), in minor units."""
+
+    def __init__(self, schedule, converter):
+        codes = converter.codes
+        base = schedule.get("*", {"tiers": [[0, 0.0]]})
+        levels = max(len(entry.get("tiers") or [[0, 0.0]]) for entry in [base, *schedule.values()])
+        self.scale = np.array([10.0 ** exponent(code) for code in codes])
+        # "*" amounts are in the base currency: convert them once per currency
+        to_local = np.where(np.isin(codes, list(schedule)), 1.0, converter.convert_many(np.ones(len(codes)), [converter.base] * len(codes), list(codes)))
+        self.bounds = np.full((len(codes), levels + 1), np.inf)  # tier start, then +inf
+        self.rates = np.zeros((len(codes), levels))
+        self.fee = np.zeros(len(codes))
+        self.waived_from = np.full(len(codes), np.inf)
+        for i, code in enumerate(codes):
+            entry = schedule.get(code, base)
+            tiers = sorted(entry.get("tiers") or [[0, 0.0]])
+            factor = to_local[i] * self.scale[i]
+            for level, (start, rate) in enumerate(tiers):
+                self.bounds[i, level] = start * factor
+                self.rates[i, level] = rate
+            self.fee[i] = np.floor(entry.get("fee", 0) * factor + 0.5)
+            if entry.get("fee_waived_from") is not None:
+                self.waived_from[i] = entry["fee_waived_from"] * factor
+        # width of each tier; padding levels (inf - inf) are empty
+        with np.errstate(invalid="ignore"):
+            self.widths = np.nan_to_num(np.diff(self.bounds, axis=1), nan=0.0)
+
+    def accrue(self, balances, ids, days):
+        """(interest, fee) in whole minor units for int64 minor-unit balances of currency ids."""
+        slices = np.clip(balances[:, None] - self.bounds[ids, :-1], 0, self.widths[ids])
+        # interest is rounded down to whole minor units
+        interest = np.floor((slices * self.rates[ids]).sum(axis=1) * days / 365).astype(np.int64)
+        fee = np.where(balances < self.waived_from[ids], self.fee[ids] * days, 0).astype(np.int64)
+        return interest, np.minimum(fee, np.maximum(balances + interest, 0))
+
+
+def load_schedule(path=None):
+    if path is None:
+        return DEFAULT_SCHEDULE
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def to_minor_array(amounts, scale):
+    # accounts.to_minor, vectorized: strip binary noise, then round half away from zero
+    scaled = np.round(amounts * scale, 6)
+    return (np.copysign(np.floor(np.abs(scaled) + 0.5), scaled)).astype(np.int64)
+
+
+def _chunks(store, ids):
+    """(keys, balances, currency ids) per CHUNK eligible accounts; unknown currencies get -1."""
+    keys, balances, currencies = [], [], []
+    for key, acct in store.items():
+        if not acct.get("activated", True) or acct.get("is_admin", False):
+            continue
+        keys.append(key)
+        balances.append(acct.get("balance", 0))
+        currencies.append(ids.get(acct.get("currency", "USD"), -1))
+        if len(keys) == CHUNK:
+            yield keys, np.array(balances, dtype=np.float64), np.array(currencies, dtype=np.intp)
+            keys, balances, currencies = [], [], []
+    if keys:
+        yield keys, np.array(balances, dtype=np.float64), np.array(currencies, dtype=np.intp)
+
+
+def accrue(store, converter, schedule, days=1, dry_run=False, ledger=None):
+    """Accrue `days` of interest and fees on every eligible account.
+
+    Returns ({currency: [accounts, interest, fees] in major units}, accounts skipped for an
+    unknown currency). Without dry_run the new balances are committed with one update_many
+    and, if a ledger is given, recorded in it with one append_many.
+    """
+    rates = RateSchedule(schedule, converter)
+    codes = converter.codes
+    count = np.zeros(len(codes), dtype=np.int64)
+    interest_total = np.zeros(len(codes), dtype=np.int64)
+    fee_total = np.zeros(len(codes), dtype=np.int64)
+    updates = {}
+    entries = []
+    skipped = 0
+    for keys, balances, ids in _chunks(store, converter.ids):
+        known = ids >= 0
+        skipped += int((~known).sum())
+        if not known.all():
+            keys = [key for key, ok in zip(keys, known) if ok]
+            balances, ids = balances[known], ids[known]
+        scale = rates.scale[ids]
+        minor = to_minor_array(balances, scale)
+        interest, fee = rates.accrue(minor, ids, days)
+        count += np.bincount(ids, minlength=len(codes))
+        interest_total += np.bincount(ids, weights=interest, minlength=len(codes)).astype(np.int64)
+        fee_total += np.bincount(ids, weights=fee, minlength=len(codes)).astype(np.int64)
+        if dry_run:
+            continue
+        changed = np.flatnonzero((interest != 0) | (fee != 0))
+        credited = minor + interest
+        final = credited - fee
+        new = (final[changed] / scale[changed]).tolist()
+        whole = (scale[changed] == 1).tolist()
+        for j, i in enumerate(changed.tolist()):
+            key, code = keys[i], codes[ids[i]]
+            updates[key] = {"balance": int(new[j]) if whole[j] else new[j]}
+            if ledger is not None:
+                if interest[i]:
+                    entries.append((key, "interest", int(interest[i]), code, int(credited[i])))
+                if fee[i]:
+                    entries.append((key, "fee", int(fee[i]), code, int(final[i])))
+    if updates:
+        store.update_many(updates)
+        if entries:
+            ledger.append_many(entries)
+    totals = {
+        code: [int(count[i]), float(interest_total[i] / rates.scale[i]), float(fee_total[i] / rates.scale[i])]
+        for i, code in enumerate(codes)
+        if count[i]
+    }
+    return totals, skipped
+
+
+# --- nightly job ---
+def last_run(db_dir):
+    try:
+        with open(Path(db_dir) / "accrual.json", "r") as f:
+            return datetime.date.fromisoformat(json.load(f)["last_run"])
+    except FileNotFoundError:
+        return None
+
+
+def run(db_dir, date=None, schedule=None, dry_run=False, force=False):
+    """Accrue every day since the last run up to `date`; returns (days, totals, skipped)."""
+    date = date or datetime.date.today()
+    previous = last_run(db_dir)
+    if previous is not None and previous >= date and not force:
+        raise ValueError(f"Already accrued up to {previous}")
+    days = (date - previous).days if previous is not None and previous < date else 1
+    store = open_store(db_dir)
+    converter = CurrencyConverter(db_path=str(Path(db_dir) / "currency.db"))
+    try:
+        # every account at once, like apply_batch: no deposit can slip in between read and write
+        with open_locks(Path(db_dir) / "accounts.lock").hold_all():
+            totals, skipped = accrue(store, converter, schedule or DEFAULT_SCHEDULE, days, dry_run, None if dry_run else open_ledger(Path(db_dir) / "ledger"))
+            if not dry_run:
+                write_json_atomic(Path(db_dir) / "accrual.json", {"last_run": date.isoformat()})
+    finally:
+        store.close()
+    return days, totals, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-dir", type=Path, default=DB_DIR)
+    parser.add_argument("--date", type=datetime.date.fromisoformat, help="accrue up to this day (default: today)")
+    parser.add_argument("--schedule", type=Path, help="JSON rate schedule (default: DEFAULT_SCHEDULE)")
+    parser.add_argument("--dry-run", action="store_true", help="report the totals without changing any balance")
+    parser.add_argument("--force", action="store_true", help="run even if this day was already accrued")
+    args = parser.parse_args()
+    try:
+        days, totals, skipped = run(args.db_dir, args.date, load_schedule(args.schedule), args.dry_run, args.force)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(f"{'would accrue' if args.dry_run else 'accrued'} {days} day(s)")
+    print(f"{'currency':<10}{'accounts':>10}{'interest':>18}{'fees':>16}")
+    for code, (count, interest, fees) in sorted(totals.items()):
+        print(f"{code:<10}{count:>10}{interest:>18.2f}{fees:>16.2f}")
+    if skipped:
+        print(f"{skipped} accounts skipped (currency not in currency.db)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,19 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+import argparse
+import csv
+import datetime
 import json
+import math
 import os
+import sys
+import instrumentation
+from accounts import from_minor, to_minor
+from currency_exchange import CurrencyConverter
+from indexes import index_values, matches
+from locks import open_locks
+from storage import open_store
 
 BASE_DIR = Path(__file__).resolve().parent
 DB_DIR = BASE_DIR.parent / "db"
@@ -11,15 +24,295 @@ def clear_terminal():
     os.system("cls" if os.name == "nt" else "clear")
 
 
+# --- Bulk operations (shared with the Admin class in main.py) ---
+BULK_ACTIONS = {"activate": "activated", "deactivate": "deactivated", "delete": "deleted", "change": "updated"}
+PROGRESS_EVERY = 10_000
+
+
+def filter_predicate(filters, has_card=None):
+    """predicate(acct) for the search filters plus an optional has-card condition."""
+
+    def predicate(acct):
+        if has_card is not None and bool(acct.get("card")) != has_card:
+            return False
+        return matches(filters, *index_values(acct))
+
+    return predicate
+
+
+def select_bulk(store, action, usernames=None, predicate=None, fields=None, progress=None):
+    """One scan of the store: ({key: fields or None for delete}, number of usernames not found)."""
+    wanted = {name.strip().upper() for name in usernames if name.strip()} if usernames is not None else None
+    data = store.all()
+    total = len(data)
+    selected = {}
+    for i, (key, acct) in enumerate(data.items(), 1):
+        if (wanted is None or key in wanted) and (predicate is None or predicate(acct)):
+            if wanted is None and action in ("delete", "deactivate") and acct.get("is_admin"):
+                pass
+            elif action == "activate" and not acct.get("activated", True):
+                selected[key] = {"activated": True}
+            elif action == "deactivate" and acct.get("activated", True):
+                selected[key] = {"activated": False}
+            elif action == "delete":
+                selected[key] = None
+            elif action == "change":
+                changes = {k: v for k, v in fields.items() if k in acct}
+                if changes:
+                    selected[key] = changes
+        if progress and (i % PROGRESS_EVERY == 0 or i == total):
+            progress("scan", i, total)
+    missing = len(wanted - data.keys()) if wanted is not None else 0
+    return selected, missing
+
+
+def commit_bulk(store, action, selected):
+    if action == "delete":
+        store.delete_many(list(selected))
+    else:
+        store.update_many(selected)
+
+
+def bulk_operation(store, action, usernames=None, predicate=None, fields=None, dry_run=False, progress=None):
+    """Apply one admin action to every account named in usernames and/or matching predicate(acct).
+
+    The accounts are found in a single scan and changed with a single store commit
+    (update_many / delete_many). Accounts picked by a predicate alone are never deleted or
+    deactivated if they are admins. progress(stage, done, total) is called while scanning
+    and committing.
+    """
+    if action not in BULK_ACTIONS:
+        return False, f"Unknown bulk action: {action}"
+    if usernames is None and predicate is None:
+        return False, "Give a list of usernames or a predicate"
+    if action == "change" and not fields:
+        return False, "No fields to change"
+    selected, missing = select_bulk(store, action, usernames, predicate, fields, progress)
+
+    verb = BULK_ACTIONS[action]
+    note = f" ({missing} not found)" if missing else ""
+    if not selected:
+        return False, f"No accounts to be {verb}{note}"
+    if dry_run:
+        return True, f"{len(selected)} accounts would be {verb}{note}"
+    if progress:
+        progress("commit", 0, len(selected))
+    commit_bulk(store, action, selected)
+    if progress:
+        progress("commit", len(selected), len(selected))
+    return True, f"{len(selected)} accounts {verb}{note}"
+
+
+# --- Streaming import/export ---
+EXPORT_FIELDS = ("username", "password", "currency", "balance", "activated", "is_admin", "card_number", "card_expiration", "card_brand", "card_type", "card_cvc")
+IMPORT_CHUNK = 2_000
+TRUE_WORDS = ("true", "yes", "1", "y")
+
+
+def file_format(path, fmt=None):
+    fmt = (fmt or Path(str(path)).suffix.lstrip(".") or "csv").lower()
+    if fmt not in ("csv", "jsonl"):
+        raise ValueError(f"Unknown format: {fmt} (csv or jsonl)")
+    return fmt
+
+
+def read_rows(f, fmt):
+    """Yield (line number, row dict) one at a time; JSONL rows may nest the card as in database.db."""
+    if fmt == "csv":
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for lineno, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield lineno, row if isinstance(row, dict) else {"_error": "Not a JSON object"}
+
+
+def luhn_valid(digits):
+    total = 0
+    for i, d in enumerate(reversed(digits)):
+        d = int(d)
+        if i % 2 == 1:
+            d *= 2
+            if d > 9:
+                d -= 9
+        total += d
+    return total % 10 == 0
+
+
+def expiration_error(text, today):
+    try:
+        month, year = text.split("/")
+        month, year = int(month), 2000 + int(year)
+    except ValueError:
+        return "Expiration must be MM/YY"
+    if not 1 <= month <= 12:
+        return "Expiration must be MM/YY"
+    if (year, month) < (today.year, today.month):
+        return "Card has expired"
+    return None
+
+
+def _flag(value, default):
+    if value is None or value == "":
+        return default
+    return value if isinstance(value, bool) else str(value).strip().lower() in TRUE_WORDS
+
+
+def parse_account(row, currencies, today):
+    """(key, account) for one import row, or raise ValueError with the reason."""
+    if "_error" in row:
+        raise ValueError(row["_error"])
+    key = str(row.get("username") or "").strip().upper()
+    password = row.get("password")
+    if not key:
+        raise ValueError("Missing username")
+    if not password:
+        raise ValueError("Missing password")
+    currency = str(row.get("currency") or "USD").strip().upper()
+    if currency not in currencies:
+        raise ValueError(f"Unknown currency: {currency}")
+    try:
+        balance = float(row.get("balance") or 0)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid balance")
+    if not math.isfinite(balance) or balance < 0:
+        raise ValueError("Invalid balance")
+    balance = from_minor(to_minor(balance, currency), currency)
+    card = row.get("card")
+    if isinstance(card, dict):
+        number, expiration, brand, kind, cvc = (card.get(k) for k in ("number", "expiration", "card", "type", "CVC"))
+    else:
+        number, expiration, brand, kind, cvc = (row.get(k) for k in ("card_number", "card_expiration", "card_brand", "card_type", "card_cvc"))
+    if number not in (None, ""):
+        number = str(number).strip()
+        if not number.isdigit() or not 12 <= len(number) <= 19 or not luhn_valid(number):
+            raise ValueError("Invalid card number")
+        error = expiration_error(str(expiration or "").strip(), today)
+        if error:
+            raise ValueError(error)
+        try:
+            cvc = int(cvc)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid CVC")
+        card = {"number": int(number), "expiration": str(expiration).strip(), "card": str(brand or "VISA").upper(), "type": str(kind or "CREDIT").upper(), "CVC": cvc}
+    else:
+        card = None
+    return key, {
+        "password": str(password),
+        "currency": currency,
+        "balance": balance,
+        "activated": _flag(row.get("activated"), True),
+        "is_admin": _flag(row.get("is_admin"), False),
+        "card": card,
+    }
+
+
+def validate_chunk(rows, currencies, today):
+    """Worker: [(line, username, account or None, reason or None)] for a list of (line, row)."""
+    out = []
+    for lineno, row in rows:
+        try:
+            key, acct = parse_account(row, currencies, today)
+            out.append((lineno, key, acct, None))
+        except ValueError as e:
+            out.append((lineno, str(row.get("username") or "").strip().upper(), None, str(e)))
+    return out
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _validated(rows, currencies, workers):
+    # at most 2 chunks per worker in flight, so memory stays flat however long the file is
+    today = datetime.date.today()
+    chunks = _chunks(rows, IMPORT_CHUNK)
+    if workers == 1:
+        for chunk in chunks:
+            yield validate_chunk(chunk, currencies, today)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(validate_chunk, chunk, currencies, today))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def import_accounts(store, f, fmt, currencies, dry_run=False, workers=None, on_reject=None):
+    """Create accounts from a CSV/JSONL stream with a single store commit (put_many).
+
+    Rows are read and validated (currency code, Luhn check and expiration of cards)
+    chunk by chunk across a process pool. Usernames already in the store, or repeated in
+    the file, are rejected; rejects are passed to on_reject(line, username, reason).
+    """
+    existing = {key for key, _ in store.items()}
+    workers = workers or os.cpu_count() or 1
+    accepted = {}
+    rejected = 0
+    for results in _validated(read_rows(f, fmt), frozenset(currencies), workers):
+        for lineno, key, acct, reason in results:
+            if reason is None and (key in existing or key in accepted):
+                reason = "Duplicate username"
+            if reason is not None:
+                rejected += 1
+                if on_reject is not None:
+                    on_reject(lineno, key, reason)
+                continue
+            accepted[key] = acct
+    note = f" ({rejected} rejected)" if rejected else ""
+    if not accepted:
+        return False, f"No accounts to import{note}"
+    if dry_run:
+        return True, f"{len(accepted)} accounts would be imported{note}"
+    store.put_many(accepted)
+    return True, f"{len(accepted)} accounts imported{note}"
+
+
+def export_accounts(store, out, fmt):
+    """Stream every account to out as CSV or JSONL (store.items(), never the whole dict)."""
+    count = 0
+    if fmt == "csv":
+        writer = csv.writer(out)
+        writer.writerow(EXPORT_FIELDS)
+    for key, acct in store.items():
+        if fmt == "jsonl":
+            out.write(json.dumps({"username": key, **acct}) + "\n")
+        else:
+            card = acct.get("card") or {}
+            writer.writerow((key, acct.get("password"), acct.get("currency", "USD"), acct.get("balance", 0),
+                             acct.get("activated", True), acct.get("is_admin", False), card.get("number", ""),
+                             card.get("expiration", ""), card.get("card", ""), card.get("type", ""), card.get("CVC", "")))
+        count += 1
+    return count
+
+
 class Admin:
-    def __init__(self, db_dir: Path = None):
+    def __init__(self, db_dir: Path = None, store=None):
         self.BASE_DIR = Path(__file__).resolve().parent
         if db_dir is None:
             db_dir = self.BASE_DIR.parent / "db"
         self.db_dir = Path(db_dir)
         self.database_db = self.db_dir / "database.db"
         self.database_db.parent.mkdir(parents=True, exist_ok=True)
-        if not self.database_db.exists():
+        self.store = store if store is not None else open_store(self.db_dir)
+        self.locks = open_locks(self.db_dir / "accounts.lock")
+        if not self.store.exists():
             # default admin account
             default = {
                 "ADMIN": {
@@ -35,66 +328,72 @@ class Admin:
 
     # --- Database helpers ---
     def _read_database(self):
-        with open(self.database_db, "r") as f:
-            return json.load(f)
+        return self.store.all()
 
     def _write_database(self, data):
-        with open(self.database_db, "w") as f:
-            json.dump(data, f, indent=4)
+        self.store.replace_all(data)
 
-    # --- Admin actions ---
+    # --- Admin actions (each holds the account's stripe from check to write, like Features) ---
     def create_account(self, username, password, currency="USD"):
         key = username.upper()
-        db = self._read_database()
-        if key in db:
-            return False, "Account already exists"
-        db[key] = {
-            "password": password,
-            "currency": currency.upper(),
-            "balance": 0,
-            "activated": True,
-            "card": None,
-        }
-        self._write_database(db)
-        return True, f"Account {key} created"
+        with self.locks.hold(key):
+            if key in self.store:
+                return False, "Account already exists"
+            self.store.put(key, {
+                "password": password,
+                "currency": currency.upper(),
+                "balance": 0,
+                "activated": True,
+                "card": None,
+            })
+            return True, f"Account {key} created"
 
     def delete_account(self, username):
         key = username.upper()
-        db = self._read_database()
-        if key not in db:
-            return False, "Account not found"
-        db.pop(key)
-        self._write_database(db)
-        return True, f"Account {key} deleted"
+        with self.locks.hold(key):
+            if key not in self.store:
+                return False, "Account not found"
+            self.store.delete(key)
+            return True, f"Account {key} deleted"
 
     def activate_account(self, username):
         key = username.upper()
-        db = self._read_database()
-        if key not in db:
-            return False, "Account not found"
-        db[key]["activated"] = True
-        self._write_database(db)
-        return True, f"Account {key} activated"
+        with self.locks.hold(key):
+            if key not in self.store:
+                return False, "Account not found"
+            self.store.update(key, {"activated": True})
+            return True, f"Account {key} activated"
 
     def deactivate_account(self, username):
         key = username.upper()
-        db = self._read_database()
-        if key not in db:
-            return False, "Account not found"
-        db[key]["activated"] = False
-        self._write_database(db)
-        return True, f"Account {key} deactivated"
+        with self.locks.hold(key):
+            if key not in self.store:
+                return False, "Account not found"
+            self.store.update(key, {"activated": False})
+            return True, f"Account {key} deactivated"
 
     def change_details(self, username, **kwargs):
         key = username.upper()
-        db = self._read_database()
-        if key not in db:
-            return False, "Account not found"
-        for k, v in kwargs.items():
-            if k in db[key]:
-                db[key][k] = v
-        self._write_database(db)
-        return True, f"Account {key} updated"
+        with self.locks.hold(key):
+            acct = self.store.get(key)
+            if acct is None:
+                return False, "Account not found"
+            self.store.update(key, {k: v for k, v in kwargs.items() if k in acct})
+            return True, f"Account {key} updated"
+
+    def bulk_operation(self, action, usernames=None, predicate=None, fields=None, dry_run=False, progress=None):
+        if dry_run:
+            return bulk_operation(self.store, action, usernames, predicate, fields, dry_run, progress)
+        # every stripe, as in Features.apply_batch: the accounts are picked and changed in one go
+        with self.locks.hold_all():
+            return bulk_operation(self.store, action, usernames, predicate, fields, dry_run, progress)
+
+    def search_accounts(self, offset=0, limit=20, **filters):
+        """One page of accounts matching filters (currency, activated, is_admin, card_brand,
+        card_type, min_balance, max_balance): (total, [(username, account), ...])."""
+        if "currency" in filters:
+            filters["currency"] = filters["currency"].upper()
+        return self.store.search(filters, offset, limit)
 
     # --- Admin authentication ---
     def login_admin(self):
@@ -111,8 +410,112 @@ class Admin:
         return False
 
 
+# --- Search screen (shared with the panel in main.py) ---
+def read_search_filters():
+    filters = {}
+    currency = input("Currency (blank for any): ").strip().upper()
+    if currency:
+        filters["currency"] = currency
+    for field, prompt in (("activated", "Activated"), ("is_admin", "Admin")):
+        answer = input(f"{prompt}? (y/n, blank for any): ").strip().lower()
+        if answer in ("y", "n"):
+            filters[field] = answer == "y"
+    brand = input("Card brand (e.g. VISA, blank for any): ").strip().upper()
+    if brand:
+        filters["card_brand"] = brand
+    kind = input("Card type (DEBIT/CREDIT, blank for any): ").strip().upper()
+    if kind:
+        filters["card_type"] = kind
+    for field, prompt in (("min_balance", "Minimum balance"), ("max_balance", "Maximum balance")):
+        value = input(f"{prompt} (blank for none): ").strip()
+        if value:
+            filters[field] = float(value)
+    return filters
+
+
+def search_screen(admin, page_size=20):
+    try:
+        filters = read_search_filters()
+    except ValueError:
+        print("Invalid balance")
+        input("Press Enter to continue...")
+        return
+    offset = 0
+    while True:
+        clear_terminal()
+        total, page = admin.search_accounts(offset, page_size, **filters)
+        if not total:
+            print("No matching accounts")
+            input("Press Enter to continue...")
+            return
+        print(f"Accounts {offset + 1}-{offset + len(page)} of {total}\n")
+        for key, acct in page:
+            card = acct.get("card") or {}
+            status = "active" if acct.get("activated", True) else "inactive"
+            admin_flag = " admin" if acct.get("is_admin") else ""
+            print(f"{key:<20} {acct.get('balance', 0):>14.2f} {acct.get('currency', 'USD')}  {status}{admin_flag}  {card.get('card') or ''} {card.get('type') or ''}")
+        action = input("\n[n]ext, [p]revious, [q]uit: ").strip().lower()
+        if action == "n" and offset + page_size < total:
+            offset += page_size
+        elif action == "p":
+            offset = max(0, offset - page_size)
+        elif action == "q":
+            return
+
+
+def print_progress(stage, done, total):
+    print(f"\r{stage.capitalize()}: {done}/{total}", end="\n" if done == total else "", flush=True)
+
+
+def read_bulk_selection():
+    """Ask for usernames (comma separated or @file with one per line) or filters; returns (usernames, predicate)."""
+    how = input("Select accounts by (1) usernames or (2) filters: ").strip()
+    if how == "1":
+        names = input("Usernames (comma separated, or @file): ").strip()
+        if names.startswith("@"):
+            with open(names[1:], "r") as f:
+                return [line for line in f], None
+        return names.split(","), None
+    filters = read_search_filters()
+    has_card = input("Has a card? (y/n, blank for any): ").strip().lower()
+    return None, filter_predicate(filters, has_card == "y" if has_card in ("y", "n") else None)
+
+
+def bulk_screen(admin):
+    print("Bulk action: 1. Activate  2. Deactivate  3. Delete  4. Change Details")
+    action = {"1": "activate", "2": "deactivate", "3": "delete", "4": "change"}.get(input("> ").strip())
+    if action is None:
+        print("Unknown option")
+        input("Press Enter to continue...")
+        return
+    fields = None
+    if action == "change":
+        field = input("Field to change (password, currency, balance): ").strip()
+        value = input("New value: ").strip()
+        try:
+            fields = {field: float(value) if field == "balance" else value}
+        except ValueError:
+            print("Invalid balance")
+            input("Press Enter to continue...")
+            return
+    try:
+        usernames, predicate = read_bulk_selection()
+    except (OSError, ValueError) as e:
+        print(f"Invalid selection: {e}")
+        input("Press Enter to continue...")
+        return
+
+    success, msg = admin.bulk_operation(action, usernames, predicate, fields, dry_run=True, progress=print_progress)
+    print(msg)
+    if success and input("Apply? (y/n): ").strip().lower() == "y":
+        success, msg = admin.bulk_operation(action, usernames, predicate, fields, progress=print_progress)
+        print(msg)
+    input("Press Enter to continue...")
+
+
 # --- GUI for Admin (only runs if this file is executed) ---
 def admin_gui():
+    instrumentation.start_profiling()
     admin = Admin(db_dir=DB_DIR)
     if not admin.login_admin():
         return  # exit if login fails
@@ -121,7 +524,8 @@ def admin_gui():
     while running:
         clear_terminal()
         print("#######################\n# ADMIN CONTROL PANEL #\n#######################")
-        print("\n1. Create Account\n2. Delete Account\n3. Activate Account\n4. Deactivate Account" "\n5. Change Account Details\n0. Exit\n")
+        print("\n1. Create Account\n2. Delete Account\n3. Activate Account\n4. Deactivate Account"
+              "\n5. Change Account Details\n6. Instrumentation Stats\n7. Search Accounts\n8. Bulk Operations\n0. Exit\n")
         try:
             choice = int(input("> "))
         except ValueError:
@@ -170,6 +574,20 @@ def admin_gui():
             print(msg)
             input("Press Enter to continue...")
 
+        elif choice == 6:
+            print(instrumentation.format_stats(admin.store))
+            path = input("\nExport to JSON file (blank to skip): ").strip()
+            if path:
+                instrumentation.export(path, admin.store)
+                print(f"Stats written to {path}")
+            input("Press Enter to continue...")
+
+        elif choice == 7:
+            search_screen(admin)
+
+        elif choice == 8:
+            bulk_screen(admin)
+
         elif choice == 0:
             print("Exiting Admin Panel...")
             running = False
@@ -178,6 +596,60 @@ def admin_gui():
             print("Unknown option")
             input("Press Enter to continue...")
 
+    admin.store.close()
+
+
+# --- Command line (no command opens the control panel) ---
+def import_main(args):
+    admin = Admin(db_dir=args.db_dir)
+    currencies = CurrencyConverter(db_path=str(args.db_dir / "currency.db")).codes
+    rejects = open(args.rejects, "w", newline="") if args.rejects else None
+    shown = []
+
+    def on_reject(lineno, key, reason):
+        if rejects is not None:
+            rejects.write(f"{lineno},{key},{reason}\n")
+        elif len(shown) < 20:
+            shown.append(f"  line {lineno} ({key or '?'}): {reason}")
+
+    try:
+        with open(args.file, "r", newline="") as f:
+            success, msg = import_accounts(admin.store, f, file_format(args.file, args.format), currencies, args.dry_run, args.workers, on_reject)
+    finally:
+        if rejects is not None:
+            rejects.close()
+    print("\n".join(shown + [msg]))
+    admin.store.close()
+    return 0 if success else 1
+
+
+def export_main(args):
+    admin = Admin(db_dir=args.db_dir)
+    fmt = file_format(args.file if args.file != "-" else "", args.format)
+    out = sys.stdout if args.file == "-" else open(args.file, "w", newline="")
+    with out:
+        count = export_accounts(admin.store, out, fmt)
+    print(f"{count} accounts exported", file=sys.stderr)
+    admin.store.close()
+    return 0
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Admin control panel; give a command to run it without the menu")
+    parser.add_argument("--db-dir", type=Path, default=DB_DIR)
+    commands = parser.add_subparsers(dest="command")
+    p = commands.add_parser("import", help="create accounts from a CSV or JSONL file in one commit")
+    p.add_argument("file")
+    p.add_argument("--format", choices=("csv", "jsonl"), help="default: from the file extension")
+    p.add_argument("--dry-run", action="store_true", help="validate and report without writing")
+    p.add_argument("--workers", type=int, help="validation processes (default: all cores)")
+    p.add_argument("--rejects", metavar="FILE", help="write rejected rows (line,username,reason) here")
+    p = commands.add_parser("export", help="stream every account to a CSV or JSONL file")
+    p.add_argument("file", help="'-' for stdout")
+    p.add_argument("--format", choices=("csv", "jsonl"), help="default: from the file extension")
+    args = parser.parse_args()
+    if args.command == "import":
+        sys.exit(import_main(args))
+    elif args.command == "export":
+        sys.exit(export_main(args))
     admin_gui()
@@ -0,0 +1,543 @@
+"""Incremental, consistent backups of the db/ directory, with point-in-time restore.
+
+    python backup.py create [--db-dir ../db] [--repo ../backups]
+    python backup.py list [--repo ../backups]
+    python backup.py restore (ID | --at TIME) DEST [--repo ../backups]
+    python backup.py verify [ID] [--repo ../backups]
+
+A backup is a manifest (repo/backups/<id>.json) listing every file under db/ as
+content-addressed chunks: the sha256 of each chunk, which is stored zlib-compressed in a
+pack file (repo/packs/<id>.pack, indexed by <id>.idx) only the first time any backup
+contains it. Every backup is a complete restore point, but only stores what changed:
+  - files whose inode, size and mtime are unchanged are not read at all;
+  - append-only files (the ledger, rate history, event log, database.db.log) only have
+    their new tail read;
+  - account files (database.db, shard files) are stored as buckets of about
+    BUCKET_ACCOUNTS accounts picked by crc32 of the username, so changing a few accounts
+    stores a few buckets, whatever the file format and however its bytes shifted;
+  - everything else is cut into CHUNK_BYTES chunks.
+
+An account file is not read at all when its journal (<file>.changes, appended by
+every store write, see storage.write_database) covers what changed since the last
+backup: the accounts named there are laid over the buckets that hold them and only
+those buckets are stored again, so the time taken follows the accounts changed, not
+the accounts held. The journal covers a file when its entries chain from the file's
+signature at the last backup to the one at this cut; otherwise (a replace_all, a
+snapshot.py conversion, a write touching over half the book, a rotated journal) the
+file is read and re-bucketed whole, as it is the first time. Creating or deleting
+accounts also re-reads the stored list of usernames, to keep their order.
+
+The snapshot is cut with every account stripe (accounts.lock) and every file lock under
+db/ held, which waits for operations in flight and holds new ones back only while the
+files are opened. Files are replaced by rename or appended to, so reading the opened
+files afterwards (append-only ones up to their size at the cut) sees exactly the cut;
+the one file updated in place, the ledger's index, is read while the locks are held.
+Balances, ledger and event log in a backup therefore agree with each other. Writes still
+in a process's write-back cache are not on disk, so not in the backup either.
+
+Restore writes a backup into a new directory: accounts in their original order and
+format, every other file byte for byte.
+"""
+from contextlib import ExitStack
+from fnmatch import fnmatch
+from io import BytesIO
+from pathlib import Path
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import struct
+import sys
+import tempfile
+import time
+import zlib
+import snapshot
+from locks import FileLock, open_locks
+from rate_history import to_timestamp
+from storage import read_database_file, write_atomic, write_database, write_json_atomic
+
+BASE_DIR = Path(__file__).resolve().parent
+DB_DIR = BASE_DIR.parent / "db"
+REPO_DIR = BASE_DIR.parent / "backups"
+CHUNK_BYTES = 256 << 10
+BUCKET_ACCOUNTS = 64
+# re-read this much before the old end of an append-only file: writers may truncate a
+# torn record or line there
+APPEND_GUARD = 64 << 10
+# a signature is only trusted for files older than this at the previous cut, since
+# coarse mtimes could otherwise hide a rewrite that got the old inode back
+SIG_SLACK_NS = 2_000_000_000
+ACCOUNT_FILES = ("database.db", "shards/shard-*.db")
+APPEND_ONLY = ("database.db.log", "ledger/ledger.bin", "ledger/accounts.txt", "ledger/currencies.txt", "rates_history/timestamps.bin", "rates_history/rates*.bin", "events/events-*.log")
+IN_PLACE = ("ledger/heads.bin",)
+SKIP = ("*.lock", "*.tmp", "*-wal", "*-shm", "*-journal")
+JOURNAL = ".changes"  # <account file>.changes, read instead of the file but not stored
+INDEX = struct.Struct("<32sQI")
+
+
+def _matches(rel, patterns):
+    return any(fnmatch(rel, pattern) for pattern in patterns)
+
+
+def _signature(f):
+    st = os.fstat(f.fileno())
+    return [st.st_ino, st.st_size, st.st_mtime_ns]
+
+
+def _as_signature(sig):
+    # storage.file_signature order (inode, mtime, size) to ours
+    return [sig[0], sig[2], sig[1]] if sig is not None else None
+
+
+class Repository:
+    """Backup manifests plus the packs holding their chunks."""
+
+    def __init__(self, path=REPO_DIR):
+        self.path = Path(path)
+        (self.path / "packs").mkdir(parents=True, exist_ok=True)
+        (self.path / "backups").mkdir(exist_ok=True)
+        self.index = {}  # digest -> (pack, offset, length)
+        for idx in sorted((self.path / "packs").glob("*.idx")):
+            for digest, offset, length in INDEX.iter_unpack(idx.read_bytes()):
+                self.index.setdefault(digest, (idx.stem, offset, length))
+        self._pack = None
+        self._packs = {}
+        self.stored = 0
+
+    def backups(self):
+        return sorted(p.stem for p in (self.path / "backups").glob("*.json"))
+
+    def manifest(self, backup_id):
+        with open(self.path / "backups" / f"{backup_id}.json", "r") as f:
+            return json.load(f)
+
+    def find(self, at):
+        """The last backup taken at or before `at` (datetime, ISO string or epoch seconds)."""
+        when = to_timestamp(at)
+        found = [b for b in self.backups() if to_timestamp(self.manifest(b)["time"]) <= when]
+        if not found:
+            raise ValueError(f"No backup at or before {at}")
+        return found[-1]
+
+    # --- chunks ---
+    def put(self, data):
+        """Store a chunk unless some backup already has it; returns its digest."""
+        digest = hashlib.sha256(data).digest()
+        if digest not in self.index:
+            blob = zlib.compress(data)
+            offset = self._pack.tell()
+            self._pack.write(blob)
+            self.index[digest] = (self._pack_id, offset, len(blob))
+            self._new.append(INDEX.pack(digest, offset, len(blob)))
+            self.stored += len(blob)
+        return digest
+
+    def get(self, digest):
+        pack, offset, length = self.index[digest]
+        f = self._packs.get(pack)
+        if f is None:
+            f = self._packs[pack] = open(self.path / "packs" / f"{pack}.pack", "rb")
+        f.seek(offset)
+        return zlib.decompress(f.read(length))
+
+    def put_blob(self, data):
+        return [self.put(data[i : i + CHUNK_BYTES]).hex() for i in range(0, len(data), CHUNK_BYTES)]
+
+    def get_blob(self, chunks):
+        return b"".join(self.get(bytes.fromhex(digest)) for digest in chunks)
+
+    # --- writing a backup ---
+    def begin(self, backup_id):
+        self._pack_id = backup_id
+        self._pack = open(self.path / "packs" / f"{backup_id}.pack", "wb")
+        self._new = []
+        self.stored = 0
+
+    def commit(self, manifest):
+        # pack, then its index, then the manifest: a backup exists once its manifest does
+        self._pack.flush()
+        os.fsync(self._pack.fileno())
+        self._pack.close()
+        self._pack = None
+        write_atomic(self.path / "packs" / f"{self._pack_id}.idx", lambda f: f.write(b"".join(self._new)), binary=True)
+        write_json_atomic(self.path / "backups" / f"{manifest['id']}.json", manifest, indent=None)
+
+    def abort(self):
+        if self._pack is not None:
+            self._pack.close()
+            self._pack = None
+            (self.path / "packs" / f"{self._pack_id}.pack").unlink(missing_ok=True)
+            for digest in self._new:
+                self.index.pop(INDEX.unpack(digest)[0], None)
+
+    def close(self):
+        for f in self._packs.values():
+            f.close()
+        self._packs.clear()
+
+
+# --- the cut ---
+def _sqlite_copy(path):
+    # SQLite changes its file in place (and in -wal); its backup API gives a consistent copy
+    tmp = tempfile.TemporaryFile()
+    with tempfile.NamedTemporaryFile(suffix=".sqlite") as copy:
+        src, dst = sqlite3.connect(path), sqlite3.connect(copy.name)
+        try:
+            src.backup(dst)
+        finally:
+            src.close()
+            dst.close()
+        with open(copy.name, "rb") as f:
+            while block := f.read(CHUNK_BYTES):
+                tmp.write(block)
+    tmp.seek(0)
+    return tmp
+
+
+def cut(db_dir):
+    """{relative path: (signature, open file)} for every file under db_dir, opened with
+    all the locks held (see the module docstring)."""
+    db_dir = Path(db_dir)
+    opened = {}
+    with ExitStack() as held:
+        held.enter_context(open_locks(db_dir / "accounts.lock").hold_all())
+        # stores publish events while holding their own lock, so the event log's comes last
+        for lock in sorted(db_dir.rglob("*.lock"), key=lambda lock: (lock.parent.name == "events", lock)):
+            if lock.name != "accounts.lock":
+                held.enter_context(FileLock(lock))
+        for path in sorted(p for p in db_dir.rglob("*") if p.is_file()):
+            rel = path.relative_to(db_dir).as_posix()
+            if _matches(rel, SKIP):
+                continue
+            if rel.endswith(".sqlite"):
+                f = _sqlite_copy(path)
+                opened[rel] = (None, f)  # never trusted: pages change in place
+                continue
+            f = open(path, "rb")
+            sig = _signature(f)
+            if _matches(rel, IN_PLACE):
+                with f:
+                    f = BytesIO(f.read())
+            opened[rel] = (sig, f)
+    return opened
+
+
+# --- storing files ---
+def _chunks(repo, f, size, start=0):
+    f.seek(start)
+    chunks = []
+    while start < size:
+        data = f.read(min(CHUNK_BYTES, size - start))
+        if not data:
+            break
+        chunks.append(repo.put(data).hex())
+        start += len(data)
+    return chunks
+
+
+def _store_file(repo, f, sig):
+    size = sig[1] if sig is not None else f.seek(0, os.SEEK_END)
+    return {"kind": "file", "sig": sig, "size": size, "chunks": _chunks(repo, f, size)}
+
+
+def _store_appended(repo, f, sig, prev):
+    # the chunks wholly before the guard are still what they were
+    keep = max(prev["size"] - APPEND_GUARD, 0) // CHUNK_BYTES
+    return {"kind": "file", "sig": sig, "size": sig[1], "chunks": prev["chunks"][:keep] + _chunks(repo, f, sig[1], keep * CHUNK_BYTES)}
+
+
+def _bucket_count(accounts, prev):
+    if prev is not None and prev["kind"] == "accounts":
+        # keep the old buckets unless the book grew or shrank a lot: same buckets, same chunks
+        n = prev["buckets_count"]
+        if n * BUCKET_ACCOUNTS // 4 <= accounts <= n * BUCKET_ACCOUNTS * 4:
+            return n
+    n = 1
+    while n * BUCKET_ACCOUNTS < accounts:
+        n *= 2
+    return n
+
+
+def _store_accounts(repo, f, sig, prev):
+    # the whole file, when its journal does not cover the change (see the module docstring)
+    binary = f.read(len(snapshot.MAGIC)) == snapshot.MAGIC
+    f.seek(0)
+    data = read_database_file(f)
+    n = _bucket_count(len(data), prev)
+    buckets = [[] for _ in range(n)]
+    for key in data:
+        buckets[zlib.crc32(key.encode()) % n].append(key)
+    digests = b"".join(repo.put(json.dumps({key: data[key] for key in sorted(bucket)}, separators=(",", ":")).encode()) for bucket in buckets)
+    order = "\0".join(data).encode()
+    return {
+        "kind": "accounts",
+        "sig": sig,
+        "format": "binary" if binary else "json",
+        "count": len(data),
+        "buckets_count": n,
+        "buckets": repo.put_blob(digests),
+        "order": repo.put_blob(order),
+        "order_crc": zlib.crc32(order),
+    }
+
+
+def _journal_position(journal):
+    """[journal id, size at the cut] of an opened journal, or None."""
+    if journal is None:
+        return None
+    sig, f = journal
+    f.seek(0)
+    try:
+        return [json.loads(f.readline())["journal"], sig[1]]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def _replay_journal(prev, sig, journal):
+    """({key: account or None}, keys deleted and created again, crc32 of the username
+    order) changed since prev, in file order, or None if the journal does not cover
+    every write since (see above)."""
+    position = _journal_position(journal)
+    if prev is None or prev["kind"] != "accounts" or position is None or prev.get("journal") is None:
+        return None
+    journal_id, offset = prev["journal"]
+    if position[0] != journal_id or position[1] < offset:
+        return None
+    f = journal[1]
+    f.seek(offset)
+    expected = prev["sig"]
+    order = prev.get("order_crc")
+    changes = {}
+    moved = set()
+    try:
+        for line in f.read(position[1] - offset).splitlines():
+            entry = json.loads(line)
+            if _as_signature(entry["before"]) != expected:
+                return None
+            expected = _as_signature(entry["after"])
+            order = entry["order"]
+            for key, acct in entry["accounts"].items():
+                if acct is None or changes.get(key, 0) is None:
+                    # deleted, or created again: it moves to the end of the file
+                    if acct is not None:
+                        moved.add(key)
+                    changes.pop(key, None)
+                changes[key] = acct
+    except (ValueError, KeyError, TypeError):
+        return None
+    return (changes, moved, order) if expected == sig else None
+
+
+def _store_changes(repo, sig, prev, changes, moved, order_crc):
+    # only the buckets holding changed accounts are read back and stored again
+    n = prev["buckets_count"]
+    table = repo.get_blob(prev["buckets"])
+    digests = [table[i : i + 32] for i in range(0, len(table), 32)]
+    by_bucket = {}
+    for key in changes:
+        by_bucket.setdefault(zlib.crc32(key.encode()) % n, []).append(key)
+    new, gone = set(), set()
+    for i, keys in by_bucket.items():
+        bucket = json.loads(repo.get(digests[i]))
+        for key in keys:
+            if changes[key] is None:
+                if bucket.pop(key, None) is not None:
+                    gone.add(key)
+            else:
+                if key not in bucket:
+                    new.add(key)
+                bucket[key] = changes[key]
+        digests[i] = repo.put(json.dumps({key: bucket[key] for key in sorted(bucket)}, separators=(",", ":")).encode())
+    count = prev["count"] + len(new) - len(gone)
+    if _bucket_count(count, prev) != n:
+        return None
+    order = prev["order"]
+    if order_crc != prev.get("order_crc"):
+        # new accounts go to the end of the file, and so do deleted ones created again
+        keys = repo.get_blob(order).decode().split("\0") if prev["count"] else []
+        keys = [key for key in keys if key not in gone and key not in moved]
+        keys += [key for key, acct in changes.items() if acct is not None and (key in new or key in moved)]
+        blob = "\0".join(keys).encode()
+        if zlib.crc32(blob) != order_crc:
+            # one write deleted and re-created an account, say: only the file knows where
+            return None
+        order = repo.put_blob(blob)
+    return {
+        "kind": "accounts",
+        "sig": sig,
+        "format": prev["format"],
+        "count": count,
+        "buckets_count": n,
+        "buckets": repo.put_blob(b"".join(digests)),
+        "order": order,
+        "order_crc": order_crc,
+    }
+
+
+def _unchanged(entry, sig, cut_ns):
+    return entry is not None and sig is not None and entry["sig"] == sig and sig[2] < cut_ns - SIG_SLACK_NS
+
+
+def create_backup(db_dir=DB_DIR, repo=REPO_DIR):
+    """Back db_dir up into repo; returns the new manifest."""
+    repo = repo if isinstance(repo, Repository) else Repository(repo)
+    backups = repo.backups()
+    previous = repo.manifest(backups[-1]) if backups else {"files": {}, "cut_ns": 0}
+    now = datetime.datetime.now(datetime.timezone.utc)
+    backup_id = now.strftime("%Y%m%dT%H%M%S%fZ")
+    start = time.perf_counter()
+    cut_ns = time.time_ns()
+    opened = cut(db_dir)
+    journals = {rel[: -len(JOURNAL)]: opened.pop(rel) for rel in list(opened) if rel.endswith(JOURNAL)}
+    files = {}
+    read = replayed = 0
+    repo.begin(backup_id)
+    try:
+        for rel, (sig, f) in opened.items():
+            with f:
+                prev = previous["files"].get(rel)
+                if _unchanged(prev, sig, previous["cut_ns"]):
+                    files[rel] = prev
+                elif _matches(rel, ACCOUNT_FILES):
+                    journal = journals.get(rel)
+                    replay = _replay_journal(prev, sig, journal)
+                    entry = _store_changes(repo, sig, prev, *replay) if replay is not None else None
+                    if entry is None:
+                        entry = _store_accounts(repo, f, sig, prev)
+                        read += entry["count"]
+                    else:
+                        replayed += len(replay[0])
+                    entry["journal"] = _journal_position(journal)
+                    files[rel] = entry
+                elif (
+                    _matches(rel, APPEND_ONLY) and prev is not None and prev["sig"][0] == sig[0] and sig[1] >= prev["size"]
+                    # compaction rewrites database.db and empties its log in place
+                    and (rel != "database.db.log" or files.get("database.db") is previous["files"].get("database.db"))
+                ):
+                    files[rel] = _store_appended(repo, f, sig, prev)
+                else:
+                    files[rel] = _store_file(repo, f, sig)
+        manifest = {
+            "id": backup_id,
+            "time": now.isoformat(),
+            "cut_ns": cut_ns,
+            "files": files,
+            "size": sum(entry.get("size", 0) for entry in files.values()),
+            "accounts": sum(entry.get("count", 0) for entry in files.values()),
+            "accounts_read": read,
+            "accounts_replayed": replayed,
+            "stored": repo.stored,
+            "seconds": time.perf_counter() - start,
+        }
+        repo.commit(manifest)
+    except BaseException:
+        repo.abort()
+        raise
+    finally:
+        for _, f in journals.values():
+            f.close()
+    return manifest
+
+
+def restore_backup(backup_id, dest, repo=REPO_DIR):
+    """Write backup `backup_id` into the new (or empty) directory dest; returns the file count."""
+    repo = repo if isinstance(repo, Repository) else Repository(repo)
+    dest = Path(dest)
+    if dest.exists() and any(dest.iterdir()):
+        raise ValueError(f"{dest} is not empty")
+    manifest = repo.manifest(backup_id)
+    for rel, entry in manifest["files"].items():
+        path = dest / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if entry["kind"] == "accounts":
+            table = repo.get_blob(entry["buckets"])
+            data = {}
+            for i in range(0, len(table), 32):
+                data.update(json.loads(repo.get(table[i : i + 32])))
+            order = repo.get_blob(entry["order"]).decode().split("\0") if entry["count"] else []
+            write_database(path, {key: data[key] for key in order}, entry["format"])
+        else:
+            with open(path, "wb") as f:
+                for digest in entry["chunks"]:
+                    f.write(repo.get(bytes.fromhex(digest)))
+    repo.close()
+    return len(manifest["files"])
+
+
+def verify_backup(backup_id, repo=REPO_DIR):
+    """Re-hash every chunk backup_id needs; returns the list of problems (empty if none)."""
+    repo = repo if isinstance(repo, Repository) else Repository(repo)
+    problems = []
+
+    def check(digest):
+        try:
+            if hashlib.sha256(repo.get(digest)).digest() != digest:
+                problems.append(f"chunk {digest.hex()} is corrupt")
+                return False
+        except (KeyError, OSError, zlib.error) as e:
+            problems.append(f"chunk {digest.hex()} is unreadable: {e!r}")
+            return False
+        return True
+
+    for rel, entry in repo.manifest(backup_id)["files"].items():
+        if entry["kind"] == "accounts":
+            lists = [bytes.fromhex(d) for d in entry["buckets"] + entry["order"]]
+            if all(map(check, lists[: len(entry["buckets"])])):
+                table = repo.get_blob(entry["buckets"])
+                for i in range(0, len(table), 32):
+                    check(table[i : i + 32])
+            for digest in lists[len(entry["buckets"]) :]:
+                check(digest)
+        else:
+            for digest in entry["chunks"]:
+                check(bytes.fromhex(digest))
+    repo.close()
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incremental backups of the db/ directory and point-in-time restore.")
+    parser.add_argument("--repo", type=Path, default=REPO_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("create", help="take a backup")
+    create.add_argument("--db-dir", type=Path, default=DB_DIR)
+    commands.add_parser("list", help="list backups, oldest first")
+    restore = commands.add_parser("restore", help="write a backup to a new directory")
+    restore.add_argument("backup", nargs="?", help="backup id (default: see --at, else the latest)")
+    restore.add_argument("dest", type=Path)
+    restore.add_argument("--at", help="the last backup taken at or before this ISO date/time")
+    verify = commands.add_parser("verify", help="check every chunk of a backup")
+    verify.add_argument("backup", nargs="?", help="backup id (default: the latest)")
+    args = parser.parse_args()
+
+    repo = Repository(args.repo)
+    if args.command == "create":
+        manifest = create_backup(args.db_dir, repo)
+        print(f"Backup {manifest['id']}: {len(manifest['files'])} files, {manifest['accounts']} accounts, {manifest['stored']} new bytes stored in {manifest['seconds']:.2f}s")
+    elif args.command == "list":
+        for backup_id in repo.backups():
+            m = repo.manifest(backup_id)
+            print(f"{backup_id}  {m['time']}  {m['accounts']:>10} accounts  {m['size']:>14} bytes  {m['stored']:>12} new")
+    else:
+        backups = repo.backups()
+        try:
+            if args.command == "restore" and args.at:
+                backup_id = repo.find(args.at)
+            elif args.backup or backups:
+                backup_id = args.backup or backups[-1]
+            else:
+                raise ValueError("No backups yet")
+            if args.command == "restore":
+                count = restore_backup(backup_id, args.dest, repo)
+                print(f"Restored {backup_id} ({count} files) to {args.dest}")
+            else:
+                problems = verify_backup(backup_id, repo)
+                for problem in problems:
+                    print(problem, file=sys.stderr)
+                print(f"{backup_id}: {'OK' if not problems else f'{len(problems)} problems'}")
+                sys.exit(1 if problems else 0)
+        except (ValueError, FileNotFoundError) as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
@@ -0,0 +1,58 @@
+from collections import Counter
+from pathlib import Path
+import argparse
+import csv
+import json
+import time
+from features import Features
+
+BASE_DIR = Path(__file__).resolve().parent
+DB_DIR = BASE_DIR.parent / "db"
+
+
+def read_transactions(path):
+    """Stream rows from a .csv (account,op,amount or src,dst,amount header) or .jsonl file."""
+    path = Path(path)
+    with open(path, "r", newline="") as f:
+        if path.suffix.lower() == ".csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply a file of deposits/withdrawals (or, with --transfers, transfers) in one pass.")
+    parser.add_argument("transactions", type=Path, help="CSV or JSONL file of {account, op, amount} rows")
+    parser.add_argument("--transfers", action="store_true", help="rows are {src, dst, amount} transfers (committed in chunks)")
+    parser.add_argument("--db-dir", type=Path, default=DB_DIR)
+    parser.add_argument("--rejects", type=Path, help="where to write rejected rows (default: <input>.rejects.jsonl)")
+    parser.add_argument("--limits", action="store_true", help="count withdrawals and transfers against the velocity limits (off for trusted replay)")
+    args = parser.parse_args()
+
+    rejects_path = args.rejects or args.transactions.with_name(args.transactions.name + ".rejects.jsonl")
+    features = Features(db_dir=args.db_dir)
+    reasons = Counter()
+    start = time.perf_counter()
+    with open(rejects_path, "w") as rejects:
+
+        def on_reject(tx, reason):
+            reasons[reason] += 1
+            rejects.write(json.dumps({**tx, "reason": reason}) + "\n")
+
+        apply = features.apply_transfers if args.transfers else features.apply_batch
+        applied, rejected = apply(read_transactions(args.transactions), on_reject, limits=args.limits)
+    elapsed = time.perf_counter() - start
+    features.store.close()
+
+    total = applied + rejected
+    print(f"Applied {applied}, rejected {rejected} (see {rejects_path})")
+    for reason, count in reasons.most_common():
+        print(f"  {count} x {reason}")
+    print(f"{total} transactions in {elapsed:.2f}s ({total / elapsed if elapsed else 0:.0f} tx/sec)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Nightly accrual over N accounts: the vectorized job vs. a per-account Python loop.
+
+Run from the code/ directory:
+    python -m benchmarks.accrual --accounts 1000000
+
+The accounts sit in a CachedStore over a binary-snapshot database.db in a temp db/ and
+are loaded before timing starts. The scalar loop does what a Features-based job would:
+CurrencyConverter.convert and accounts.to_minor once per account. Commit time (one
+update_many, one ledger append) is reported separately.
+"""
+import argparse
+import math
+import tempfile
+import time
+from pathlib import Path
+
+import accrual
+from accounts import exponent, from_minor, to_minor
+from benchmarks.synth import make_db_dir
+from currency_exchange import CurrencyConverter
+from ledger import Ledger
+from storage import CachedStore, write_database
+
+
+def scalar_accrual(store, converter, schedule, days=1):
+    """The same accrual with one convert() per account and no NumPy (dry run)."""
+    updates = {}
+    for key, acct in store.items():
+        if not acct.get("activated", True) or acct.get("is_admin", False):
+            continue
+        cur = acct.get("currency", "USD")
+        entry = schedule.get(cur, schedule["*"])
+        factor = 1.0 if cur in schedule else converter.convert(1.0, converter.base, cur)
+        balance = to_minor(acct.get("balance", 0), cur)
+        scale = 10 ** exponent(cur)
+        tiers = sorted(entry["tiers"])
+        interest = 0.0
+        for level, (start, rate) in enumerate(tiers):
+            end = tiers[level + 1][0] * factor * scale if level + 1 < len(tiers) else math.inf
+            interest += max(0.0, min(balance, end) - start * factor * scale) * rate
+        interest = math.floor(interest * days / 365)
+        fee = math.floor(entry.get("fee", 0) * factor * scale + 0.5) * days if balance < entry.get("fee_waived_from", math.inf) * factor * scale else 0
+        fee = min(fee, max(balance + interest, 0))
+        if interest or fee:
+            updates[key] = {"balance": from_minor(balance + interest - fee, cur)}
+    return updates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, default=200_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        accounts = make_db_dir(tmp, args.accounts)
+        write_database(Path(tmp) / "database.db", accounts, "binary")
+        del accounts
+        store = CachedStore(Path(tmp) / "database.db")
+        converter = CurrencyConverter(db_path=str(Path(tmp) / "currency.db"))
+        start = time.perf_counter()
+        store.all()
+        print(f"{args.accounts} accounts loaded in {time.perf_counter() - start:.2f}s")
+
+        start = time.perf_counter()
+        updates = scalar_accrual(store, converter, accrual.DEFAULT_SCHEDULE)
+        scalar = time.perf_counter() - start
+        print(f"scalar loop (dry run)      {scalar:8.2f}s   {len(updates)} balances changed")
+
+        start = time.perf_counter()
+        accrual.accrue(store, converter, accrual.DEFAULT_SCHEDULE, dry_run=True)
+        vector = time.perf_counter() - start
+        print(f"vectorized (dry run)       {vector:8.2f}s   ({scalar / vector:.1f}x)")
+
+        ledger = Ledger(Path(tmp) / "ledger")
+        start = time.perf_counter()
+        accrual.accrue(store, converter, accrual.DEFAULT_SCHEDULE, ledger=ledger)
+        print(f"vectorized + commit        {time.perf_counter() - start:8.2f}s   (update_many + ledger)")
+        ledger.close()
+
+
+if __name__ == "__main__":
+    main()
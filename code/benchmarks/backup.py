@@ -0,0 +1,97 @@
+"""Incremental backups: time and size of a full backup, of backups after a few changes,
+and of restoring them.
+
+Run from the code/ directory:
+    python -m benchmarks.backup --accounts 1000000 --changes 1000 --rounds 3 --storage wal
+
+A db/ directory of --accounts accounts gets a full backup, then --rounds times: --changes
+deposits (balances, ledger and event log all change) and another backup. The cost of
+each is set against copying the whole directory, with how many accounts it read from
+account files and how many it replayed from their journals. Every backup is then
+restored and its accounts and ledger must equal the live ones at the time it was taken.
+"""
+import argparse
+import random
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from backup import Repository, create_backup, restore_backup
+from benchmarks.synth import make_db_dir
+from features import Features
+from ledger import Ledger
+from storage import ShardedStore, SqliteStore, open_store, write_database
+
+
+def deposit(db_dir, storage, keys, n, seed):
+    store = open_store(db_dir, storage)
+    features = Features(db_dir=db_dir, store=store)
+    rng = random.Random(seed)
+    for _ in range(n):
+        features.deposit_amount(rng.choice(keys), 1.0)
+    store.close()
+
+
+def live_state(db_dir, storage):
+    store = open_store(db_dir, storage)
+    accounts = store.all()
+    store.close()
+    ledger = Ledger(Path(db_dir) / "ledger")
+    return accounts, len(ledger)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, default=100_000)
+    parser.add_argument("--changes", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--storage", default="wal", help="json, wal, cached, compact, sharded or sqlite")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_dir = Path(tmp) / "db"
+        accounts = make_db_dir(db_dir, args.accounts)
+        write_database(db_dir / "database.db", accounts, "binary")
+        if args.storage == "sqlite":
+            SqliteStore(db_dir / "database.sqlite").replace_all(accounts)
+        elif args.storage == "sharded":
+            ShardedStore(db_dir / "shards").replace_all(accounts)
+        keys = sorted(accounts)
+        deposit(db_dir, args.storage, keys, args.changes, 0)
+        repo = Repository(Path(tmp) / "backups")
+
+        start = time.perf_counter()
+        shutil.copytree(db_dir, Path(tmp) / "copy")
+        copy = time.perf_counter() - start
+        size = sum(p.stat().st_size for p in db_dir.rglob("*") if p.is_file())
+        print(f"copy db/: {copy:.2f}s, {size / 1e6:.1f} MB")
+
+        expected = {}
+        for round in range(args.rounds + 1):
+            if round:
+                deposit(db_dir, args.storage, keys, args.changes, round)
+            # a signature only lets the next backup skip a file that was 2s old at this one
+            time.sleep(2.1)
+            state = live_state(db_dir, args.storage)
+            manifest = create_backup(db_dir, repo)
+            expected[manifest["id"]] = state
+            kind = "full" if not round else f"after {args.changes} deposits"
+            print(f"backup {kind}: {manifest['seconds']:.2f}s, {manifest['stored'] / 1e6:.2f} MB stored, "
+                  f"{manifest['accounts_read']} accounts read, {manifest['accounts_replayed']} replayed")
+        print(f"repository: {sum(p.stat().st_size for p in repo.path.rglob('*') if p.is_file()) / 1e6:.1f} MB for {len(expected)} backups")
+
+        for i, (backup_id, (accounts, records)) in enumerate(expected.items()):
+            dest = Path(tmp) / f"restore-{i}"
+            start = time.perf_counter()
+            restore_backup(backup_id, dest, repo)
+            elapsed = time.perf_counter() - start
+            got, got_records = live_state(dest, args.storage)
+            if got != accounts or got_records != records:
+                raise SystemExit(f"FAILED: restore of {backup_id} differs from the live state at the time ({records} vs {got_records} ledger records)")
+            print(f"restore {backup_id}: {elapsed:.2f}s, {records} ledger records")
+        print("OK: every backup restores to the state it was taken at")
+
+
+if __name__ == "__main__":
+    main()
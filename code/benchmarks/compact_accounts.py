@@ -0,0 +1,83 @@
+"""Memory per account and full-scan speed: plain dicts (CachedStore) vs. Account records (CompactStore).
+
+Run from the code/ directory:  python -m benchmarks.compact_accounts --accounts 100000
+"""
+import argparse
+import gc
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+from benchmarks.synth import make_db_dir
+from storage import CachedStore, CompactStore
+
+
+def memory_per_store(cls, path):
+    gc.collect()
+    tracemalloc.start()
+    store = cls(path)
+    store._accounts()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size
+
+
+def best_of(fn, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def scan_dicts(store):
+    # CachedStore's public scan path is all(), which hands out a copy of every account
+    totals = defaultdict(float)
+    for acct in store.all().values():
+        totals[acct["currency"]] += acct["balance"]
+    return totals
+
+
+def scan_raw_dicts(store):
+    totals = defaultdict(float)
+    for acct in store._accounts().values():
+        totals[acct["currency"]] += acct["balance"]
+    return totals
+
+
+def scan_records(store):
+    totals = defaultdict(int)
+    for _, record in store.records():
+        totals[record.currency] += record.balance_minor
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--accounts", type=int, default=100_000)
+    args = parser.parse_args()
+
+    n = args.accounts
+    print(f"{n} accounts")
+    with tempfile.TemporaryDirectory() as tmp:
+        make_db_dir(tmp, n)
+        path = f"{tmp}/database.db"
+        results = {}
+        for name, cls, scan in (("dicts", CachedStore, scan_dicts), ("compact", CompactStore, scan_records)):
+            size = memory_per_store(cls, path)
+            load = best_of(lambda: cls(path)._accounts(), repeat=1)
+            store = cls(path)
+            store._accounts()
+            results[name] = size, best_of(lambda: scan(store))
+            print(f"  {name:<8} {size / n:8.0f} B/account  load {load:6.2f}s  scan {results[name][1] * 1000:8.1f} ms")
+            if cls is CachedStore:
+                print(f"  {'':<8} {'':>19}  {'':>11}  scan {best_of(lambda: scan_raw_dicts(store)) * 1000:8.1f} ms without copies")
+    (plain_size, plain_scan), (compact_size, compact_scan) = results["dicts"], results["compact"]
+    print(f"  memory saved {1 - compact_size / plain_size:.0%}, scan speedup {plain_scan / compact_scan:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Scalar CurrencyConverter.convert vs. vectorized convert_many.
+
+Run from the code/ directory:  python -m benchmarks.convert_many --n 1000000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from currency_exchange import CurrencyConverter
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--n", type=int, default=1_000_000)
+    parser.add_argument("--scalar-n", type=int, default=200_000, help="conversions timed on the scalar path")
+    args = parser.parse_args()
+
+    conv = CurrencyConverter()
+    rng = np.random.default_rng(0)
+    codes = np.array(conv.codes)
+    amounts = rng.uniform(0, 10_000, args.n)
+    from_codes = codes[rng.integers(len(codes), size=args.n)]
+    to_codes = codes[rng.integers(len(codes), size=args.n)]
+
+    start = time.perf_counter()
+    fast = conv.convert_many(amounts, from_codes, to_codes)
+    vector_time = time.perf_counter() - start
+
+    ids_from, ids_to = conv.currency_ids(from_codes), conv.currency_ids(to_codes)
+    start = time.perf_counter()
+    conv.convert_many(amounts, ids_from, ids_to)
+    id_time = time.perf_counter() - start
+
+    m = min(args.n, args.scalar_n)
+    a, f, t = amounts[:m].tolist(), from_codes[:m].tolist(), to_codes[:m].tolist()
+    start = time.perf_counter()
+    slow = [conv.convert(a[i], f[i], t[i]) for i in range(m)]
+    scalar_time = (time.perf_counter() - start) * args.n / m
+
+    assert np.allclose(fast[:m], slow, rtol=1e-12, atol=1e-9), "convert_many diverges from convert"
+    print(f"scalar convert       {scalar_time:8.3f}s for {args.n} conversions (extrapolated from {m})")
+    print(f"convert_many (codes) {vector_time:8.3f}s  ({scalar_time / vector_time:.0f}x)")
+    print(f"convert_many (ids)   {id_time:8.3f}s  ({scalar_time / id_time:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Learning what changed: tailing the event log vs diffing copies of database.db.
+
+Run from the code/ directory:
+    python -m benchmarks.events --accounts 1000000 --changes 10000
+
+--changes deposits are applied to a database of --accounts accounts through a cached store
+(so each one is captured), timed with capture on and off. A consumer then learns what
+changed in two ways: reading the events after a sequence number, and the old way,
+loading a copy of database.db from before and after and comparing every account. Both
+must find the same changed accounts.
+"""
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.synth import make_db_dir
+from events import EventLog
+from storage import CachedStore, read_database, write_database
+
+
+def apply_changes(store, keys, n, seed):
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    for _ in range(n):
+        key = rng.choice(keys)
+        store.update(key, {"balance": store.get(key)["balance"] + 1})
+    elapsed = time.perf_counter() - start
+    store.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, default=100_000)
+    parser.add_argument("--changes", type=int, default=10_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        accounts = make_db_dir(tmp, args.accounts)
+        write_database(Path(tmp) / "database.db", accounts, "binary")
+        keys = sorted(accounts)
+        database_db = Path(tmp) / "database.db"
+        off = apply_changes(CachedStore(database_db, write_back="exit"), keys, args.changes, 0)
+        before = Path(tmp) / "before.db"
+        write_database(before, read_database(database_db), "binary")
+        log = EventLog(Path(tmp) / "events")
+        since = log.last_seq + 1
+        store = CachedStore(database_db, write_back="exit")
+        store.events = log
+        on = apply_changes(store, keys, args.changes, 1)
+        print(f"{args.changes} updates on {args.accounts} accounts: {off / args.changes * 1e6:.0f} us each without capture, {on / args.changes * 1e6:.0f} us with")
+
+        start = time.perf_counter()
+        changed = {event["account"] for event in log.read(since)}
+        tail = time.perf_counter() - start
+        size = sum(segment.stat().st_size for segment in log.segments())
+        print(f"tail the event log from seq {since}: {tail:.3f}s ({size / 1e6:.1f} MB of events)")
+
+        start = time.perf_counter()
+        old, new = read_database(before), read_database(database_db)
+        diffed = {key for key, acct in new.items() if old.get(key) != acct}
+        full = time.perf_counter() - start
+        print(f"diff two copies of database.db: {full:.3f}s")
+        log.close()
+        if changed != diffed:
+            raise SystemExit(f"FAILED: {len(changed)} accounts changed per the events, {len(diffed)} per the diff")
+        print(f"OK: both find the same {len(changed)} changed accounts; tailing is {full / tail:.0f}x faster")
+
+
+if __name__ == "__main__":
+    main()
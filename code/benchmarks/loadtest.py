@@ -0,0 +1,158 @@
+"""Load test for service.py: requests/sec and latency percentiles under concurrency.
+
+Run from the code/ directory:
+    python -m benchmarks.loadtest --accounts 10000 --clients 64 --duration 10 --writes 0.5
+
+Without --url it builds a synthetic db/ in a temp directory and starts the service on a
+free localhost port; with --url it targets a running service (log in as --username).
+Each client keeps one keep-alive connection and its own session, and loops over
+balance reads and deposit/withdraw writes. Latencies are per request, end to end.
+"""
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from benchmarks.synth import make_db_dir
+from instrumentation import format_cache
+
+CODE_DIR = Path(__file__).resolve().parent.parent
+
+
+class Client:
+    """One keep-alive HTTP/1.1 connection speaking JSON."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.token = None
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        payload = json.dumps(body).encode() if body is not None else b""
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(payload)}\r\n"
+        if self.token:
+            head += f"Authorization: Bearer {self.token}\r\n"
+        self.writer.write((head + "\r\n").encode() + payload)
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode().partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+        return status, json.loads(await self.reader.readexactly(length))
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+
+
+async def run_client(host, port, username, password, deadline, writes, seed, latencies, errors):
+    rng = random.Random(seed)
+    client = Client(host, port)
+    status, result = await client.request("POST", "/login", {"username": username, "password": password})
+    if not result.get("ok"):
+        errors.append(f"{username}: {result.get('message')}")
+        return
+    client.token = result["token"]
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        if rng.random() < writes:
+            op = "/deposit" if rng.random() < 0.5 else "/withdraw"
+            kind = "write"
+            status, result = await client.request("POST", op, {"amount": rng.randrange(1, 5000) / 100})
+        else:
+            kind = "read"
+            status, result = await client.request("GET", "/balance")
+        latencies[kind].append(time.perf_counter() - start)
+        if status != 200:
+            errors.append(f"{status}: {result.get('message')}")
+    await client.close()
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100))] if values else 0.0
+
+
+def start_service(db_dir, window):
+    proc = subprocess.Popen(
+        [sys.executable, "service.py", "--db-dir", str(db_dir), "--port", "0", "--window", str(window)],
+        cwd=CODE_DIR,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    line = proc.stdout.readline()
+    if not line.startswith("Listening on"):
+        proc.kill()
+        raise SystemExit(f"service did not start: {line.strip()}")
+    return proc, urlsplit(line.split()[-1])
+
+
+async def load(host, port, users, args):
+    latencies = {"read": [], "write": []}
+    errors = []
+    deadline = time.perf_counter() + args.duration
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(host, port, user, password, deadline, args.writes, seed, latencies, errors) for seed, (user, password) in enumerate(users)))
+    elapsed = time.perf_counter() - start
+    stats = (await Client(host, port).request("GET", "/stats"))[1]
+    return latencies, errors, elapsed, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="running service, e.g. http://127.0.0.1:8080")
+    parser.add_argument("--username", help="with --url: account every client logs in as")
+    parser.add_argument("--password", default="pw")
+    parser.add_argument("--accounts", type=int, default=10_000, help="synthetic accounts when starting the service")
+    parser.add_argument("--clients", type=int, default=64, help="concurrent connections")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--writes", type=float, default=0.5, help="fraction of requests that are deposits/withdrawals")
+    parser.add_argument("--window", type=float, default=0.005, help="group commit window of the started service")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        proc = None
+        if args.url:
+            url = urlsplit(args.url)
+            users = [(args.username, args.password)] * args.clients
+        else:
+            accounts = make_db_dir(tmp, args.accounts)
+            active = [key for key, acct in accounts.items() if acct["activated"] and not acct["is_admin"]]
+            del accounts
+            users = [(key, "pw") for key in random.Random(0).sample(active, min(args.clients, len(active)))]
+            proc, url = start_service(tmp, args.window)
+        try:
+            latencies, errors, elapsed, stats = asyncio.run(load(url.hostname, url.port, users, args))
+        finally:
+            if proc is not None:
+                proc.terminate()
+                proc.wait()
+
+    total = sum(len(v) for v in latencies.values())
+    print(f"{len(users)} clients, {args.duration:.0f}s, {args.writes:.0%} writes: {total / elapsed:.0f} requests/sec")
+    print(f"{'kind':<8}{'count':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for kind, values in latencies.items():
+        values.sort()
+        print(f"{kind:<8}{len(values):>9}" + "".join(f"{percentile(values, p) * 1000:>10.2f}" for p in (50, 95, 99, 100)))
+    print(f"group commit: {stats.get('commits', 0)} flushes for {stats.get('committed_writes', 0)} writes ({stats.get('writes_per_commit', 0):.1f} per flush)")
+    if stats.get("cache"):
+        print(format_cache(stats["cache"]))
+    if errors:
+        print(f"{len(errors)} errors, e.g. {errors[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Per-operation latency/throughput of Features and Admin as database.db grows.
+
+Run from the code/ directory:
+    python -m benchmarks.operations --sizes 1000 10000 100000 1000000 --storage json --out results.json
+
+Every size runs in its own child process so peak RSS is per size. Results (ops/sec,
+p50/p99 latency, peak RSS, bytes written per op) are written as JSON together with the
+git commit, so runs can be compared across commits.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from admin import Admin
+from benchmarks.synth import generate_accounts, make_db_dir, username
+from features import Features
+from storage import ShardedStore, SqliteStore, open_store
+
+
+def bytes_written():
+    """Bytes this process has passed to write() so far (Linux /proc), or None."""
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def time_operation(fn, args_iter, max_ops, budget):
+    """Call fn(*args) until max_ops calls or `budget` seconds have been spent (at least 3 calls)."""
+    latencies = []
+    written = bytes_written()
+    start = time.perf_counter()
+    for args in args_iter:
+        t = time.perf_counter()
+        fn(*args)
+        latencies.append(time.perf_counter() - t)
+        if len(latencies) >= max_ops or (len(latencies) >= 3 and time.perf_counter() - start > budget):
+            break
+    elapsed = time.perf_counter() - start
+    after = bytes_written()
+    latencies.sort()
+    return {
+        "ops": len(latencies),
+        "ops_per_sec": len(latencies) / elapsed if elapsed else None,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "bytes_written_per_op": (after - written) / len(latencies) if written is not None else None,
+    }
+
+
+def run_size(db_dir, n, storage, max_ops, budget, seed=0):
+    store = open_store(db_dir, storage)
+    features = Features(db_dir=db_dir, store=store)
+    admin = Admin(db_dir=db_dir, store=store)
+
+    rng = random.Random(seed)
+    keys = [k for k, _ in generate_accounts(n, seed)]
+    no_card = [k for k, a in generate_accounts(n, seed) if not a.get("card")]
+    currencies = ("USD", "EUR", "GBP", "JPY")
+
+    def random_keys():
+        while True:
+            yield (rng.choice(keys),)
+
+    ops = {
+        "login": (features.login, ((username(rng.randrange(n - 1)), "pw") for _ in iter(int, 1))),
+        "deposit": (lambda k: features.deposit_amount(k, 1.0), random_keys()),
+        "withdraw": (lambda k: features.withdraw_amount(k, 1.0), random_keys()),
+        "change_currency": (lambda k: features.change_currency_to(k, rng.choice(currencies)), random_keys()),
+        "register_card": (lambda k: features.add_card(k, 4539657457661162, "08/32", "VISA", "CREDIT", 960), ((k,) for k in no_card)),
+        "create_account": (lambda i: admin.create_account(f"BENCH{i}", "pw", "USD"), ((i,) for i in range(max_ops))),
+        "change_details": (lambda k: admin.change_details(k, password="changed"), random_keys()),
+        "delete_account": (lambda i: admin.delete_account(f"BENCH{i}"), ((i,) for i in range(max_ops))),
+    }
+    results = {name: time_operation(fn, args, max_ops, budget) for name, (fn, args) in ops.items()}
+    store.close()
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"accounts": n, "storage": storage, "peak_rss_mb": peak_kb / 1024, "operations": results}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--storage", default=os.getenv("BANK_STORAGE") or "json", help="json, wal, sqlite, cached, compact or sharded")
+    parser.add_argument("--ops", type=int, default=200, help="maximum calls per operation")
+    parser.add_argument("--budget", type=float, default=10.0, help="seconds per operation before stopping early")
+    parser.add_argument("--out", type=Path, default=Path("bench_results.json"))
+    parser.add_argument("--one", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--db-dir", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.one is not None:
+        print(json.dumps(run_size(args.db_dir, args.one, args.storage, args.ops, args.budget)))
+        return
+
+    runs = []
+    for n in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            accounts = make_db_dir(tmp, n)
+            if args.storage == "sqlite":
+                SqliteStore(Path(tmp) / "database.sqlite").replace_all(accounts)
+            elif args.storage == "sharded":
+                ShardedStore(Path(tmp) / "shards").replace_all(accounts)
+            del accounts
+            cmd = [sys.executable, "-m", "benchmarks.operations", "--one", str(n), "--db-dir", tmp]
+            cmd += ["--storage", args.storage, "--ops", str(args.ops), "--budget", str(args.budget)]
+            result = json.loads(subprocess.run(cmd, capture_output=True, text=True, check=True).stdout)
+        runs.append(result)
+        print(f"\n{n} accounts ({args.storage}), peak RSS {result['peak_rss_mb']:.0f} MB")
+        for name, r in result["operations"].items():
+            written = f"{r['bytes_written_per_op']:.0f}" if r["bytes_written_per_op"] is not None else "n/a"
+            print(f"  {name:<16} {r['ops_per_sec']:>10.1f} ops/s  p50 {r['p50_ms']:8.3f} ms  p99 {r['p99_ms']:8.3f} ms  {written:>10} B/op")
+
+    report = {"commit": git_commit(), "date": datetime.datetime.now(datetime.timezone.utc).isoformat(), "runs": runs}
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"\nResults written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
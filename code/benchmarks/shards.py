@@ -0,0 +1,71 @@
+"""Sharded layout: point-operation speed vs. a single database.db, and whole-book job scaling
+with the number of worker processes.
+
+Run from the code/ directory:
+    python -m benchmarks.shards --accounts 1000000 --shards 16 --workers 1 2 4 8 16
+
+Speedups are relative to one worker; they level off at the number of cores
+(os.cpu_count() is printed with the results).
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import shards
+from benchmarks.synth import make_db_dir
+from currency_exchange import CurrencyConverter
+from storage import JsonStore, ShardedStore
+
+
+def deposits_per_sec(store, keys, ops, seed=0):
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    for _ in range(ops):
+        key = rng.choice(keys)
+        store.update(key, {"balance": store.get(key).get("balance", 0) + 1.0})
+    return ops / (time.perf_counter() - start)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, default=200_000)
+    parser.add_argument("--shards", type=int, default=8)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--ops", type=int, default=50, help="deposits for the point-operation comparison")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        accounts = make_db_dir(tmp, args.accounts)
+        keys = list(accounts)
+        store = ShardedStore(Path(tmp) / "shards", args.shards)
+        store.replace_all(accounts)
+        del accounts
+        converter = CurrencyConverter(Path(__file__).resolve().parent.parent.parent / "db" / "currency.db")
+
+        print(f"{args.accounts} accounts, {args.shards} shards, {os.cpu_count()} cores\n")
+        single = deposits_per_sec(JsonStore(Path(tmp) / "database.db"), keys, args.ops)
+        sharded = deposits_per_sec(store, keys, args.ops)
+        print(f"deposits/sec   single file {single:10.1f}   sharded {sharded:10.1f}   ({sharded / single:.1f}x)\n")
+
+        jobs = {
+            "revalue": lambda w: shards.revalue(store, converter, "USD", w),
+            "export": lambda w: shards.export(store, Path(tmp) / "export.csv", w),
+            "bulk (dry run)": lambda w: shards.bulk(store, "deactivate", {"currency": "EUR"}, dry_run=True, workers=w),
+        }
+        print(f"{'job':<16}" + "".join(f"{f'{w} workers':>18}" for w in args.workers))
+        for name, job in jobs.items():
+            times = [timed(lambda: job(w)) for w in args.workers]
+            print(f"{name:<16}" + "".join(f"{t:>9.2f}s ({times[0] / t:4.1f}x)" for t in times))
+
+
+if __name__ == "__main__":
+    main()
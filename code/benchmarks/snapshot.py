@@ -0,0 +1,58 @@
+"""database.db as indent=4 JSON vs. the binary snapshot format: file size, load and write time.
+
+Run from the code/ directory:
+    python -m benchmarks.snapshot --accounts 10000 100000 1000000
+
+Loads go through storage.read_database, the same path every store uses; the best of
+--repeat runs is reported.
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.synth import generate_accounts
+from storage import read_database, write_database
+
+
+def best_of(repeat, fn):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run_size(tmp, n, repeat):
+    accounts = dict(generate_accounts(n))
+    results = {}
+    for fmt in ("json", "binary"):
+        path = Path(tmp) / f"database-{fmt}.db"
+        write = best_of(repeat, lambda: write_database(path, accounts, fmt))
+        load = best_of(repeat, lambda: read_database(path))
+        results[fmt] = (path.stat().st_size, load, write)
+        assert read_database(path) == accounts
+        path.unlink()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'accounts':>10}{'format':>8}{'size MB':>10}{'load s':>9}{'write s':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.accounts:
+            results = run_size(tmp, n, args.repeat)
+            for fmt, (size, load, write) in results.items():
+                print(f"{n:>10}{fmt:>8}{size / 1e6:>10.2f}{load:>9.3f}{write:>9.3f}")
+            (json_size, json_load, _), (bin_size, bin_load, _) = results["json"], results["binary"]
+            print(f"{'':>10}{'':>8}{bin_size / json_size:>9.0%} size, {json_load / bin_load:.1f}x faster load")
+
+
+if __name__ == "__main__":
+    main()
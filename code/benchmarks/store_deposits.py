@@ -0,0 +1,54 @@
+"""Deposits/sec for the whole-file JSON store, the write-ahead log store and the SQLite store.
+
+Run from the code/ directory:  python -m benchmarks.store_deposits --sizes 10000 100000 1000000
+"""
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.synth import make_db_dir
+from storage import JsonStore, LogStore, SqliteStore
+
+
+def run_deposits(store, keys, ops, seed=0):
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    for _ in range(ops):
+        key = rng.choice(keys)
+        acct = store.get(key)
+        store.update(key, {"balance": acct.get("balance", 0) + 1.0})
+    return ops / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--ops", type=int, default=2000)
+    parser.add_argument("--json-limit", type=int, default=10_000, help="skip the JSON store above this many accounts")
+    parser.add_argument("--no-sync", action="store_true", help="do not fsync each log record")
+    args = parser.parse_args()
+
+    for n in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "database.db"
+            keys = list(make_db_dir(tmp, n))
+            if n <= args.json_limit:
+                rate = run_deposits(JsonStore(path), keys, min(args.ops, 200))
+                print(f"{n:>9} accounts  json  {rate:>10.1f} deposits/sec")
+            start = time.perf_counter()
+            store = LogStore(path, sync=not args.no_sync)
+            replay = time.perf_counter() - start
+            rate = run_deposits(store, keys, args.ops)
+            print(f"{n:>9} accounts  wal   {rate:>10.1f} deposits/sec  (startup replay {replay:.2f}s)")
+            store.close()
+            sqlite = SqliteStore(Path(tmp) / "database.sqlite")
+            sqlite.replace_all(JsonStore(path).all())
+            rate = run_deposits(sqlite, keys, args.ops)
+            print(f"{n:>9} accounts  sqlite {rate:>9.1f} deposits/sec")
+            sqlite.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Many processes depositing and withdrawing against one db/ at the same time.
+
+Run from the code/ directory:
+    python -m benchmarks.stress --processes 8 --ops 200 --accounts 20 --storage json
+
+Every worker keeps the net amount it successfully moved per account. At the end each
+account's balance must equal its starting balance plus every worker's net change (so the
+total is conserved), database.db must still parse, and each account's last ledger record
+must agree with its balance. With --signups N every worker also tries to create the same
+N new accounts; each must end up created exactly once. Exits non-zero if anything was
+lost. test_stress.py runs the same check for every storage mode under pytest.
+"""
+import argparse
+import multiprocessing
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+from accounts import to_minor
+from benchmarks.synth import make_db_dir
+from features import Features
+from ledger import Ledger
+from main import Admin
+from storage import ShardedStore, SqliteStore, open_store
+
+
+def signup_name(i):
+    return f"NEW{i:05d}"
+
+
+def worker(db_dir, storage, currencies, ops, seed, signups=0):
+    store = open_store(db_dir, storage)
+    features = Features(db_dir=db_dir, store=store)
+    admin = Admin(Path(db_dir), store=store)
+    rng = random.Random(seed)
+    keys = list(currencies)
+    net = Counter()
+    created = []
+    every = max(ops // signups, 1) if signups else 0
+    for i in range(ops):
+        if every and i % every == 0 and len(created) < signups:
+            # every worker races for the same new usernames
+            name = signup_name(i // every)
+            if admin.create_account(name, "pw", "USD")[0]:
+                created.append(name)
+        key = rng.choice(keys)
+        amount = rng.randrange(1, 5000) / 100
+        if rng.random() < 0.5:
+            success, _ = features.deposit_amount(key, amount)
+            sign = 1
+        else:
+            success, _ = features.withdraw_amount(key, amount)
+            sign = -1
+        if success:
+            net[key] += sign * to_minor(amount, currencies[key])
+    store.close()
+    return net, created
+
+
+def seed_db(db_dir, accounts, storage):
+    """A db/ directory of `accounts` synthetic accounts, loaded into the given storage mode."""
+    accounts = make_db_dir(db_dir, accounts)
+    if storage == "sqlite":
+        # closed before the workers fork: a child must not inherit an open SQLite connection
+        store = SqliteStore(Path(db_dir) / "database.sqlite")
+        store.replace_all(accounts)
+        store.close()
+    elif storage == "sharded":
+        ShardedStore(Path(db_dir) / "shards").replace_all(accounts)
+    return accounts
+
+
+def run_workers(db_dir, storage, accounts, processes, ops, signups=0):
+    """Run `processes` workers at once; returns (net change per account, names each worker created)."""
+    currencies = {key: acct["currency"] for key, acct in accounts.items() if key != "ADMIN"}
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.starmap(worker, [(db_dir, storage, currencies, ops, seed, signups) for seed in range(processes)])
+    net = Counter()
+    for part, _ in results:
+        net.update(part)
+    return net, [created for _, created in results]
+
+
+def check(db_dir, storage, accounts, net, created=(), signups=0):
+    """Everything that was lost: a list of messages, empty if every write survived."""
+    store = open_store(db_dir, storage)
+    after = store.all()
+    store.close()
+    ledger = Ledger(Path(db_dir) / "ledger")
+    errors = []
+    for key, acct in accounts.items():
+        before = to_minor(acct["balance"], acct["currency"])
+        final = to_minor(after[key]["balance"], after[key]["currency"])
+        if final != before + net[key]:
+            errors.append(f"{key}: expected {before + net[key]}, found {final} (minor units)")
+        rows = list(ledger.statement(key))
+        if rows and rows[-1]["balance"] != after[key]["balance"]:
+            errors.append(f"{key}: ledger ends at {rows[-1]['balance']}, balance is {after[key]['balance']}")
+    ledger.close()
+    winners = Counter(name for names in created for name in names)
+    for name in map(signup_name, range(signups)):
+        if winners[name] != 1:
+            errors.append(f"{name}: created {winners[name]} times")
+        elif name not in after:
+            errors.append(f"{name}: created, then lost")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=200, help="operations per process")
+    parser.add_argument("--accounts", type=int, default=20, help="fewer accounts means more contention")
+    parser.add_argument("--storage", default="json", help="json, wal, sqlite, cached, compact or sharded")
+    parser.add_argument("--signups", type=int, default=0, help="new accounts every worker tries to create")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        accounts = seed_db(tmp, args.accounts, args.storage)
+        before = {key: to_minor(acct["balance"], acct["currency"]) for key, acct in accounts.items()}
+
+        start = time.perf_counter()
+        net, created = run_workers(tmp, args.storage, accounts, args.processes, args.ops, args.signups)
+        elapsed = time.perf_counter() - start
+        errors = check(tmp, args.storage, accounts, net, created, args.signups)
+        store = open_store(tmp, args.storage)
+        after = store.all()
+        store.close()
+
+        total_ops = args.processes * args.ops
+        print(f"{args.processes} processes x {args.ops} ops on {len(accounts) - 1} accounts ({args.storage}): {total_ops / elapsed:.0f} ops/sec")
+        expected = sum(before.values()) + sum(net.values())
+        found = sum(to_minor(a["balance"], a["currency"]) for a in after.values())
+        print(f"total (minor units) before {sum(before.values())}, expected after {expected}, found {found}")
+        if errors:
+            print(f"FAILED: {len(errors)} lost updates")
+            for error in errors[:10]:
+                print("  " + error)
+            sys.exit(1)
+        print("OK: every balance conserved")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Deterministic synthetic account databases for benchmarks.
+
+    python -m benchmarks.synth /tmp/bench_db --accounts 100000
+"""
+import argparse
+import json
+import random
+import shutil
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+CURRENCY_DB = BASE_DIR.parent / "db" / "currency.db"
+
+
+def luhn_complete(prefix):
+    """Append the Luhn check digit to a string of digits."""
+    total = 0
+    for i, d in enumerate(reversed(prefix)):
+        d = int(d)
+        if i % 2 == 0:
+            d *= 2
+            if d > 9:
+                d -= 9
+        total += d
+    return prefix + str((10 - total % 10) % 10)
+
+
+def username(i):
+    return f"USER{i:07d}"
+
+
+def generate_accounts(n, seed=0, card_ratio=0.3, currencies=None):
+    """Yield (key, account) pairs; the same n and seed always give the same accounts."""
+    rng = random.Random(seed)
+    if currencies is None:
+        with open(CURRENCY_DB, "r") as f:
+            rates = json.load(f)["rates"]
+        # mostly a handful of major currencies, with a long tail of the rest
+        majors = [c for c in ("USD", "EUR", "GBP", "JPY", "CHF") if c in rates or c == "USD"]
+        currencies = majors * 20 + sorted(rates)
+    yield "ADMIN", {"password": "admin000", "currency": "USD", "balance": 0, "activated": True, "is_admin": True, "card": None}
+    for i in range(n - 1):
+        card = None
+        if rng.random() < card_ratio:
+            brand, prefix = rng.choice((("VISA", "4"), ("MC", "5"), ("AMEX", "3")))
+            card = {
+                "number": int(luhn_complete(prefix + "".join(rng.choice("0123456789") for _ in range(14)))),
+                "expiration": f"{rng.randint(1, 12):02d}/{rng.randint(26, 35)}",
+                "card": brand,
+                "type": rng.choice(("CREDIT", "DEBIT")),
+                "CVC": rng.randint(100, 999),
+            }
+        yield username(i), {
+            "password": "pw",
+            "currency": rng.choice(currencies),
+            "balance": round(rng.uniform(0, 10_000), 2),
+            "activated": rng.random() < 0.95,
+            "is_admin": False,
+            "card": card,
+        }
+
+
+def make_db_dir(path, n, seed=0, indent=4):
+    """Create a db/ directory with database.db (n accounts), and currency.db."""
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    shutil.copy(CURRENCY_DB, path / "currency.db")
+    accounts = dict(generate_accounts(n, seed))
+    with open(path / "database.db", "w") as f:
+        json.dump(accounts, f, indent=indent)
+    return accounts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    make_db_dir(args.path, args.accounts, args.seed)
+    print(f"Wrote {args.accounts} accounts to {args.path}")
@@ -0,0 +1,147 @@
+"""Batch transfer files and single transfers running against one db/ at the same time.
+
+Run from the code/ directory:
+    python -m benchmarks.transfers --accounts 10000 --transfers 200000 --processes 4
+
+--processes workers each apply their own file of random transfers with apply_transfers
+while --single workers issue one transfer_amount at a time, so batches and single
+transfers fight over the same stripes. Afterwards every account's balance must match its
+last ledger record, each currency's total must equal its start plus everything credited
+minus everything debited in it, and every cross-currency transfer must carry the same
+value in the reference currency on both sides, up to half a minor unit of the credit.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+from accounts import exponent, to_minor
+from benchmarks.synth import make_db_dir
+from currency_exchange import CurrencyConverter
+from features import Features
+from ledger import Ledger
+from storage import SNAPSHOT_ENV, open_store, write_database
+
+
+def random_transfers(keys, n, seed):
+    rng = random.Random(seed)
+    for _ in range(n):
+        yield {"src": rng.choice(keys), "dst": rng.choice(keys), "amount": rng.randrange(1, 20_000) / 100}
+
+
+def batch_worker(db_dir, storage, keys, n, seed, chunk):
+    store = open_store(db_dir, storage)
+    features = Features(db_dir=db_dir, store=store)
+    start = time.perf_counter()
+    applied, rejected = features.apply_transfers(random_transfers(keys, n, seed), chunk=chunk)
+    elapsed = time.perf_counter() - start
+    store.close()
+    return applied, rejected, elapsed
+
+
+def single_worker(db_dir, storage, keys, n, seed):
+    store = open_store(db_dir, storage)
+    features = Features(db_dir=db_dir, store=store)
+    applied = 0
+    start = time.perf_counter()
+    for tx in random_transfers(keys, n, seed):
+        success, _ = features.transfer_amount(tx["src"], tx["dst"], tx["amount"])
+        applied += success
+    elapsed = time.perf_counter() - start
+    store.close()
+    return applied, n - applied, elapsed
+
+
+def check(tmp, storage, accounts):
+    """Return a list of conservation errors (empty if everything adds up)."""
+    store = open_store(tmp, storage)
+    after = store.all()
+    store.close()
+    table = CurrencyConverter(db_path=str(Path(tmp) / "currency.db")).table
+    moved = Counter()
+    last = {}
+    errors = []
+    ledger = Ledger(Path(tmp) / "ledger")
+    previous = None
+    for row in ledger.records():
+        units = to_minor(row["amount"], row["currency"])
+        moved[row["currency"]] += units if row["op"] == "transfer_in" else -units
+        last[row["account"]] = row["balance"]
+        if row["op"] == "transfer_out":
+            previous = row
+            continue
+        # append_many writes each transfer as an adjacent (transfer_out, transfer_in) pair
+        sent = to_minor(previous["amount"], previous["currency"]) / 10 ** exponent(previous["currency"]) / table.get_rate(previous["currency"])
+        received = units / 10 ** exponent(row["currency"]) / table.get_rate(row["currency"])
+        if abs(received - sent) > 0.5 / 10 ** exponent(row["currency"]) / table.get_rate(row["currency"]) + 1e-12 * sent:
+            errors.append(f"{previous['account']} -> {row['account']}: sent {sent} but credited {received} in {table.base}")
+    ledger.close()
+    before, found = Counter(), Counter()
+    for key, acct in accounts.items():
+        before[acct["currency"]] += to_minor(acct["balance"], acct["currency"])
+        found[after[key]["currency"]] += to_minor(after[key]["balance"], after[key]["currency"])
+        if key in last and last[key] != after[key]["balance"]:
+            errors.append(f"{key}: ledger ends at {last[key]}, balance is {after[key]['balance']}")
+    for cur in before:
+        if before[cur] + moved[cur] != found[cur]:
+            errors.append(f"{cur}: expected {before[cur] + moved[cur]}, found {found[cur]} (minor units)")
+
+    def value(totals):
+        return sum(units / 10 ** exponent(cur) / table.get_rate(cur) for cur, units in totals.items())
+
+    print(f"total value in {table.base}: before {value(before):.2f}, after {value(found):.2f} (conversion rounding {value(found) - value(before):+.4f})")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, default=10_000)
+    parser.add_argument("--transfers", type=int, default=100_000, help="transfers per batch worker")
+    parser.add_argument("--processes", type=int, default=4, help="batch workers")
+    parser.add_argument("--single", type=int, default=2, help="workers doing one transfer at a time")
+    parser.add_argument("--single-ops", type=int, default=200, help="transfers per single worker")
+    parser.add_argument("--chunk", type=int, default=10_000)
+    parser.add_argument("--storage", default="cached", help="json, wal, sqlite, cached, compact or sharded")
+    parser.add_argument("--format", choices=("binary", "json"), default="binary", help="database.db / shard file format")
+    args = parser.parse_args()
+
+    # workers inherit it, so new shard files get the same format
+    os.environ[SNAPSHOT_ENV] = args.format
+    with tempfile.TemporaryDirectory() as tmp:
+        accounts = make_db_dir(tmp, args.accounts)
+        write_database(Path(tmp) / "database.db", accounts, args.format)
+        store = open_store(tmp, args.storage)
+        store.replace_all(accounts)
+        store.close()
+        keys = sorted(accounts)
+        with multiprocessing.Pool(args.processes + args.single) as pool:
+            start = time.perf_counter()
+            batches = [pool.apply_async(batch_worker, (tmp, args.storage, keys, args.transfers, seed, args.chunk)) for seed in range(args.processes)]
+            singles = [pool.apply_async(single_worker, (tmp, args.storage, keys, args.single_ops, 1000 + seed)) for seed in range(args.single)]
+            batches, singles = [r.get() for r in batches], [r.get() for r in singles]
+            elapsed = time.perf_counter() - start
+
+        total = args.processes * args.transfers + args.single * args.single_ops
+        applied = sum(r[0] for r in batches + singles)
+        print(f"{args.processes} batch + {args.single} single workers on {args.accounts} accounts ({args.storage}): "
+              f"{total / elapsed:.0f} transfers/sec, {applied} applied, {total - applied} rejected")
+        for i, (done, failed, seconds) in enumerate(batches):
+            print(f"  batch {i}: {(done + failed) / seconds:.0f} transfers/sec")
+        for i, (done, failed, seconds) in enumerate(singles):
+            print(f"  single {i}: {(done + failed) / seconds:.0f} transfers/sec")
+        errors = check(tmp, args.storage, accounts)
+        if errors:
+            print(f"FAILED: {len(errors)} conservation errors")
+            for error in errors[:10]:
+                print("  " + error)
+            sys.exit(1)
+        print("OK: money conserved")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Velocity checks with millions of tracked accounts: cost per check and memory per account.
+
+Run from the code/ directory:
+    python -m benchmarks.velocity --accounts 1000000 --checks 1000000
+
+Every account first makes --events withdrawals, so all of them are tracked, then --checks
+random withdrawals and login checks are timed. The same workload runs against a plain dict of
+timestamp deques (pruned on every check) for comparison. Memory is the growth of the
+process's resident set while the accounts are being tracked. The off-hot-path costs,
+writing velocity.db and merging it back, are reported separately.
+"""
+import argparse
+import gc
+import os
+import random
+import tempfile
+import time
+from collections import deque
+from pathlib import Path
+
+from benchmarks.synth import username
+from velocity import DEFAULT_LIMITS, VelocityLimits
+
+
+def rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class DequeLimits:
+    """The straightforward version: every withdrawal's (time, amount) kept until it expires."""
+
+    def __init__(self, window, max_count, max_amount):
+        self.window, self.max_count, self.max_amount = window, max_count, max_amount
+        self.events = {}
+
+    def withdraw(self, account, units, now):
+        events = self.events.setdefault(account, deque())
+        while events and events[0][0] <= now - self.window:
+            events.popleft()
+        if len(events) + 1 > self.max_count or sum(units for _, units in events) + units > self.max_amount:
+            return "limit"
+        events.append((now, units))
+        return None
+
+
+def run(name, track, check, keys, events, checks, rng):
+    gc.collect()
+    before = rss_bytes()
+    start = time.perf_counter()
+    for _ in range(events):
+        for key in keys:
+            track(key)
+    populate = time.perf_counter() - start
+    memory = rss_bytes() - before
+    picks = [rng.choice(keys) for _ in range(checks)]
+    start = time.perf_counter()
+    for key in picks:
+        check(key)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<22}{populate:>10.2f}s{memory / len(keys):>12.0f} B/acct{elapsed / checks * 1e9:>10.0f} ns/check")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, default=1_000_000)
+    parser.add_argument("--checks", type=int, default=1_000_000)
+    parser.add_argument("--events", type=int, default=1, help="withdrawals per account before timing")
+    args = parser.parse_args()
+
+    keys = [username(i) for i in range(args.accounts)]
+    window = DEFAULT_LIMITS["withdraw_window"]
+    print(f"{args.accounts} tracked accounts, {args.events} withdrawals each, {args.checks} checks")
+    print(f"{'':<22}{'populate':>11}{'memory':>17}{'per check':>18}")
+    with tempfile.TemporaryDirectory() as tmp:
+        limits = VelocityLimits(Path(tmp) / "velocity.db", DEFAULT_LIMITS, persist_interval=float("inf"))
+        clock = [time.time()]
+
+        def withdraw(key):
+            clock[0] += 0.01
+            limits.withdraw(key, 100, "USD", now=clock[0])
+
+        run("sliding window", withdraw, withdraw, keys, args.events, args.checks, random.Random(0))
+        rng = random.Random(1)
+        start = time.perf_counter()
+        for key in (rng.choice(keys) for _ in range(args.checks)):
+            limits.login_allowed(key, "USD")
+        print(f"{'  login_allowed':<22}{'':>41}{(time.perf_counter() - start) / args.checks * 1e9:>10.0f} ns/check")
+
+        start = time.perf_counter()
+        limits.flush()
+        size = (Path(tmp) / "velocity.db").stat().st_size
+        print(f"flush to velocity.db: {time.perf_counter() - start:.2f}s, {size / 1e6:.1f} MB")
+        other = VelocityLimits(Path(tmp) / "velocity.db", DEFAULT_LIMITS)
+        limits._sig = None
+        start = time.perf_counter()
+        limits._merge()
+        print(f"merge back into memory: {time.perf_counter() - start:.2f}s ({len(other.windows['withdraw'])} accounts)")
+        # dropped (not del: the withdraw closure above still names limits) before measuring the deques
+        limits = other = None
+        gc.collect()
+
+    naive = DequeLimits(window, 20, 1_000_000)
+    clock = [time.time()]
+
+    def deque_withdraw(key):
+        clock[0] += 0.01
+        naive.withdraw(key, 100, clock[0])
+
+    run("dict of deques", deque_withdraw, deque_withdraw, keys, args.events, args.checks, random.Random(0))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,57 @@
-import json
+import time
 from pathlib import Path
+from types import MappingProxyType
+from instrumentation import load_json, timed
+
+
+class RateTable:
+    """One immutable set of rates. CurrencyConverter swaps whole tables, never edits one."""
+
+    def __init__(self, base, rates, last_updated=None):
+        self.base = base
+        self.rates = MappingProxyType({code: float(rate) for code, rate in rates.items()})
+        self.last_updated = last_updated
+        self.loaded_at = time.time()
+        # integer ids for currency codes, fixed for the life of the table (base currency is id 0)
+        self.codes = tuple([base] + sorted(c for c in self.rates if c != base))
+        self.ids = MappingProxyType({code: i for i, code in enumerate(self.codes)})
+        self._matrix = None
+        self._code_table = None
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("base", "USD"), data.get("rates", {}), data.get("last_updated"))
+
+    def get_rate(self, currency):
+        currency = currency.upper()
+        if currency == self.base:
+            return 1.0
+        if currency in self.rates:
+            return self.rates[currency]
+        raise ValueError(f"Currency {currency} not found in database")
+
+    def cross_rates(self):
+        import numpy as np
+
+        if self._matrix is None:
+            rates = np.array([self.get_rate(code) for code in self.codes], dtype=np.float64)
+            self._matrix = rates[np.newaxis, :] / rates[:, np.newaxis]
+        return self._matrix
+
+    def code_table(self):
+        import numpy as np
+
+        if self._code_table is None:
+            table = np.full(1 << 21, -1, dtype=np.intp)
+            for code, i in self.ids.items():
+                if len(code) == 3 and code.isascii():
+                    # accept any letter case, like convert() does
+                    for a in {code[0].upper(), code[0].lower()}:
+                        for b in {code[1].upper(), code[1].lower()}:
+                            for c in {code[2].upper(), code[2].lower()}:
+                                table[(ord(a) << 14) | (ord(b) << 7) | ord(c)] = i
+            self._code_table = table
+        return self._code_table
 
 
 class CurrencyConverter:
@@ -10,23 +62,86 @@ class CurrencyConverter:
         if not self.db_path.exists():
             raise FileNotFoundError(f"Currency DB not found: {self.db_path}")
         with open(self.db_path, "r") as f:
-            data = json.load(f)
-        self.base = data.get("base", "USD")
-        self.rates = data.get("rates", {})
+            self.table = RateTable.from_dict(load_json(f))
+        self._history = None
+
+    # Readers take self.table once per call, so a concurrent swap() never mixes two tables.
+    def swap(self, table):
+        self.table = table
+
+    @property
+    def base(self):
+        return self.table.base
+
+    @property
+    def rates(self):
+        return self.table.rates
+
+    @property
+    def codes(self):
+        return self.table.codes
+
+    @property
+    def ids(self):
+        return self.table.ids
 
     def get_rate(self, currency):
-        currency = currency.upper()
-        if currency == self.base:
-            return 1.0
-        if currency in self.rates:
-            return float(self.rates[currency])
-        raise ValueError(f"Currency {currency} not found in database")
+        return self.table.get_rate(currency)
 
+    @timed("fx.convert")
     def convert(self, amount, from_currency, to_currency):
-        from_currency = from_currency.upper()
-        to_currency = to_currency.upper()
-        from_rate = self.get_rate(from_currency)
-        to_rate = self.get_rate(to_currency)
+        table = self.table
+        from_rate = table.get_rate(from_currency)
+        to_rate = table.get_rate(to_currency)
         # Convert from source → USD → target
         usd_amount = amount / from_rate
         return usd_amount * to_rate
+
+    @timed("fx.convert_at")
+    def convert_at(self, amount, from_currency, to_currency, when):
+        """Convert with the rates in effect at `when` (datetime, ISO string or epoch seconds)."""
+        from rate_history import RateHistory
+
+        if self._history is None:
+            self._history = RateHistory(self.db_path.parent / "rates_history")
+        from_rate = self._history.rate_at(from_currency, when)
+        to_rate = self._history.rate_at(to_currency, when)
+        return amount / from_rate * to_rate
+
+    # --- vectorized conversion ---
+    def currency_ids(self, codes, table=None):
+        """Map an array of currency codes to integer ids (integer arrays pass through)."""
+        import numpy as np
+
+        table = table or self.table
+        codes = np.asarray(codes)
+        if codes.dtype.kind in "iu":
+            return codes
+        if codes.dtype == np.dtype("<U3"):
+            # pack the three (ASCII) code points into a 21-bit index into a lookup table
+            chars = codes.reshape(-1).view(np.uint32).reshape(-1, 3)
+            packed = (chars[:, 0] << 14) | (chars[:, 1] << 7) | chars[:, 2]
+            packed[(chars >= 128).any(axis=1)] = 0
+            ids = table.code_table()[packed]
+            if (ids < 0).any():
+                bad = codes.reshape(-1)[(ids < 0).argmax()]
+                raise ValueError(f"Currency {bad.upper()} not found in database")
+            return ids.reshape(codes.shape)
+        uniques, inverse = np.unique(np.char.upper(codes.astype(str)), return_inverse=True)
+        try:
+            lookup = np.array([table.ids[code] for code in uniques], dtype=np.intp)
+        except KeyError as e:
+            raise ValueError(f"Currency {e.args[0]} not found in database") from None
+        return lookup[inverse.reshape(codes.shape)]
+
+    def cross_rates(self):
+        """float64 matrix where cross_rates()[i, j] converts currency id i into id j."""
+        return self.table.cross_rates()
+
+    @timed("fx.convert_many")
+    def convert_many(self, amounts, from_codes, to_codes):
+        import numpy as np
+
+        table = self.table
+        amounts = np.asarray(amounts, dtype=np.float64)
+        return amounts * table.cross_rates()[self.currency_ids(from_codes, table), self.currency_ids(to_codes, table)]
@@ -0,0 +1,398 @@
+"""Change-data-capture stream: one event per changed account field.
+
+open_store has every store publish what each write changed, so
+deposits, withdrawals, transfers, currency changes, card (un)registration, accrual,
+imports and every Admin action all show up without each of them having to report itself:
+
+    {"seq": 42, "time": "2026-...+00:00", "account": "ALICE", "field": "balance", "old": 10.0, "new": 15.0}
+
+A created or deleted account is a single event with field "*" and the whole account as
+new (or old). Passwords are never published (a password change has old and new None),
+nor are card CVCs.
+
+Stores publish at their commit point, while they still hold the lock of the file (or
+shard) being written, comparing the accounts they loaded under that lock with what
+they stored. So old values are what the write replaced, new values are what was
+stored, and writes to one file reach the log in the order they were committed, whatever
+locks the caller holds.
+
+Events go to two places:
+  - db/events/, a rotating log of JSON lines [seq, time (us), account, field, old, new]:
+    events-<first seq>.log, a new segment every segment_bytes, the oldest deleted beyond
+    keep_segments. Appends hold events.lock, so every process sharing db/ writes to one
+    gap-free sequence.
+  - bounded in-process queues, one per subscribe(). Publishing never waits for a slow
+    consumer: events that do not fit are dropped from its queue and read back from the
+    log when the consumer gets to them.
+
+Consumers tail from a sequence number with EventLog.read(start) / follow(start) /
+subscribe(start=...), over HTTP with GET /admin/events?from=SEQ, or from the shell:
+
+    python events.py --from 1000 --follow
+
+Capture is on unless BANK_EVENTS=0. A process that opens a store with capture off
+publishes a gap marker first, so consumers know its writes are missing from there on:
+
+    {"seq": 43, "time": "...", "account": null, "field": "gap", "old": null, "new": {"pid": 1234}}
+"""
+from bisect import bisect_right
+from pathlib import Path
+import argparse
+import datetime
+import functools
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from locks import FileLock
+
+EVENTS_ENV = "BANK_EVENTS"
+SEGMENT_BYTES = 64 << 20
+KEEP_SEGMENTS = 16
+QUEUE_SIZE = 10_000
+READ_CHUNK = 1 << 20
+WHOLE = "*"
+GAP = "gap"
+
+_shared_logs = {}
+_gaps = set()  # processes that have marked their gap (forked children mark their own)
+
+
+def capture_enabled():
+    return os.getenv(EVENTS_ENV, "1").strip() != "0"
+
+
+def open_events(path):
+    # one instance per directory, so subscribers see every write the process makes
+    path = Path(path).resolve()
+    if path not in _shared_logs:
+        _shared_logs[path] = EventLog(path)
+    return _shared_logs[path]
+
+
+def capture_events(store, db_dir):
+    """Have store publish its writes to db_dir/events (else mark the gap); returns store."""
+    events = open_events(Path(db_dir) / "events")
+    if capture_enabled():
+        store.events = events
+    elif os.getpid() not in _gaps:
+        _gaps.add(os.getpid())
+        events.publish([(None, GAP, None, {"pid": os.getpid()})])
+    return store
+
+
+def _first_seq(segment):
+    # events-<20-digit seq>.log
+    return int(segment.name[7:27])
+
+
+def _public(field, value):
+    if field == "password":
+        return None
+    if field == "card" and value:
+        return {k: v for k, v in value.items() if k != "CVC"}
+    if field == WHOLE and value is not None:
+        return {k: _public(k, v) for k, v in value.items() if k != "password"}
+    return value
+
+
+@functools.lru_cache(maxsize=1)
+def _iso(ts):
+    # events published together share a timestamp; format it once
+    return datetime.datetime.fromtimestamp(ts / 1_000_000, datetime.timezone.utc).isoformat()
+
+
+def _event(row):
+    seq, ts, account, field, old, new = row
+    return {"seq": seq, "time": _iso(ts), "account": account, "field": field, "old": old, "new": new}
+
+
+def diff(key, old, new):
+    """(account, field, old, new) changes between two versions of an account (None = absent)."""
+    if old is None or new is None:
+        return [] if old is new else [(key, WHOLE, _public(WHOLE, old), _public(WHOLE, new))]
+    return [(key, field, _public(field, old.get(field)), _public(field, new.get(field))) for field in {**old, **new} if old.get(field) != new.get(field)]
+
+
+class EventLog:
+    """Rotating on-disk event log plus in-process subscribers (see the module docstring)."""
+
+    def __init__(self, path, segment_bytes=SEGMENT_BYTES, keep_segments=KEEP_SEGMENTS, sync=False):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = segment_bytes
+        self.keep_segments = keep_segments
+        self.sync = sync
+        self._file = None
+        self._name = None
+        self._size = 0
+        self._next = 1
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._commit = FileLock(self.path / "events.lock")
+        with self._commit:
+            self._sync()
+
+    def segments(self):
+        # zero-padded names sort in sequence order
+        return sorted(self.path.glob("events-*.log"))
+
+    # --- writing ---
+    def _sync(self):
+        """Catch up with other writers and repair a crashed append (lock held)."""
+        if self._file is not None:
+            size = os.fstat(self._file.fileno()).st_size
+            # another writer only ever starts a new segment once ours is full
+            if size == self._size and size < self.segment_bytes:
+                return
+        segments = self.segments()
+        if not segments:
+            return
+        if segments[-1] != self._name:
+            if self._file is not None:
+                self._file.close()
+            self._name = segments[-1]
+            self._file = open(self._name, "ab")
+        size = os.fstat(self._file.fileno()).st_size
+        with open(self._name, "rb") as f:
+            # widen the view from the end until it holds the last complete line
+            back = 4096
+            while True:
+                f.seek(max(size - back, 0))
+                tail = f.read()
+                end = tail.rfind(b"\n")
+                start = tail.rfind(b"\n", 0, max(end, 0)) + 1
+                if back >= size or start > 0:
+                    break
+                back *= 4
+        if end + 1 < len(tail):
+            # drop a torn line left behind by a crash mid-append
+            size -= len(tail) - end - 1
+            os.truncate(self._name, size)
+        self._size = size
+        self._next = json.loads(tail[start:end])[0] + 1 if end >= 0 else _first_seq(self._name)
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        self._name = self.path / f"events-{self._next:020d}.log"
+        self._file = open(self._name, "ab")
+        self._size = 0
+        for old in self.segments()[: -self.keep_segments]:
+            old.unlink(missing_ok=True)
+
+    def publish(self, changes):
+        """Append (account, field, old, new) changes as consecutive events; returns the last seq."""
+        if not changes:
+            return None
+        ts = time.time_ns() // 1000
+        with self._lock, self._commit:
+            self._sync()
+            if self._file is None or self._size >= self.segment_bytes:
+                self._rotate()
+            first = self._next
+            lines = [json.dumps([first + i, ts, *change], separators=(",", ":")).encode() + b"\n" for i, change in enumerate(changes)]
+            data = b"".join(lines)
+            self._file.write(data)
+            self._file.flush()
+            if self.sync:
+                os.fsync(self._file.fileno())
+            name, offset = self._name, self._size
+            self._size += len(data)
+            self._next += len(lines)
+            if self._subscribers:
+                # (seq, segment, offset just past the event, event) for each subscriber
+                delivered = []
+                for i, (line, change) in enumerate(zip(lines, changes)):
+                    offset += len(line)
+                    delivered.append((first + i, name, offset, _event((first + i, ts, *change))))
+                for subscriber in self._subscribers:
+                    subscriber._offer(delivered)
+        return self._next - 1
+
+    def flush(self):
+        """fsync everything appended so far (the service calls this at each group commit)."""
+        with self._lock:
+            if self._file is not None:
+                os.fsync(self._file.fileno())
+
+    # --- reading ---
+    def read(self, start=None):
+        """Yield every event from seq start (default: the oldest kept) up to the present."""
+        tail = Tail(self, start)
+        try:
+            while True:
+                events = tail.poll()
+                if not events:
+                    return
+                yield from events
+        finally:
+            tail.close()
+
+    def follow(self, start=None, interval=0.5):
+        """Like read(), then keep yielding new events as they are published, forever."""
+        tail = Tail(self, start)
+        try:
+            while True:
+                events = tail.poll()
+                if not events:
+                    time.sleep(interval)
+                yield from events
+        finally:
+            tail.close()
+
+    def subscribe(self, maxsize=QUEUE_SIZE, start=None):
+        """A Subscription starting at seq start (default: the next event published)."""
+        with self._lock, self._commit:
+            self._sync()
+            subscription = Subscription(self, maxsize, self._next if start is None else start)
+            self._subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.remove(subscription)
+
+    @property
+    def last_seq(self):
+        with self._lock, self._commit:
+            self._sync()
+            return self._next - 1
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self._name = None
+
+
+class Tail:
+    """A cursor reading the event log forward from a sequence number."""
+
+    def __init__(self, log, start=None):
+        self.log = log
+        segments = log.segments()
+        firsts = [_first_seq(segment) for segment in segments]
+        if start is None:
+            start = firsts[0] if firsts else 1
+        elif firsts and start < firsts[0]:
+            raise ValueError(f"Events before {firsts[0]} have been rotated out of the log")
+        self.next_seq = start
+        self._file = None
+        self._name = None
+        if segments:
+            # the last segment starting at or before `start`
+            self._open(segments[max(bisect_right(firsts, start) - 1, 0)], 0)
+
+    def _open(self, name, offset):
+        if self._file is not None:
+            self._file.close()
+        # kept open, so the segment can still be read after rotation deletes it
+        self._file = open(name, "rb")
+        self._file.seek(offset)
+        self._name = name
+
+    def seek(self, name, offset, next_seq):
+        """Continue after an event read elsewhere (a subscriber's queue) instead of rereading."""
+        if name != self._name:
+            self._open(name, offset)
+        else:
+            self._file.seek(offset)
+        self.next_seq = next_seq
+
+    def poll(self):
+        """Events published since the last poll (up to about READ_CHUNK bytes), oldest first."""
+        events = []
+        while not events:
+            if self._file is None:
+                segments = self.log.segments()
+                if not segments:
+                    return events
+                self._open(segments[0], 0)
+            data = self._file.read(READ_CHUNK)
+            end = data.rfind(b"\n") + 1
+            # leave a line that is still being written for the next poll
+            self._file.seek(end - len(data), os.SEEK_CUR)
+            if not end:
+                newer = [segment for segment in self.log.segments() if segment > self._name]
+                if not newer or len(data) >= READ_CHUNK:
+                    return events
+                self._open(newer[0], 0)
+                continue
+            for line in data[:end].splitlines():
+                if int(line[1 : line.index(b",")]) >= self.next_seq:
+                    events.append(_event(json.loads(line)))
+            if events:
+                self.next_seq = events[-1]["seq"] + 1
+        return events
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class Subscription:
+    """Events in sequence order: this process's from a bounded queue, the rest from the log."""
+
+    def __init__(self, log, maxsize, start):
+        self.log = log
+        self.queue = queue.Queue(maxsize)
+        self.tail = Tail(log, start)
+        self.dropped = 0
+        self._backlog = []
+
+    def _offer(self, delivered):
+        for i, item in enumerate(delivered):
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                # the log has them; get() reads them from there when the gap shows up
+                self.dropped += len(delivered) - i
+                return
+
+    def get(self, timeout=None, interval=0.5):
+        """The next event, or None if there is none within timeout seconds (None: wait forever)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self._backlog:
+                return self._backlog.pop(0)
+            wait = interval if deadline is None else min(interval, max(deadline - time.monotonic(), 0))
+            try:
+                seq, name, offset, event = self.queue.get(timeout=wait)
+            except queue.Empty:
+                seq = None
+            if seq is not None and seq < self.tail.next_seq:
+                continue  # already read from the log
+            if seq == self.tail.next_seq:
+                self.tail.seek(name, offset, seq + 1)
+                return event
+            # a gap (other processes' events, or ones the queue dropped), or nothing local for
+            # a while: both mean reading the log
+            self._backlog = self.tail.poll()
+            if not self._backlog and deadline is not None and time.monotonic() >= deadline:
+                return None
+
+    def close(self):
+        self.log.unsubscribe(self)
+        self.tail.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print account change events (JSON lines) from the event log.")
+    parser.add_argument("--from", dest="start", type=int, help="first sequence number (default: the oldest kept)")
+    parser.add_argument("--follow", action="store_true", help="keep waiting for new events")
+    parser.add_argument("--events", type=Path, default=Path(__file__).resolve().parent.parent / "db" / "events")
+    args = parser.parse_args()
+    log = EventLog(args.events)
+    try:
+        for event in (log.follow if args.follow else log.read)(args.start):
+            print(json.dumps(event), flush=args.follow)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
@@ -1,20 +1,17 @@
 import requests
 from dotenv import load_dotenv
 import os
-import json
 import datetime
 from pathlib import Path
+from rate_history import RateHistory
+from storage import write_json_atomic
 
+API_URL = "http://apilayer.net/api/live"
 
-def fetch_and_store():
-    load_dotenv()
-    key = os.getenv("CURRENCY_KEY")
-
-    if not key:
-        raise ValueError("CURRENCY_KEY not found in .env file")
 
-    url = f"http://apilayer.net/api/live?access_key={key}&source=USD&format=1"
-    response = requests.get(url)
+def fetch_rates(key, session=None, url=None, timeout=10):
+    url = url or os.getenv("CURRENCY_API_URL") or API_URL
+    response = (session or requests).get(url, params={"access_key": key, "source": "USD", "format": 1}, timeout=timeout)
     data = response.json()
 
     if not data.get("success", False):
@@ -23,13 +20,29 @@ def fetch_and_store():
     quotes = data["quotes"]
     now = datetime.datetime.utcnow().isoformat()
 
-    cleaned = {"last_updated": now, "base": "USD", "rates": {currency[3:]: rate for currency, rate in quotes.items()}}
+    return {"last_updated": now, "base": "USD", "rates": {currency[3:]: rate for currency, rate in quotes.items()}}
 
-    BASE = Path(__file__).resolve().parent
-    db_dir = BASE.parent / "db"
+
+def store_rates(cleaned, db_dir):
+    db_dir = Path(db_dir)
     db_dir.mkdir(parents=True, exist_ok=True)
-    with open(db_dir / "currency.db", "w") as f:
-        json.dump(cleaned, f, indent=4)
+    # temp file + rename, so readers never see a half-written currency.db
+    write_json_atomic(db_dir / "currency.db", cleaned)
+
+    history = RateHistory(db_dir / "rates_history")
+    history.append(cleaned["last_updated"], cleaned["base"], cleaned["rates"])
+    history.close()
+
+
+def fetch_and_store():
+    load_dotenv()
+    key = os.getenv("CURRENCY_KEY")
+
+    if not key:
+        raise ValueError("CURRENCY_KEY not found in .env file")
+
+    BASE = Path(__file__).resolve().parent
+    store_rates(fetch_rates(key), BASE.parent / "db")
 
     print("Rates successfully stored in currency.db")
 
@@ -1,60 +1,252 @@
 from pathlib import Path
-import json
+import datetime
+import math
+from accounts import from_minor, to_minor
 from currency_exchange import CurrencyConverter
+from ledger import open_ledger
+from locks import open_locks
+from sessions import open_sessions
+from storage import open_store
+from velocity import open_velocity
 import os
 
+TRANSFER_CHUNK = 10_000
+
 
 def clear_terminal():
     os.system("cls" if os.name == "nt" else "clear")
 
 
 class Features:
-    def __init__(self, db_dir: Path = None):
+    def __init__(self, db_dir: Path = None, store=None):
         self.BASE_DIR = Path(__file__).resolve().parent
         if db_dir is None:
             db_dir = self.BASE_DIR.parent / "db"
         self.db_dir = Path(db_dir)
-        self.user_db = self.db_dir / "user.db"
         self.database_db = self.db_dir / "database.db"
         self.currency_db = self.db_dir / "currency.db"
         self.conv = CurrencyConverter(db_path=str(self.currency_db))
+        self.store = store if store is not None else open_store(self.db_dir)
+        self.ledger = open_ledger(self.db_dir / "ledger")
+        self.locks = open_locks(self.db_dir / "accounts.lock")
+        self.sessions = open_sessions(self.db_dir / "sessions.json")
+        self.velocity = open_velocity(self.db_dir / "velocity.db", converter=self.conv)
 
     # --- helpers ---
-    def _write_user_db(self, data):
-        with open(self.user_db, "w") as f:
-            json.dump(data, f, indent=4)
-
-    def _read_user_db(self):
-        with open(self.user_db, "r") as f:
-            return json.load(f)
-
     def _read_database(self):
-        with open(self.database_db, "r") as f:
-            return json.load(f)
+        return self.store.all()
 
     def _write_database(self, data):
-        with open(self.database_db, "w") as f:
-            json.dump(data, f, indent=4)
+        self.store.replace_all(data)
 
     # --- authentication ---
-    def login(self, username, password):
-        db = self._read_database()
+    def authenticate(self, username, password):
+        """Return the account key if the credentials may log in, else None (no session is created)."""
         key = username.upper()
-        if key in db and db[key]["password"] == password:
-            # Allow login even if admin, and check if activated for regular users
-            if db[key].get("activated", True) or db[key].get("is_admin", False):
-                self._write_user_db({"logged in": True, "account": key})
-                return True
-        return False
-
-    def logout(self):
-        self._write_user_db({"logged in": False, "account": ""})
+        acct = self.store.get(key)
+        if not acct:
+            return None
+        # too many recent failures: refused without even looking at the password
+        if not self.velocity.login_allowed(key, acct.get("currency", "USD"), acct.get("is_admin", False)):
+            return None
+        if acct["password"] != password:
+            self.velocity.login_failed(key)
+            return None
+        # Allow login even if admin, and check if activated for regular users
+        if acct.get("activated", True) or acct.get("is_admin", False):
+            self.velocity.login_succeeded(key)
+            return key
+        return None
+
+    def login(self, username, password):
+        """Start a session; returns its token, or None if the credentials are refused."""
+        key = self.authenticate(username, password)
+        if key is None:
+            return None
+        return self.sessions.create(key)
+
+    def logout(self, token):
+        self.sessions.end(token)
         print("Logged out.")
 
+    # --- batch transactions ---
+    def apply_batch(self, transactions, on_reject=None, limits=False):
+        """Apply an iterable of {"account", "op", "amount"} deposits/withdrawals in one pass.
+
+        Each transaction is validated against the running in-memory balances (integer minor
+        units, so long runs do not accumulate float error) with the same
+        rules as deposit/withdraw; rejected ones are passed to on_reject(tx, reason). All
+        accepted changes are committed with a single store write. Returns (applied, rejected).
+        Batches are trusted back-office replay, so withdrawals only count against the
+        velocity limits with limits=True.
+        """
+        with self.locks.hold_all():
+            accounts = self.store.all()
+            balances = {}
+            entries = []
+            applied = rejected = 0
+            for tx in transactions:
+                account = str(tx.get("account", "")).upper()
+                op = str(tx.get("op", "")).lower()
+                reason = None
+                if account not in accounts:
+                    reason = "Account not found"
+                elif op not in ("deposit", "withdraw"):
+                    reason = f"Unknown operation: {op}"
+                else:
+                    try:
+                        amount = float(tx.get("amount"))
+                    except (TypeError, ValueError):
+                        reason = "Invalid amount"
+                if reason is None:
+                    cur = accounts[account].get("currency", "USD")
+                    bal = balances.get(account)
+                    if bal is None:
+                        bal = to_minor(accounts[account].get("balance", 0), cur)
+                    reason = self._check_amount(op, amount, from_minor(bal, cur), cur)
+                if reason is None and op == "withdraw" and limits:
+                    # the same sliding-window limits as withdraw_amount
+                    reason = self.velocity.withdraw(account, to_minor(amount, cur), cur, accounts[account].get("is_admin", False))
+                if reason is not None:
+                    rejected += 1
+                    if on_reject is not None:
+                        on_reject(tx, reason)
+                    continue
+                units = to_minor(amount, cur)
+                balances[account] = bal + units if op == "deposit" else bal - units
+                entries.append((account, op, units, cur, balances[account]))
+                applied += 1
+            if balances:
+                updates = {}
+                for key, bal in balances.items():
+                    updates[key] = {"balance": from_minor(bal, accounts[key].get("currency", "USD"))}
+                self.store.update_many(updates)
+                self.ledger.append_many(entries)
+            return applied, rejected
+
+    # --- transfers ---
+    @staticmethod
+    def _check_transfer(src, dst, amount, accounts, balances, table):
+        """(debit, credit) in minor units of each side's currency, or a rejection reason."""
+        if src == dst:
+            return "Cannot transfer to the same account"
+        if src not in accounts:
+            return "Account not found"
+        if dst not in accounts:
+            return "Recipient account not found"
+        if not accounts[src].get("activated", True):
+            return "Account is not activated"
+        if not accounts[dst].get("activated", True):
+            return "Recipient account is not activated"
+        src_cur, dst_cur = accounts[src].get("currency", "USD"), accounts[dst].get("currency", "USD")
+        # _check_amount's rules, against the running minor-unit balance
+        debit = to_minor(amount, src_cur) if math.isfinite(amount) else 0
+        if debit <= 0:
+            return "Amount must be positive"
+        if debit > balances[src]:
+            return "Insufficient funds"
+        if src_cur == dst_cur:
+            return debit, debit
+        try:
+            # convert what is actually debited, with CurrencyConverter.convert's arithmetic on
+            # one rate table for the whole batch
+            credit = to_minor(from_minor(debit, src_cur) / table.get_rate(src_cur) * table.get_rate(dst_cur), dst_cur)
+        except Exception as e:
+            return f"Currency conversion failed: {e}"
+        if credit <= 0:
+            return "Amount too small to convert"
+        return debit, credit
+
+    def _commit_transfers(self, accounts, balances, entries):
+        updates = {key: {"balance": from_minor(bal, accounts[key].get("currency", "USD"))} for key, bal in balances.items()}
+        self.store.update_many(updates)
+        self.ledger.append_many(entries)
+        return updates
+
+    def transfer_amount(self, src, dst, amount):
+        """Move `amount` (in src's currency) from src to dst, converted to dst's currency."""
+        dst = dst.strip().upper()
+        with self.locks.hold(src, dst):
+            accounts = self.store.get_many([src, dst])
+            balances = {key: to_minor(acct.get("balance", 0), acct.get("currency", "USD")) for key, acct in accounts.items()}
+            result = self._check_transfer(src, dst, amount, accounts, balances, self.conv.table)
+            if isinstance(result, str):
+                return False, result
+            debit, credit = result
+            src_cur, dst_cur = accounts[src].get("currency", "USD"), accounts[dst].get("currency", "USD")
+            # money leaving the account counts against the withdrawal limits
+            error = self.velocity.withdraw(src, debit, src_cur, accounts[src].get("is_admin", False))
+            if error:
+                return False, error
+            balances[src] -= debit
+            balances[dst] += credit
+            entries = [(src, "transfer_out", debit, src_cur, balances[src]), (dst, "transfer_in", credit, dst_cur, balances[dst])]
+            updates = self._commit_transfers(accounts, balances, entries)
+            sent = f"{from_minor(debit, src_cur)} {src_cur}" + (f" ({from_minor(credit, dst_cur)} {dst_cur})" if src_cur != dst_cur else "")
+            return True, f"Transferred {sent} to {dst}. New balance: {updates[src]['balance']} {src_cur}"
+
+    def apply_transfers(self, transfers, on_reject=None, chunk=TRANSFER_CHUNK, limits=False):
+        """Apply an iterable of {"src", "dst", "amount"} transfers in one pass.
+
+        Transfers are taken `chunk` at a time. Each chunk locks the stripes of every account
+        it touches (in stripe order, so concurrent batches and single transfers cannot
+        deadlock), validates its transfers in order against the running balances, and
+        commits with one update_many and one ledger append. Rejected transfers are passed
+        to on_reject(tx, reason). Returns (applied, rejected). As in apply_batch, money sent
+        only counts against the velocity limits with limits=True.
+        """
+        applied = rejected = 0
+        batch = []
+        for tx in transfers:
+            batch.append(tx)
+            if len(batch) == chunk:
+                done, failed = self._transfer_chunk(batch, on_reject, limits)
+                applied, rejected, batch = applied + done, rejected + failed, []
+        if batch:
+            done, failed = self._transfer_chunk(batch, on_reject, limits)
+            applied, rejected = applied + done, rejected + failed
+        return applied, rejected
+
+    def _transfer_chunk(self, batch, on_reject, limits=False):
+        parsed = []
+        for tx in batch:
+            try:
+                amount = float(tx.get("amount"))
+            except (TypeError, ValueError):
+                amount = None
+            parsed.append((str(tx.get("src", "")).upper(), str(tx.get("dst", "")).upper(), amount))
+        keys = {key for src, dst, _ in parsed for key in (src, dst)}
+        with self.locks.hold(*keys):
+            accounts = self.store.get_many(keys)
+            balances = {key: to_minor(acct.get("balance", 0), acct.get("currency", "USD")) for key, acct in accounts.items()}
+            table = self.conv.table
+            entries = []
+            touched = set()
+            applied = rejected = 0
+            for tx, (src, dst, amount) in zip(batch, parsed):
+                result = "Invalid amount" if amount is None else self._check_transfer(src, dst, amount, accounts, balances, table)
+                if not isinstance(result, str) and limits:
+                    # money leaving the account counts against the withdrawal limits, as in transfer_amount
+                    result = self.velocity.withdraw(src, result[0], accounts[src].get("currency", "USD"), accounts[src].get("is_admin", False)) or result
+                if isinstance(result, str):
+                    rejected += 1
+                    if on_reject is not None:
+                        on_reject(tx, result)
+                    continue
+                debit, credit = result
+                balances[src] -= debit
+                balances[dst] += credit
+                entries.append((src, "transfer_out", debit, accounts[src].get("currency", "USD"), balances[src]))
+                entries.append((dst, "transfer_in", credit, accounts[dst].get("currency", "USD"), balances[dst]))
+                touched.update((src, dst))
+                applied += 1
+            if entries:
+                self._commit_transfers(accounts, {key: balances[key] for key in touched}, entries)
+        return applied, rejected
+
     # --- balance & currency ---
     def view_balance(self, account):
-        db = self._read_database()
-        acct = db.get(account)
+        acct = self.store.get(account)
         if not acct:
             print("Account not found.")
             input("Press Enter to continue...")
@@ -62,19 +254,82 @@ class Features:
         print(f"\nBalance: {acct.get('balance', 0)} {acct.get('currency', 'USD')}")
         input("Press Enter to continue...")
 
+    @staticmethod
+    def _check_amount(op, amount, balance, currency="USD"):
+        # compared in minor units, so amounts below one cent (or yen, ...) count as zero
+        if not math.isfinite(amount) or to_minor(amount, currency) <= 0:
+            return "Amount must be positive"
+        if op == "withdraw" and to_minor(amount, currency) > to_minor(balance, currency):
+            return "Insufficient funds"
+        return None
+
+    # Non-interactive cores return (success, message) like the Admin actions; the menu
+    # methods below only prompt and print.
+    def deposit_amount(self, account, amount):
+        with self.locks.hold(account):
+            acct = self.store.get(account)
+            if not acct:
+                return False, "Account not found."
+            cur = acct.get("currency", "USD")
+            error = self._check_amount("deposit", amount, 0, cur)
+            if error:
+                return False, error
+            units = to_minor(amount, cur)
+            balance = to_minor(acct.get("balance", 0), cur) + units
+            acct["balance"] = from_minor(balance, cur)
+            self.store.update(account, {"balance": acct["balance"]})
+            self.ledger.append(account, "deposit", units, cur, balance)
+            return True, f"Deposit successful. New balance: {acct['balance']} {acct['currency']}"
+
+    def withdraw_amount(self, account, amount):
+        with self.locks.hold(account):
+            acct = self.store.get(account)
+            if not acct:
+                return False, "Account not found."
+            cur = acct.get("currency", "USD")
+            bal = acct.get("balance", 0)
+            error = self._check_amount("withdraw", amount, bal, cur)
+            if error:
+                return False, error
+            units = to_minor(amount, cur)
+            error = self.velocity.withdraw(account, units, cur, acct.get("is_admin", False))
+            if error:
+                return False, error
+            balance = to_minor(bal, cur) - units
+            acct["balance"] = from_minor(balance, cur)
+            self.store.update(account, {"balance": acct["balance"]})
+            self.ledger.append(account, "withdraw", units, cur, balance)
+            return True, f"Withdrawal successful. New balance: {acct['balance']} {acct['currency']}"
+
+    def change_currency_to(self, account, new_cur):
+        with self.locks.hold(account):
+            new_cur = new_cur.strip().upper()
+            acct = self.store.get(account)
+            if not acct:
+                return False, "Account not found."
+            old_cur = acct.get("currency", "USD")
+            if new_cur == old_cur:
+                return False, "Already using that currency"
+            try:
+                amount = acct.get("balance", 0)
+                converted = self.conv.convert(amount, old_cur, new_cur)
+            except Exception as e:
+                return False, f"Currency conversion failed: {e}"
+            balance = to_minor(converted, new_cur)
+            acct["balance"] = from_minor(balance, new_cur)
+            acct["currency"] = new_cur
+            self.store.update(account, {"balance": acct["balance"], "currency": new_cur})
+            self.ledger.append_many([(account, "fx_out", to_minor(amount, old_cur), old_cur, 0), (account, "fx_in", balance, new_cur, balance)])
+            return True, f"Currency changed from {old_cur} to {new_cur}. New balance: {acct['balance']} {new_cur}"
+
     def deposit(self, account):
         try:
             amount = float(input("Amount to deposit: "))
         except ValueError:
             print("Invalid amount")
             return
-        if amount <= 0:
-            print("Amount must be positive")
-            return
-        db = self._read_database()
-        db[account]["balance"] = db[account].get("balance", 0) + amount
-        self._write_database(db)
-        print(f"Deposit successful. New balance: {db[account]['balance']} {db[account]['currency']}")
+        success, msg = self.deposit_amount(account, amount)
+        print(msg)
 
     def withdraw(self, account):
         try:
@@ -82,45 +337,50 @@ class Features:
         except ValueError:
             print("Invalid amount")
             return
-        if amount <= 0:
-            print("Amount must be positive")
-            return
-        db = self._read_database()
-        bal = db[account].get("balance", 0)
-        if amount > bal:
-            print("Insufficient funds")
-            return
-        db[account]["balance"] = bal - amount
-        self._write_database(db)
-        print(f"Withdrawal successful. New balance: {db[account]['balance']} {db[account]['currency']}")
+        success, msg = self.withdraw_amount(account, amount)
+        print(msg)
 
     def change_currency(self, account):
-        new_cur = input("New currency (3-letter code): ").strip().upper()
-        db = self._read_database()
-        acct = db.get(account)
-        if not acct:
-            print("Account not found.")
-            return
-        old_cur = acct.get("currency", "USD")
-        if new_cur == old_cur:
-            print("Already using that currency")
+        new_cur = input("New currency (3-letter code): ")
+        success, msg = self.change_currency_to(account, new_cur)
+        print(msg)
+
+    def transfer(self, account):
+        dst = input("Recipient username: ")
+        try:
+            amount = float(input("Amount to transfer: "))
+        except ValueError:
+            print("Invalid amount")
             return
+        success, msg = self.transfer_amount(account, dst, amount)
+        print(msg)
+
+    # --- statements ---
+    def view_statement(self, account):
         try:
-            amount = acct.get("balance", 0)
-            converted = self.conv.convert(amount, old_cur, new_cur)
-        except Exception as e:
-            print(f"Currency conversion failed: {e}")
+            start = input("From date (YYYY-MM-DD, blank for the beginning): ").strip() or None
+            end = input("To date (YYYY-MM-DD, blank for today): ").strip() or None
+            if start:
+                datetime.date.fromisoformat(start)
+            if end:
+                # the statement includes the whole "to" day
+                end = (datetime.date.fromisoformat(end) + datetime.timedelta(days=1)).isoformat()
+        except ValueError:
+            print("Invalid date")
+            input("Press Enter to continue...")
             return
-        acct["balance"] = round(converted, 2)
-        acct["currency"] = new_cur
-        db[account] = acct
-        self._write_database(db)
-        print(f"Currency changed from {old_cur} to {new_cur}. New balance: {acct['balance']} {new_cur}")
+        print(f"\n{'Date':<20}{'Operation':<12}{'Amount':>16}{'Balance':>16}")
+        count = 0
+        for row in self.ledger.statement(account, start, end):
+            print(f"{row['time'][:19].replace('T', ' '):<20}{row['op']:<12}{row['amount']:>16} {row['currency']}{row['balance']:>12} {row['currency']}")
+            count += 1
+        if not count:
+            print("No transactions in this period")
+        input("\nPress Enter to continue...")
 
     # --- card management ---
     def card_settings(self, account):
-        db = self._read_database()
-        acct = db.get(account)
+        acct = self.store.get(account)
         if not acct:
             print("Account not found.")
             input("Press Enter to continue...")
@@ -154,9 +414,36 @@ class Features:
             else:
                 print("Unknown option")
 
+    def add_card(self, account, number, expiration, card_type="VISA", kind="CREDIT", cvc=0):
+        with self.locks.hold(account):
+            acct = self.store.get(account)
+            if not acct:
+                return False, "Account not found."
+            if acct.get("card"):
+                return False, "A card is already registered. Unregister first."
+            card = {
+                "number": number,
+                "expiration": expiration,
+                "card": card_type,
+                "type": kind,
+                "CVC": cvc,
+            }
+            self.store.update(account, {"card": card})
+            return True, "Card registered"
+
+    def remove_card(self, account):
+        with self.locks.hold(account):
+            acct = self.store.get(account)
+            if not acct:
+                return False, "Account not found."
+            if not acct.get("card"):
+                return False, "No card to unregister"
+            acct.pop("card", None)
+            self.store.put(account, acct)
+            return True, "Card unregistered"
+
     def register_card(self, account):
-        db = self._read_database()
-        acct = db.get(account)
+        acct = self.store.get(account)
         if acct.get("card"):
             print("A card is already registered. Unregister first.")
             input("Press Enter to continue...")
@@ -171,25 +458,11 @@ class Features:
             print("Invalid input for card fields")
             input("Press Enter to continue...")
             return
-        acct["card"] = {
-            "number": number,
-            "expiration": expiration,
-            "card": card_type,
-            "type": kind,
-            "CVC": cvc,
-        }
-        db[account] = acct
-        self._write_database(db)
-        print("Card registered")
+        success, msg = self.add_card(account, number, expiration, card_type, kind, cvc)
+        print(msg)
 
     def unregister_card(self, account):
-        db = self._read_database()
-        acct = db.get(account)
-        if not acct.get("card"):
-            print("No card to unregister")
+        success, msg = self.remove_card(account)
+        print(msg)
+        if not success:
             input("Press Enter to continue...")
-            return
-        acct.pop("card", None)
-        db[account] = acct
-        self._write_database(db)
-        print("Card unregistered")
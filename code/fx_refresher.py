@@ -0,0 +1,79 @@
+import datetime
+import os
+import random
+import threading
+import time
+import requests
+from dotenv import load_dotenv
+from currency_exchange import RateTable
+from fas_currency import fetch_rates, store_rates
+
+
+class RateRefresher(threading.Thread):
+    """Daemon thread that re-fetches rates every `ttl` seconds (+/- jitter) and hot-swaps them.
+
+    Each refresh writes currency.db atomically, appends to the rate history and then
+    replaces the converter's RateTable in one assignment; convert() calls already in
+    flight keep using the table they started with.
+    """
+
+    def __init__(self, converter, key=None, ttl=3600, jitter=0.1, url=None):
+        super().__init__(name="fx-refresher", daemon=True)
+        if key is None:
+            load_dotenv()
+            key = os.getenv("CURRENCY_KEY")
+        if not key:
+            raise ValueError("CURRENCY_KEY not found in .env file")
+        self.converter = converter
+        self.key = key
+        self.ttl = ttl
+        self.jitter = jitter
+        self.url = url
+        self.session = requests.Session()
+        self._stop_event = threading.Event()
+        self.refreshes = 0
+        self.failures = 0
+        self.last_latency = None
+        self.last_error = None
+
+    def refresh_once(self):
+        start = time.perf_counter()
+        try:
+            cleaned = fetch_rates(self.key, session=self.session, url=self.url)
+            store_rates(cleaned, self.converter.db_path.parent)
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            self.last_latency = time.perf_counter() - start
+            return False
+        self.converter.swap(RateTable.from_dict(cleaned))
+        self.last_latency = time.perf_counter() - start
+        self.refreshes += 1
+        return True
+
+    def run(self):
+        while not self._stop_event.wait(self.ttl * random.uniform(1 - self.jitter, 1 + self.jitter)):
+            self.refresh_once()
+
+    def stop(self):
+        self._stop_event.set()
+        self.session.close()
+
+    def staleness(self):
+        """Seconds since the rates in use were fetched."""
+        table = self.converter.table
+        if table.last_updated:
+            updated = datetime.datetime.fromisoformat(table.last_updated).replace(tzinfo=datetime.timezone.utc).timestamp()
+        else:
+            updated = table.loaded_at
+        return time.time() - updated
+
+    def metrics(self):
+        return {
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "last_latency": self.last_latency,
+            "staleness": self.staleness(),
+            "last_error": self.last_error,
+        }
+
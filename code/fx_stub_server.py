@@ -0,0 +1,60 @@
+"""Local stand-in for the apilayer `live` endpoint, for exercising the rate refresher offline.
+
+    python fx_stub_server.py --port 8765
+    CURRENCY_API_URL=http://127.0.0.1:8765/api/live CURRENCY_KEY=test BANK_FX_REFRESH_TTL=5 python main.py
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+import argparse
+import json
+import random
+import time
+
+BASE_DIR = Path(__file__).resolve().parent
+CURRENCY_DB = BASE_DIR.parent / "db" / "currency.db"
+
+
+def make_handler(rates, drift=0.01, fail_rate=0.0):
+    class LiveHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if url.path != "/api/live":
+                self.send_error(404)
+                return
+            if not query.get("access_key") or random.random() < fail_rate:
+                body = {"success": False, "error": {"code": 101, "info": "You have not supplied a valid API Access Key."}}
+            else:
+                quotes = {f"USD{code}": round(rate * random.uniform(1 - drift, 1 + drift), 6) for code, rate in rates.items()}
+                body = {"success": True, "timestamp": int(time.time()), "source": "USD", "quotes": quotes}
+            payload = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return LiveHandler
+
+
+def serve(port=0, rates=None, drift=0.01, fail_rate=0.0):
+    """Create (but do not start) the stub server; port 0 picks a free port."""
+    if rates is None:
+        with open(CURRENCY_DB, "r") as f:
+            rates = json.load(f)["rates"]
+    return ThreadingHTTPServer(("127.0.0.1", port), make_handler(rates, drift, fail_rate))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--drift", type=float, default=0.01, help="random relative change applied to each rate")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with success=false")
+    args = parser.parse_args()
+    server = serve(args.port, drift=args.drift, fail_rate=args.fail_rate)
+    print(f"Serving fake rates on http://127.0.0.1:{server.server_address[1]}/api/live")
+    server.serve_forever()
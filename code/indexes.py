@@ -0,0 +1,134 @@
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+import heapq
+
+# equality-indexed fields; balance ranges use a separate sorted list
+INDEXED_FIELDS = ("currency", "activated", "is_admin", "card_brand", "card_type")
+FILTERS = INDEXED_FIELDS + ("min_balance", "max_balance")
+
+
+def index_values(acct):
+    """(indexed field values, balance) for an account dict."""
+    card = acct.get("card") or {}
+    values = (
+        acct.get("currency", "USD"),
+        bool(acct.get("activated", True)),
+        bool(acct.get("is_admin", False)),
+        card.get("card"),
+        card.get("type"),
+    )
+    return values, acct.get("balance", 0)
+
+
+def matches(filters, values, balance):
+    for field, value in zip(INDEXED_FIELDS, values):
+        if field in filters and filters[field] != value:
+            return False
+    if "min_balance" in filters and balance < filters["min_balance"]:
+        return False
+    if "max_balance" in filters and balance > filters["max_balance"]:
+        return False
+    return True
+
+
+def check_filters(filters):
+    unknown = set(filters) - set(FILTERS)
+    if unknown:
+        raise ValueError(f"Unknown search filter: {', '.join(sorted(unknown))}")
+
+
+def scan_search(items, filters, offset=0, limit=20):
+    """Filter (key, acct) pairs by streaming over them; returns (total, page of pairs) ordered
+    like AccountIndex.search()."""
+    check_filters(filters)
+    total = 0
+
+    def hits():
+        nonlocal total
+        for key, acct in items:
+            values, balance = index_values(acct)
+            if matches(filters, values, balance):
+                total += 1
+                yield (balance, key) if by_balance else key, key, acct
+
+    by_balance = "min_balance" in filters or "max_balance" in filters
+    page = heapq.nsmallest(offset + limit, hits(), key=lambda hit: hit[0])
+    return total, [(key, acct) for _, key, acct in page[offset:]]
+
+
+class AccountIndex:
+    """Secondary indexes over an in-memory account set, maintained one account at a time.
+
+    Each indexed field maps value -> set of keys; balances live in a sorted list of
+    (balance, key) for range queries. search() intersects the smallest sets first and
+    only returns the keys for the requested page.
+    """
+
+    def __init__(self):
+        self.sets = {field: defaultdict(set) for field in INDEXED_FIELDS}
+        self.balances = []
+        self.entries = {}
+
+    def add(self, key, values, balance):
+        if key in self.entries:
+            self.remove(key)
+        self.entries[key] = (values, balance)
+        for field, value in zip(INDEXED_FIELDS, values):
+            self.sets[field][value].add(key)
+        insort(self.balances, (balance, key))
+
+    def add_many(self, entries):
+        """Index (key, values, balance) triples in bulk: one sort instead of an insort each."""
+        added = []
+        for key, values, balance in entries:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (values, balance)
+            for field, value in zip(INDEXED_FIELDS, values):
+                self.sets[field][value].add(key)
+            added.append((balance, key))
+        self.balances.extend(added)
+        self.balances.sort()
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        values, balance = entry
+        for field, value in zip(INDEXED_FIELDS, values):
+            keys = self.sets[field][value]
+            keys.discard(key)
+            if not keys:
+                del self.sets[field][value]
+        i = bisect_left(self.balances, (balance, key))
+        if i < len(self.balances) and self.balances[i] == (balance, key):
+            del self.balances[i]
+
+    def search(self, filters, offset=0, limit=20):
+        """Return (total matches, keys for the page). Pages are in key order, or balance order
+        when a balance range is given."""
+        check_filters(filters)
+        candidates = None
+        for field in sorted((f for f in INDEXED_FIELDS if f in filters), key=lambda f: len(self.sets[f].get(filters[f], ()))):
+            keys = self.sets[field].get(filters[field], set())
+            candidates = set(keys) if candidates is None else candidates & keys
+            if not candidates:
+                return 0, []
+
+        if "min_balance" in filters or "max_balance" in filters:
+            lo = bisect_left(self.balances, (filters["min_balance"],)) if "min_balance" in filters else 0
+            hi = bisect_right(self.balances, (filters["max_balance"], chr(0x10FFFF))) if "max_balance" in filters else len(self.balances)
+            in_range = (self.balances[i][1] for i in range(lo, hi))
+            if candidates is not None:
+                in_range = (key for key in in_range if key in candidates)
+            total = 0
+            page = []
+            for key in in_range:
+                if offset <= total < offset + limit:
+                    page.append(key)
+                total += 1
+            return total, page
+
+        if candidates is None:
+            candidates = self.entries.keys()
+        return len(candidates), heapq.nsmallest(offset + limit, candidates)[offset:]
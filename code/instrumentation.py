@@ -0,0 +1,194 @@
+"""Lightweight timers/counters for storage, JSON and currency calls.
+
+Set BANK_INSTRUMENT=1 to collect stats. When it is unset, timed() returns the function
+unchanged and instrument_store() returns the store itself, so the hot paths pay nothing.
+BANK_PROFILE=cpu, memory or all additionally runs cProfile and/or tracemalloc and writes
+the results (bank.pstats, bank_memory.txt) to BANK_PROFILE_OUT (default: current directory)
+at exit.
+"""
+from pathlib import Path
+import atexit
+import functools
+import json
+import os
+import time
+
+INSTRUMENT_ENV = "BANK_INSTRUMENT"
+PROFILE_ENV = "BANK_PROFILE"
+PROFILE_OUT_ENV = "BANK_PROFILE_OUT"
+
+ENABLED = os.getenv(INSTRUMENT_ENV, "") not in ("", "0")
+
+_stats = {}
+
+
+def record(name, seconds, nbytes=0):
+    stat = _stats.get(name)
+    if stat is None:
+        stat = _stats[name] = [0, 0.0, 0, 0.0]
+    stat[0] += 1
+    stat[1] += seconds
+    stat[2] += nbytes
+    if seconds > stat[3]:
+        stat[3] = seconds
+
+
+def timed(name):
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorate
+
+
+# --- JSON helpers used by the stores ---
+def load_json(f):
+    if not ENABLED:
+        return json.load(f)
+    start = time.perf_counter()
+    text = f.read()
+    record("file.read", time.perf_counter() - start, len(text))
+    start = time.perf_counter()
+    data = json.loads(text)
+    record("json.parse", time.perf_counter() - start, len(text))
+    return data
+
+
+def dump_json(data, f, indent=4):
+    if not ENABLED:
+        json.dump(data, f, indent=indent)
+        return
+    start = time.perf_counter()
+    text = json.dumps(data, indent=indent)
+    record("json.dump", time.perf_counter() - start, len(text))
+    start = time.perf_counter()
+    f.write(text)
+    record("file.write", time.perf_counter() - start, len(text))
+
+
+class InstrumentedStore:
+    """Proxy that times every store method as store.<method>."""
+
+    def __init__(self, store):
+        self._store = store
+        self._kind = type(store).__name__
+
+    def __getattr__(self, name):
+        attr = getattr(self._store, name)
+        # stats() reports on the store; timing it would only add itself to the report
+        if name.startswith("_") or name == "stats" or not callable(attr):
+            return attr
+        label = f"store.{name}"
+
+        @functools.wraps(attr)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                record(label, time.perf_counter() - start)
+
+        return wrapper
+
+    def __contains__(self, key):
+        start = time.perf_counter()
+        try:
+            return key in self._store
+        finally:
+            record("store.contains", time.perf_counter() - start)
+
+
+def instrument_store(store):
+    return InstrumentedStore(store) if ENABLED else store
+
+
+# --- reporting ---
+def snapshot():
+    return {
+        name: {"count": count, "total_ms": seconds * 1000, "avg_ms": seconds * 1000 / count, "max_ms": slowest * 1000, "bytes": nbytes}
+        for name, (count, seconds, nbytes, slowest) in sorted(_stats.items())
+    }
+
+
+def store_stats(store):
+    """The store's own counters (CachedStore: cache hits, misses, flushes), or None.
+
+    These are counted whether or not instrumentation is enabled."""
+    stats = getattr(store, "stats", None)
+    return stats() if stats is not None else None
+
+
+def format_cache(cache):
+    lookups = cache["hits"] + cache["misses"]
+    rate = 100 * cache["hits"] / lookups if lookups else 0
+    return f"Account cache: {cache['hits']} hits, {cache['misses']} misses ({rate:.1f}% hits), {cache['flushes']} flushes, {cache['dirty']} dirty"
+
+
+def format_stats(store=None):
+    cache = store_stats(store)
+    stats = snapshot()
+    if not ENABLED:
+        lines = [f"Instrumentation is disabled (set {INSTRUMENT_ENV}=1 to enable)."]
+    elif not stats:
+        lines = ["No calls recorded yet."]
+    else:
+        lines = [f"{'name':<22}{'count':>9}{'total ms':>12}{'avg ms':>10}{'max ms':>10}{'bytes':>14}"]
+        for name, s in stats.items():
+            lines.append(f"{name:<22}{s['count']:>9}{s['total_ms']:>12.2f}{s['avg_ms']:>10.3f}{s['max_ms']:>10.3f}{s['bytes']:>14}")
+    if cache is not None:
+        lines.append("\n" + format_cache(cache))
+    return "\n".join(lines)
+
+
+def export(path, store=None):
+    with open(path, "w") as f:
+        json.dump({"enabled": ENABLED, "stats": snapshot(), "cache": store_stats(store)}, f, indent=4)
+
+
+def reset():
+    _stats.clear()
+
+
+# --- optional profilers ---
+def start_profiling():
+    """Start cProfile and/or tracemalloc if BANK_PROFILE asks for them; results are written at exit."""
+    mode = os.getenv(PROFILE_ENV, "").lower()
+    if not mode:
+        return
+    out = Path(os.getenv(PROFILE_OUT_ENV) or ".")
+    out.mkdir(parents=True, exist_ok=True)
+    if mode in ("cpu", "all"):
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        def dump_cpu():
+            profiler.disable()
+            profiler.dump_stats(out / "bank.pstats")
+
+        atexit.register(dump_cpu)
+    if mode in ("memory", "all"):
+        import tracemalloc
+
+        tracemalloc.start()
+
+        def dump_memory():
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics("lineno")[:25]
+            with open(out / "bank_memory.txt", "w") as f:
+                f.write(f"current {current} bytes, peak {peak} bytes\n\n")
+                f.writelines(f"{stat}\n" for stat in top)
+            tracemalloc.stop()
+
+        atexit.register(dump_memory)
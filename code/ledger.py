@@ -0,0 +1,324 @@
+from array import array
+from pathlib import Path
+import argparse
+import csv
+import datetime
+import mmap
+import os
+import struct
+import sys
+import time
+from accounts import from_minor
+from locks import FileLock
+from rate_history import to_timestamp
+
+BASE_DIR = Path(__file__).resolve().parent
+LEDGER_DIR = BASE_DIR.parent / "db" / "ledger"
+
+# timestamp (µs), account id, currency id, op, amount, resulting balance (both minor units),
+# previous record of the same account (-1 for the first one)
+RECORD = struct.Struct("<qIHBxqqq")
+HEAD = struct.Struct("<q")
+HEADS_BULK = 1024
+OPS = ("deposit", "withdraw", "fx_out", "fx_in", "interest", "fee", "transfer_out", "transfer_in")
+COLUMNS = ("time", "account", "op", "amount", "currency", "balance")
+
+_shared_ledgers = {}
+
+
+def open_ledger(path=LEDGER_DIR):
+    # one instance per directory, so every Features in the process appends to the same chains
+    path = Path(path).resolve()
+    if path not in _shared_ledgers:
+        _shared_ledgers[path] = Ledger(path)
+    return _shared_ledgers[path]
+
+
+class Ledger:
+    """Append-only transaction ledger of fixed-width binary records.
+
+    ledger.bin holds the records; each one points back to the previous record of the same
+    account. heads.bin is the per-account offset index: the number of records it covers,
+    then the newest record number for each account id. accounts.txt and currencies.txt
+    map ids to names (one per line). A statement follows one account's chain through the
+    memory-mapped ledger, so it never touches other accounts' records.
+
+    Appends hold ledger.lock and re-read the files first, so several processes can share
+    one ledger; readers only follow records the index already covers.
+    """
+
+    def __init__(self, path=LEDGER_DIR, sync=False):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.ledger_file = self.path / "ledger.bin"
+        self.heads_file = self.path / "heads.bin"
+        self.sync = sync
+        self.names = {"accounts": [], "currencies": []}
+        self.ids = {"accounts": {}, "currencies": {}}
+        self._name_pos = {"accounts": 0, "currencies": 0}
+        self._map = None
+        self._mapped_size = -1
+        self._count = 0
+        self._last_time = (None, None)
+        self._name_files = {}
+        self._commit = FileLock(self.path / "ledger.lock")
+        self._ledger = open(self.ledger_file, "ab")
+        self._heads_fd = os.open(self.heads_file, os.O_RDWR | os.O_CREAT, 0o644)
+        with self._commit:
+            self._sync()
+
+    # --- id tables ---
+    def _load_names(self, kind):
+        file = self.path / f"{kind}.txt"
+        if not file.exists():
+            return
+        with open(file, "rb") as f:
+            f.seek(self._name_pos[kind])
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # still being written (or torn by a crash, and then never used)
+                    break
+                self._name_pos[kind] += len(line)
+                self.ids[kind][line[:-1].decode()] = len(self.names[kind])
+                self.names[kind].append(line[:-1].decode())
+
+    def _id(self, kind, name):
+        # called with the lock held and the tables freshly synced
+        i = self.ids[kind].get(name)
+        if i is None:
+            i = len(self.names[kind])
+            f = self._name_files.get(kind)
+            if f is None:
+                f = self._name_files[kind] = open(self.path / f"{kind}.txt", "ab")
+            # flushed by append_many before any record refers to it
+            line = (name + "\n").encode()
+            f.write(line)
+            self._name_pos[kind] += len(line)
+            self.names[kind].append(name)
+            self.ids[kind][name] = i
+        return i
+
+    # --- offset index ---
+    def _sync(self):
+        """Catch up with other writers and repair a crashed append (lock held)."""
+        for kind in self.names:
+            self._load_names(kind)
+        size = os.fstat(self._ledger.fileno()).st_size
+        count = size // RECORD.size
+        if size % RECORD.size:
+            # drop a torn record left behind by a crash mid-append
+            os.truncate(self.ledger_file, count * RECORD.size)
+        covered = self._covered()
+        self._count = count
+        if covered < count:
+            # records appended after the last index update: re-link them
+            _, records = self._view()
+            for n in range(covered, count):
+                self._set_head(RECORD.unpack_from(records, n * RECORD.size)[1], n)
+            self._write_count()
+
+    def _covered(self):
+        raw = os.pread(self._heads_fd, HEAD.size, 0)
+        return HEAD.unpack(raw)[0] if len(raw) == HEAD.size else 0
+
+    def _head(self, account_id):
+        raw = os.pread(self._heads_fd, HEAD.size, HEAD.size * (account_id + 1))
+        return HEAD.unpack(raw)[0] if len(raw) == HEAD.size else -1
+
+    def _set_head(self, account_id, n):
+        os.pwrite(self._heads_fd, HEAD.pack(n), HEAD.size * (account_id + 1))
+
+    def _heads_table(self, count):
+        """The newest record of account ids 0..count-1 as one array (lock held)."""
+        table = array("q", os.pread(self._heads_fd, HEAD.size * count, HEAD.size))
+        table.extend([-1] * (count - len(table)))
+        return table
+
+    def _set_heads(self, heads, table=None):
+        """Write {account id: record} (lock held), through `table` for big batches."""
+        if table is None:
+            for account_id, n in heads.items():
+                self._set_head(account_id, n)
+            return
+        # the whole index in one write instead of a pwrite per account
+        table.extend([-1] * (len(self.names["accounts"]) - len(table)))
+        for account_id, n in heads.items():
+            table[account_id] = n
+        os.pwrite(self._heads_fd, table.tobytes(), HEAD.size)
+
+    def _write_count(self):
+        os.pwrite(self._heads_fd, HEAD.pack(self._count), 0)
+
+    def _view(self):
+        size = self._count * RECORD.size
+        if size != self._mapped_size:
+            self._close_map()
+            self._mapped_size = size
+            if size:
+                with open(self.ledger_file, "rb") as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._map = mm, memoryview(mm)[:size]
+        if self._map is None:
+            return None, b""
+        return self._map
+
+    def _close_map(self):
+        if self._map is not None:
+            (mm, view), self._map = self._map, None
+            view.release()
+            mm.close()
+
+    # --- writing ---
+    def append(self, account, op, amount, currency, balance, when=None):
+        """Record one operation; amount and balance are integer minor units of currency."""
+        return self.append_many([(account, op, amount, currency, balance)], when)
+
+    def append_many(self, entries, when=None):
+        """Record (account, op, amount, currency, balance) entries with a single write."""
+        with self._commit:
+            # stamped under the lock, so records are in time order and statements (which stop
+            # at the first record older than their start) never skip one
+            ts = to_timestamp(when) if when is not None else time.time_ns() // 1000
+            self._sync()
+            chunks = []
+            pending = {}
+            n = self._count
+            # ids past the end of the index (new ones, or left by a crash) have no records yet
+            first_new = min(max(os.fstat(self._heads_fd).st_size // HEAD.size - 1, 0), len(self.names["accounts"]))
+            table = self._heads_table(first_new) if len(entries) >= HEADS_BULK else None
+            for account, op, amount, currency, balance in entries:
+                account_id = self._id("accounts", account)
+                if account_id in pending:
+                    prev = pending[account_id]
+                elif account_id >= first_new:
+                    prev = -1
+                else:
+                    prev = table[account_id] if table is not None else self._head(account_id)
+                chunks.append(RECORD.pack(ts, account_id, self._id("currencies", currency), OPS.index(op), amount, balance, prev))
+                pending[account_id] = n
+                n += 1
+            if not chunks:
+                return None
+            for f in self._name_files.values():
+                f.flush()
+            if first_new < len(self.names["accounts"]):
+                # give them index slots before any record can point at them
+                os.pwrite(self._heads_fd, HEAD.pack(-1) * (len(self.names["accounts"]) - first_new), HEAD.size * (first_new + 1))
+            self._ledger.write(b"".join(chunks))
+            self._ledger.flush()
+            if self.sync:
+                os.fsync(self._ledger.fileno())
+            self._set_heads(pending, table)
+            self._count = n
+            self._write_count()
+        return n - 1
+
+    def flush(self):
+        """fsync everything appended so far (one call covers many appends when sync=False)."""
+        for f in (self._ledger, *self._name_files.values()):
+            os.fsync(f.fileno())
+        os.fsync(self._heads_fd)
+
+    # --- reading ---
+    def _refresh(self):
+        # no lock needed: records below the covered count are complete and their names written
+        for kind in self.names:
+            self._load_names(kind)
+        self._count = self._covered()
+
+    def _values(self, record):
+        ts, account_id, currency_id, op, amount, balance, _ = record
+        currency = self.names["currencies"][currency_id]
+        # records written by one append_many share a timestamp; format it once
+        if self._last_time[0] != ts:
+            self._last_time = ts, datetime.datetime.fromtimestamp(ts / 1_000_000, datetime.timezone.utc).isoformat()
+        return self._last_time[1], self.names["accounts"][account_id], OPS[op], from_minor(amount, currency), currency, from_minor(balance, currency)
+
+    def statement(self, account, start=None, end=None):
+        """Yield one account's records with start <= time < end as dicts, oldest first."""
+        return (dict(zip(COLUMNS, self._values(record))) for record in self._chain(account, start, end))
+
+    def records(self, start=None, end=None):
+        """Yield every record with start <= time < end as dicts, in ledger order."""
+        return (dict(zip(COLUMNS, self._values(record))) for record in self._scan(start, end))
+
+    def _chain(self, account, start=None, end=None):
+        self._refresh()
+        account_id = self.ids["accounts"].get(account)
+        if account_id is None:
+            return
+        start = to_timestamp(start) if start is not None else None
+        end = to_timestamp(end) if end is not None else None
+        _, records = self._view()
+        # walk the chain newest -> oldest, keeping only record numbers in the range
+        picked = array("q")
+        n = self._head(account_id)
+        while 0 <= n < self._count:
+            record = RECORD.unpack_from(records, n * RECORD.size)
+            if record[1] != account_id or (start is not None and record[0] < start):
+                break
+            if end is None or record[0] < end:
+                picked.append(n)
+            n = record[6]
+        for n in reversed(picked):
+            yield RECORD.unpack_from(records, n * RECORD.size)
+
+    def _scan(self, start=None, end=None, chunk=1 << 20):
+        # plain chunked reads rather than the mapping, so a full export keeps no pages resident
+        start = to_timestamp(start) if start is not None else None
+        end = to_timestamp(end) if end is not None else None
+        self._refresh()
+        remaining = self._count * RECORD.size
+        step = chunk // RECORD.size * RECORD.size
+        with open(self.ledger_file, "rb") as f:
+            while remaining > 0:
+                data = f.read(min(step, remaining))
+                remaining -= len(data)
+                for record in RECORD.iter_unpack(data):
+                    if (start is None or record[0] >= start) and (end is None or record[0] < end):
+                        yield record
+
+    def __len__(self):
+        self._refresh()
+        return self._count
+
+    def close(self):
+        self._close_map()
+        for f in self._name_files.values():
+            f.close()
+        self._name_files.clear()
+        if self._ledger is not None:
+            self._ledger.close()
+            os.close(self._heads_fd)
+            self._ledger = None
+
+
+def export_csv(out, ledger, account=None, start=None, end=None):
+    """Stream ledger rows (one account's statement, or everything) to a CSV file object."""
+    records = ledger._chain(account, start, end) if account else ledger._scan(start, end)
+    writer = csv.writer(out)
+    writer.writerow(COLUMNS)
+    count = 0
+    for record in records:
+        writer.writerow(ledger._values(record))
+        count += 1
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the transaction ledger to CSV.")
+    parser.add_argument("out", help="CSV file to write ('-' for stdout)")
+    parser.add_argument("--account", help="only this account (username)")
+    parser.add_argument("--from", dest="start", help="start date/time (ISO), inclusive")
+    parser.add_argument("--to", dest="end", help="end date/time (ISO), exclusive")
+    parser.add_argument("--ledger", type=Path, default=LEDGER_DIR)
+    args = parser.parse_args()
+    ledger = Ledger(args.ledger)
+    account = args.account.upper() if args.account else None
+    if args.out == "-":
+        count = export_csv(sys.stdout, ledger, account, args.start, args.end)
+    else:
+        with open(args.out, "w", newline="") as f:
+            count = export_csv(f, ledger, account, args.start, args.end)
+    ledger.close()
+    print(f"Exported {count} ledger rows", file=sys.stderr)
@@ -0,0 +1,103 @@
+"""Cross-process locks for the db/ directory.
+
+FileLock guards a whole file's read-modify-write (the store commit). StripedLocks maps
+accounts onto a fixed number of stripes (byte ranges of one lock file), so operations on
+different accounts rarely wait for each other. Both also lock against other threads of the
+same process. Without fcntl (Windows) they fall back to thread-only locking.
+"""
+from contextlib import contextmanager
+from pathlib import Path
+import os
+import threading
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+_shared_locks = {}
+
+
+class FileLock:
+    """Exclusive flock on a lock file; re-entrant within a thread."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._thread_lock = threading.RLock()
+        self._fd = None
+        self._pid = None
+        self._depth = 0
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            try:
+                # flock belongs to the open file, which a forked child shares with its
+                # parent: each process needs a descriptor of its own to exclude the others
+                if self._fd is None or self._pid != os.getpid():
+                    self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                    self._pid = os.getpid()
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except BaseException:
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0 and fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+
+def open_locks(path, stripes=64):
+    # one instance per lock file: fcntl record locks belong to the process, so threads
+    # must share the same in-process locks to exclude each other
+    path = Path(path).resolve()
+    if path not in _shared_locks:
+        _shared_locks[path] = StripedLocks(path, stripes)
+    return _shared_locks[path]
+
+
+class StripedLocks:
+    """Per-account locks: crc32(username) picks one of `stripes` byte-range locks."""
+
+    def __init__(self, path, stripes=64):
+        self.path = Path(path)
+        self.stripes = stripes
+        self._threads = [threading.Lock() for _ in range(stripes)]
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644) if fcntl is not None else None
+
+    def stripe(self, key):
+        return zlib.crc32(key.upper().encode()) % self.stripes
+
+    @contextmanager
+    def hold(self, *keys):
+        """Lock the stripes of every key, in stripe order so two holders can never deadlock."""
+        with self._hold(sorted({self.stripe(key) for key in keys})):
+            yield
+
+    def hold_all(self):
+        return self._hold(range(self.stripes))
+
+    @contextmanager
+    def _hold(self, stripes):
+        held = []
+        try:
+            for stripe in stripes:
+                self._threads[stripe].acquire()
+                try:
+                    if fcntl is not None:
+                        fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, stripe)
+                except BaseException:
+                    self._threads[stripe].release()
+                    raise
+                held.append(stripe)
+            yield
+        finally:
+            for stripe in reversed(held):
+                if fcntl is not None:
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, stripe)
+                self._threads[stripe].release()
@@ -1,25 +1,26 @@
 from pathlib import Path
+import argparse
 import json
 import os
+import shlex
+import sys
+import time
+import instrumentation
+from admin import bulk_operation, bulk_screen, search_screen
 from features import Features
+from locks import open_locks
+from storage import STORAGE_ENV, WRITE_BACK_ENV, open_store
 
 BASE_DIR = Path(__file__).resolve().parent
 DB_DIR = BASE_DIR.parent / "db"
-USER_DB = DB_DIR / "user.db"
 DATABASE_DB = DB_DIR / "database.db"
 
 
-def ensure_user_db():
-    if not USER_DB.exists():
-        USER_DB.parent.mkdir(parents=True, exist_ok=True)
-        USER_DB.write_text(json.dumps({"logged in": False, "account": ""}, indent=4))
-
-
-def ensure_database():
-    if not DATABASE_DB.exists():
-        DATABASE_DB.parent.mkdir(parents=True, exist_ok=True)
+def ensure_database(store, db_dir=DB_DIR):
+    if not store.exists():
+        Path(db_dir).mkdir(parents=True, exist_ok=True)
         default = {"ADMIN": {"password": "admin000", "currency": "USD", "balance": 0, "activated": True, "card": None, "is_admin": True}}
-        DATABASE_DB.write_text(json.dumps(default, indent=4))
+        store.replace_all(default)
 
 
 def clear_terminal():
@@ -37,10 +38,11 @@ def logged_out_menu():
 
 
 def user_menu(is_admin=False):
+    # new entries go at the end, so the numbers users (and scripts) know keep their meaning
     print("\n1. View Balance\n2. Deposit Money\n3. Withdraw Money\n4. Change Currency" "\n5. Card Settings\n6. Log Out")
     if is_admin:
         print("7. Admin Control Panel")
-    print("0. Exit\n")
+    print("8. View Statement\n9. Transfer Money\n0. Exit\n")
     try:
         return int(input("> "))
     except ValueError:
@@ -51,65 +53,71 @@ def user_menu(is_admin=False):
 class Admin:
     """Admin functionality integrated into main.py"""
 
-    def __init__(self, db_dir: Path):
+    def __init__(self, db_dir: Path, store=None):
         self.db_dir = db_dir
         self.database_db = db_dir / "database.db"
+        self.store = store if store is not None else open_store(db_dir)
+        self.locks = open_locks(db_dir / "accounts.lock")
 
     def _read_database(self):
-        with open(self.database_db, "r") as f:
-            return json.load(f)
+        return self.store.all()
 
     def _write_database(self, data):
-        with open(self.database_db, "w") as f:
-            json.dump(data, f, indent=4)
+        self.store.replace_all(data)
 
-    # --- Admin actions ---
+    # --- Admin actions (each holds the account's stripe from check to write, like Features) ---
     def create_account(self, username, password, currency="USD", is_admin=False):
         key = username.upper()
-        db = self._read_database()
-        if key in db:
-            return False, "Account already exists"
-        db[key] = {"password": password, "currency": currency.upper(), "balance": 0, "activated": True, "card": None, "is_admin": is_admin}
-        self._write_database(db)
-        return True, f"Account {key} created"
+        with self.locks.hold(key):
+            if key in self.store:
+                return False, "Account already exists"
+            self.store.put(key, {"password": password, "currency": currency.upper(), "balance": 0, "activated": True, "card": None, "is_admin": is_admin})
+            return True, f"Account {key} created"
 
     def delete_account(self, username):
         key = username.upper()
-        db = self._read_database()
-        if key not in db:
-            return False, "Account not found"
-        db.pop(key)
-        self._write_database(db)
-        return True, f"Account {key} deleted"
+        with self.locks.hold(key):
+            if key not in self.store:
+                return False, "Account not found"
+            self.store.delete(key)
+            return True, f"Account {key} deleted"
 
     def activate_account(self, username):
         key = username.upper()
-        db = self._read_database()
-        if key not in db:
-            return False, "Account not found"
-        db[key]["activated"] = True
-        self._write_database(db)
-        return True, f"Account {key} activated"
+        with self.locks.hold(key):
+            if key not in self.store:
+                return False, "Account not found"
+            self.store.update(key, {"activated": True})
+            return True, f"Account {key} activated"
 
     def deactivate_account(self, username):
         key = username.upper()
-        db = self._read_database()
-        if key not in db:
-            return False, "Account not found"
-        db[key]["activated"] = False
-        self._write_database(db)
-        return True, f"Account {key} deactivated"
+        with self.locks.hold(key):
+            if key not in self.store:
+                return False, "Account not found"
+            self.store.update(key, {"activated": False})
+            return True, f"Account {key} deactivated"
 
     def change_details(self, username, **kwargs):
         key = username.upper()
-        db = self._read_database()
-        if key not in db:
-            return False, "Account not found"
-        for k, v in kwargs.items():
-            if k in db[key]:
-                db[key][k] = v
-        self._write_database(db)
-        return True, f"Account {key} updated"
+        with self.locks.hold(key):
+            acct = self.store.get(key)
+            if acct is None:
+                return False, "Account not found"
+            self.store.update(key, {k: v for k, v in kwargs.items() if k in acct})
+            return True, f"Account {key} updated"
+
+    def bulk_operation(self, action, usernames=None, predicate=None, fields=None, dry_run=False, progress=None):
+        if dry_run:
+            return bulk_operation(self.store, action, usernames, predicate, fields, dry_run, progress)
+        # every stripe, as in Features.apply_batch: the accounts are picked and changed in one go
+        with self.locks.hold_all():
+            return bulk_operation(self.store, action, usernames, predicate, fields, dry_run, progress)
+
+    def search_accounts(self, offset=0, limit=20, **filters):
+        if "currency" in filters:
+            filters["currency"] = filters["currency"].upper()
+        return self.store.search(filters, offset, limit)
 
     # Admin GUI
     def admin_gui(self):
@@ -117,7 +125,8 @@ class Admin:
         while running:
             clear_terminal()
             print("#######################\n# ADMIN CONTROL PANEL #\n#######################")
-            print("\n1. Create Account\n2. Delete Account\n3. Activate Account\n4. Deactivate Account" "\n5. Change Account Details\n0. Back\n")
+            print("\n1. Create Account\n2. Delete Account\n3. Activate Account\n4. Deactivate Account"
+                  "\n5. Change Account Details\n6. Instrumentation Stats\n7. Search Accounts\n8. Bulk Operations\n0. Back\n")
             try:
                 choice = int(input("> "))
             except ValueError:
@@ -169,6 +178,20 @@ class Admin:
                 print(msg)
                 input("Press Enter to continue...")
 
+            elif choice == 6:
+                print(instrumentation.format_stats(self.store))
+                path = input("\nExport to JSON file (blank to skip): ").strip()
+                if path:
+                    instrumentation.export(path, self.store)
+                    print(f"Stats written to {path}")
+                input("Press Enter to continue...")
+
+            elif choice == 7:
+                search_screen(self)
+
+            elif choice == 8:
+                bulk_screen(self)
+
             elif choice == 0:
                 running = False
 
@@ -177,25 +200,153 @@ class Admin:
                 input("Press Enter to continue...")
 
 
-def main():
-    ensure_user_db()
-    ensure_database()
-    features = Features(db_dir=DB_DIR)
-    admin = Admin(DB_DIR)
+# --- Headless command mode ---
+def run_command(tokens, session, features, admin):
+    """Run one scripted command; returns a dict that is emitted as one JSON line."""
+    cmd, args = tokens[0].lower(), tokens[1:]
+    account = session.get("account")
+
+    if cmd == "login":
+        key = features.authenticate(args[0], args[1])
+        session["account"] = key
+        return {"ok": key is not None, "message": f"Logged in as {key}" if key else "Login failed."}
+    if cmd == "signup":
+        success, msg = admin.create_account(args[0], args[1], args[2] if len(args) > 2 else "USD", is_admin=False)
+        return {"ok": success, "message": msg}
+    if not account:
+        return {"ok": False, "message": "Not logged in"}
+
+    if cmd == "logout":
+        session["account"] = None
+        return {"ok": True, "message": "Logged out."}
+    if cmd in ("balance", "card", "admin"):
+        # it may have been deleted since login (admin delete, another process)
+        acct = features.store.get(account)
+        if acct is None:
+            return {"ok": False, "message": "Account not found."}
+    if cmd == "balance":
+        return {"ok": True, "balance": acct.get("balance", 0), "currency": acct.get("currency", "USD")}
+    if cmd == "statement":
+        rows = list(features.ledger.statement(account, args[0] if args else None, args[1] if len(args) > 1 else None))
+        return {"ok": True, "rows": rows}
+    if cmd == "deposit":
+        success, msg = features.deposit_amount(account, float(args[0]))
+    elif cmd == "withdraw":
+        success, msg = features.withdraw_amount(account, float(args[0]))
+    elif cmd == "change-currency":
+        success, msg = features.change_currency_to(account, args[0])
+    elif cmd == "transfer":
+        success, msg = features.transfer_amount(account, args[0], float(args[1]))
+    elif cmd == "card":
+        sub = args[0].lower()
+        if sub == "register":
+            number, expiration, brand, kind, cvc = args[1:6]
+            success, msg = features.add_card(account, int(number), expiration, brand.upper(), kind.upper(), int(cvc))
+        elif sub == "unregister":
+            success, msg = features.remove_card(account)
+        elif sub == "view":
+            card = acct.get("card")
+            return {"ok": card is not None, "card": card}
+        else:
+            raise ValueError(f"Unknown card command: {sub}")
+    elif cmd == "admin":
+        if not acct.get("is_admin", False):
+            return {"ok": False, "message": "Admin permissions required"}
+        sub, args = args[0].lower(), args[1:]
+        if sub == "create":
+            is_admin = len(args) > 3 and args[3].lower() in ["true", "yes", "1", "y", "admin"]
+            success, msg = admin.create_account(args[0], args[1], args[2] if len(args) > 2 else "USD", is_admin)
+        elif sub == "delete":
+            success, msg = admin.delete_account(args[0])
+        elif sub == "activate":
+            success, msg = admin.activate_account(args[0])
+        elif sub == "deactivate":
+            success, msg = admin.deactivate_account(args[0])
+        elif sub == "change":
+            field, value = args[1], args[2]
+            if field == "balance":
+                value = float(value)
+            elif field == "is_admin":
+                value = value.lower() in ["true", "yes", "1", "y"]
+            success, msg = admin.change_details(args[0], **{field: value})
+        else:
+            raise ValueError(f"Unknown admin command: {sub}")
+    else:
+        raise ValueError(f"Unknown command: {cmd}")
+    return {"ok": success, "message": msg}
+
+
+def run_script(lines, features, admin, out=sys.stdout):
+    """Execute commands (one per line, '#' comments allowed) without prompts or screen clears.
+
+    Each command produces one JSON object per line on `out`. Returns (ok, failed) counts.
+    """
+    session = {"account": None}
+    ok = failed = 0
+    for lineno, line in enumerate(lines, 1):
+        tokens = shlex.split(line, comments=True)
+        if not tokens:
+            continue
+        try:
+            result = run_command(tokens, session, features, admin)
+        except IndexError:
+            result = {"ok": False, "message": "Bad command: missing arguments"}
+        except ValueError as e:
+            result = {"ok": False, "message": f"Bad command: {e}"}
+        except Exception as e:
+            # one failing command is reported like any other failure, not the end of the script
+            result = {"ok": False, "message": f"Error: {type(e).__name__}: {e}"}
+        ok += result["ok"]
+        failed += not result["ok"]
+        out.write(json.dumps({"line": lineno, "command": tokens[0].lower(), **result}) + "\n")
+    return ok, failed
+
+
+def script_main(path, db_dir=DB_DIR):
+    instrumentation.start_profiling()
+    # unless told otherwise, load database.db once and write it back once at the end
+    store = open_store(db_dir, os.getenv(STORAGE_ENV) or "cached", write_back=os.getenv(WRITE_BACK_ENV) or "exit")
+    ensure_database(store, db_dir)
+    features = Features(db_dir=db_dir, store=store)
+    admin = Admin(db_dir, store=store)
+    start = time.perf_counter()
+    stream = sys.stdin if path == "-" else open(path, "r")
+    with stream:
+        ok, failed = run_script(stream, features, admin)
+    store.close()
+    elapsed = time.perf_counter() - start
+    total = ok + failed
+    print(f"{total} commands ({failed} failed) in {elapsed:.2f}s ({total / elapsed if elapsed else 0:.0f} ops/sec)", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def main(token=None):
+    instrumentation.start_profiling()
+    store = open_store(DB_DIR)
+    ensure_database(store)
+    features = Features(db_dir=DB_DIR, store=store)
+    admin = Admin(DB_DIR, store=store)
+    refresher = None
+    if os.getenv("BANK_FX_REFRESH_TTL"):
+        # keep rates fresh in long-running sessions; needs CURRENCY_KEY like fas_currency.py
+        from fx_refresher import RateRefresher
+
+        refresher = RateRefresher(features.conv, ttl=float(os.getenv("BANK_FX_REFRESH_TTL")))
+        refresher.start()
 
     running = True
     while running:
         clear_terminal()
         print("#########################\n# SMART BANKING PROGRAM #\n#########################")
 
-        with open(USER_DB, "r") as user_db:
-            data = json.load(user_db)
-            logged_in = data.get("logged in", False)
-            account = data.get("account", "")
+        # the token stays in this process; each terminal has its own session
+        account = features.sessions.validate(token)
+        if token and account is None:
+            token = None
+            print("Your session has expired. Please log in again.")
 
-        if logged_in and account:
-            db_data = json.load(open(DATABASE_DB))
-            is_admin = db_data.get(account, {}).get("is_admin", False)
+        if account:
+            is_admin = (store.get(account) or {}).get("is_admin", False)
 
             choice = user_menu(is_admin)
             if choice == 1:
@@ -209,9 +360,14 @@ def main():
             elif choice == 5:
                 features.card_settings(account)
             elif choice == 6:
-                features.logout()
+                features.logout(token)
+                token = None
             elif choice == 7 and is_admin:
                 admin.admin_gui()
+            elif choice == 8:
+                features.view_statement(account)
+            elif choice == 9:
+                features.transfer(account)
             elif choice == 0:
                 print("Goodbye!")
                 running = False
@@ -224,8 +380,10 @@ def main():
             if choice == 1:
                 username = input("Username: ").strip()
                 password = input("Password: ")
-                if features.login(username, password):
+                token = features.login(username, password)
+                if token:
                     print(f"Logged in as {username}")
+                    print(f"Session token (resume with --session): {token}")
                     input("Press Enter to continue...")
                 else:
                     print("Login failed.")
@@ -247,6 +405,19 @@ def main():
                 print("Unknown option.")
                 input("Press Enter to continue...")
 
+    if refresher is not None:
+        refresher.stop()
+    features.sessions.close()
+    features.velocity.close()
+    store.close()
+
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Smart Banking Program")
+    parser.add_argument("--script", metavar="FILE", help="run commands from FILE ('-' for stdin) instead of the menu")
+    parser.add_argument("--db-dir", type=Path, default=DB_DIR, help="database directory for --script")
+    parser.add_argument("--session", metavar="TOKEN", help="resume a session that has not expired yet")
+    args = parser.parse_args()
+    if args.script:
+        sys.exit(script_main(args.script, args.db_dir))
+    main(args.session)
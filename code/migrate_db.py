@@ -0,0 +1,30 @@
+from pathlib import Path
+import argparse
+from storage import open_store
+
+BASE_DIR = Path(__file__).resolve().parent
+DB_DIR = BASE_DIR.parent / "db"
+
+
+def migrate(db_dir, source, target):
+    src = open_store(db_dir, source)
+    dst = open_store(db_dir, target)
+    data = src.all()
+    dst.replace_all(data)
+    src.close()
+    dst.close()
+    return len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy every account from one storage backend to another.")
+    parser.add_argument("--db-dir", type=Path, default=DB_DIR)
+    parser.add_argument("--from", dest="source", default="json", help="source storage mode (json, wal, sqlite, sharded)")
+    parser.add_argument("--to", dest="target", default="sqlite", help="target storage mode (json, wal, sqlite, sharded)")
+    args = parser.parse_args()
+    count = migrate(args.db_dir, args.source, args.target)
+    print(f"Migrated {count} accounts from {args.source} to {args.target}")
+
+
+if __name__ == "__main__":
+    main()
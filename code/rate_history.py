@@ -0,0 +1,210 @@
+from pathlib import Path
+import argparse
+import bisect
+import datetime
+import json
+import math
+import mmap
+import os
+import struct
+from locks import FileLock
+
+BASE_DIR = Path(__file__).resolve().parent
+HISTORY_DIR = BASE_DIR.parent / "db" / "rates_history"
+
+
+def to_timestamp(when):
+    """Microseconds since the epoch (UTC) for a datetime, ISO string or number of seconds."""
+    if isinstance(when, str):
+        when = datetime.datetime.fromisoformat(when)
+    if isinstance(when, datetime.datetime):
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=datetime.timezone.utc)
+        return int(when.timestamp() * 1_000_000)
+    return int(when * 1_000_000)
+
+
+class RateHistory:
+    """Append-only columnar history of rate snapshots.
+
+    currencies.json fixes the column order and names the rates file, timestamps.bin holds
+    one int64 per snapshot (sorted) and the rates file (rates.bin, rates-<width>.bin once
+    widened) one float64 row per snapshot. Both binary files are memory-mapped, so a
+    lookup binary-searches the timestamps and touches one row.
+
+    Appends hold history.lock, so several processes can share one history.
+    """
+
+    def __init__(self, path=HISTORY_DIR):
+        self.path = Path(path)
+        self.codes_file = self.path / "currencies.json"
+        self.timestamps_file = self.path / "timestamps.bin"
+        self.rates_file = self.path / "rates.bin"
+        self._commit = FileLock(self.path / "history.lock")
+        self.codes = []
+        self.ids = {}
+        self._maps = None
+        self._mapped_size = -1
+        self._views()
+
+    def _set_codes(self, codes):
+        self.codes = list(codes)
+        self.ids = {code: i for i, code in enumerate(self.codes)}
+
+    # --- reading ---
+    def _views(self):
+        size = self.timestamps_file.stat().st_size if self.timestamps_file.exists() else 0
+        if size != self._mapped_size:
+            self.close()
+            self._mapped_size = size
+            self._load_codes()
+            if size:
+                maps = [self._map(self.timestamps_file)]
+                while True:
+                    try:
+                        maps.append(self._map(self.rates_file))
+                        break
+                    except FileNotFoundError:
+                        self._load_codes()  # widened meanwhile: currencies.json names the new file
+                # only rows both files have: a writer may be between the two
+                rows = min(size // 8, len(maps[1]) // (8 * len(self.codes)) if self.codes else 0)
+                ts = memoryview(maps[0])[: rows * 8].cast("q")
+                rates = memoryview(maps[1])[: rows * len(self.codes) * 8].cast("d")
+                self._maps = maps, ts, rates
+        if self._maps is None:
+            return (), ()
+        return self._maps[1], self._maps[2]
+
+    def _load_codes(self):
+        if self.codes_file.exists():
+            with open(self.codes_file, "r") as f:
+                meta = json.load(f)
+            self._set_codes(meta["codes"])
+            self.rates_file = self.path / meta.get("rates", "rates.bin")
+
+    @staticmethod
+    def _map(file):
+        with open(file, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self._views()[0])
+
+    def last_timestamp(self):
+        ts, _ = self._views()
+        return ts[-1] if len(ts) else None
+
+    def row_at(self, when):
+        """Index of the last snapshot taken at or before `when`."""
+        ts, _ = self._views()
+        row = bisect.bisect_right(ts, to_timestamp(when)) - 1
+        if row < 0:
+            raise ValueError(f"No rates recorded at or before {when}")
+        return row
+
+    def rate_at(self, currency, when):
+        currency = currency.upper()
+        _, rates = self._views()
+        if currency not in self.ids:
+            raise ValueError(f"Currency {currency} not found in rate history")
+        rate = rates[self.row_at(when) * len(self.codes) + self.ids[currency]]
+        if math.isnan(rate):
+            raise ValueError(f"Currency {currency} has no rate at {when}")
+        return rate
+
+    # --- writing ---
+    def append(self, when, base, rates):
+        self.path.mkdir(parents=True, exist_ok=True)
+        with self._commit:
+            # another process may have appended or widened since we last looked
+            self._mapped_size = -1
+            self._load_codes()
+            return self._append(to_timestamp(when), base, rates)
+
+    def _append(self, ts, base, rates):
+        last = self.last_timestamp()
+        if last is not None and ts <= last:
+            if ts == last:
+                return False
+            raise ValueError("Snapshots must be appended in time order")
+        rows = len(self)
+        rates = {code.upper(): float(rate) for code, rate in rates.items()}
+        rates[base.upper()] = 1.0
+        new_codes = sorted(code for code in rates if code not in self.ids)
+        if new_codes:
+            self._add_columns(new_codes)
+        row = [rates.get(code, float("nan")) for code in self.codes]
+        # the rate row goes first: rows without a timestamp are ignored by readers
+        with open(self.rates_file, "r+b" if self.rates_file.exists() else "wb") as f:
+            f.seek(rows * len(self.codes) * 8)
+            f.write(struct.pack(f"<{len(row)}d", *row))
+            f.truncate()
+        with open(self.timestamps_file, "ab") as f:
+            f.write(struct.pack("<q", ts))
+        return True
+
+    def _add_columns(self, new_codes):
+        old_width = len(self.codes)
+        rows = len(self)
+        self.close()
+        self._mapped_size = -1
+        old_file = self.rates_file
+        codes = self.codes + new_codes
+        # widening is rare (a new currency appears), so rewriting every row is fine. The
+        # wider rows go to a new file and replacing currencies.json switches codes and
+        # file in one step; a crash before that leaves the old pair untouched.
+        rates_file = self.path / (f"rates-{len(codes)}.bin" if rows else "rates.bin")
+        if rows:
+            with open(old_file, "rb") as f:
+                old = struct.unpack(f"<{rows * old_width}d", f.read(rows * old_width * 8))
+            with open(rates_file, "wb") as f:
+                pad = struct.pack(f"<{len(new_codes)}d", *[float("nan")] * len(new_codes))
+                for r in range(rows):
+                    f.write(struct.pack(f"<{old_width}d", *old[r * old_width : (r + 1) * old_width]) + pad)
+                f.flush()
+                os.fsync(f.fileno())
+        tmp = self.codes_file.with_name("currencies.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"codes": codes, "rates": rates_file.name}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.codes_file)
+        self._set_codes(codes)
+        self.rates_file = rates_file
+        if old_file != rates_file:
+            old_file.unlink(missing_ok=True)
+
+    def close(self):
+        if self._maps is not None:
+            (maps, ts, rates), self._maps = self._maps, None
+            ts.release()
+            rates.release()
+            for m in maps:
+                m.close()
+
+
+def backfill(files, path=HISTORY_DIR):
+    """Append currency.db snapshots (in timestamp order) to the history; returns how many were new."""
+    snapshots = []
+    for file in files:
+        with open(file, "r") as f:
+            data = json.load(f)
+        snapshots.append((to_timestamp(data["last_updated"]), data))
+    history = RateHistory(path)
+    added = 0
+    last = history.last_timestamp()
+    for ts, data in sorted(snapshots, key=lambda s: s[0]):
+        if last is not None and ts < last:
+            print(f"Skipping snapshot from {data['last_updated']}: older than the history")
+            continue
+        added += history.append(data["last_updated"], data.get("base", "USD"), data.get("rates", {}))
+    history.close()
+    return added
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill the rate history from existing currency.db files.")
+    parser.add_argument("files", nargs="+", type=Path)
+    parser.add_argument("--history", type=Path, default=HISTORY_DIR)
+    args = parser.parse_args()
+    print(f"Added {backfill(args.files, args.history)} snapshots to {args.history}")
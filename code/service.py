@@ -0,0 +1,483 @@
+"""Local JSON-over-HTTP front end for the Features and Admin operations.
+
+Run from the code/ directory:
+    python service.py --port 8080 [--db-dir ../db] [--window 0.005]
+
+Requests and responses are JSON; responses carry {"ok": ..., "message": ...} like the
+--script mode of main.py. After /login, send "Authorization: Bearer <token>".
+
+    POST /login {"username", "password"}             POST /logout
+    POST /signup {"username", "password", "currency"}
+    GET  /balance                                     GET  /statement?from=&to=
+    POST /deposit {"amount"}                          POST /withdraw {"amount"}
+    POST /currency {"currency"}                       POST /transfer {"to", "amount"}
+    GET  /card      POST /card/register {"number", "expiration", "brand", "type", "cvc"}
+    POST /card/unregister
+    POST /admin/create {"username", "password", "currency", "is_admin"}
+    POST /admin/delete | /admin/activate | /admin/deactivate {"username"}
+    POST /admin/change {"username", "fields": {...}}
+    POST /admin/bulk {"action", "usernames", "filters", "has_card", "fields", "dry_run"}
+    GET  /admin/search?currency=&activated=&...&offset=&limit=
+    GET  /admin/events?from=&limit=                   (change events, see events.py)
+    GET  /stats
+
+Accounts are served from the in-memory cache. Writes are group-committed: a write's
+response is sent only after the flush that made it durable, and one flush (database.db
+plus the ledger and the event log) covers every write that arrived within --window seconds.
+Handlers and flushes run in order on one store thread, so file locks and fsyncs never
+block the event loop and the cache is only touched by that thread.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from pathlib import Path
+from urllib.parse import parse_qsl, urlsplit
+import argparse
+import asyncio
+import json
+import math
+import os
+import signal
+import time
+from accounts import CARD_FIELDS
+from admin import filter_predicate
+from events import open_events
+from features import Features
+from main import DB_DIR, Admin, ensure_database
+from storage import open_store
+
+MAX_BODY = 1 << 20
+FLAG_WORDS = {"true": True, "yes": True, "1": True, "y": True, "false": False, "no": False, "0": False, "n": False}
+STATUS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden", 404: "Not Found", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class GroupCommit:
+    """Many writes, one durable flush.
+
+    wait() returns a future for the next flush. The first waiter arms a timer; when it
+    fires (or max_batch writes are waiting) flush() runs once and resolves every waiter.
+    The flush runs in executor (the loop's default one if None), never on the loop itself,
+    and one at a time: writes arriving meanwhile wait for the flush after it.
+    """
+
+    def __init__(self, flush, window=0.005, max_batch=1000, executor=None):
+        self._flush = flush
+        self.window = window
+        self.max_batch = max_batch
+        self.executor = executor
+        self._waiters = []
+        self._timer = None
+        self._flushing = None
+        self.batches = 0
+        self.writes = 0
+
+    def wait(self):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._waiters.append(future)
+        if len(self._waiters) >= self.max_batch:
+            self.commit()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self.commit)
+        return future
+
+    def commit(self):
+        """Start a flush for the current waiters; returns the flush in flight (None when idle)."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._flushing is not None or not self._waiters:
+            return self._flushing
+        waiters, self._waiters = self._waiters, []
+        self._flushing = asyncio.get_running_loop().run_in_executor(self.executor, self._flush)
+        self._flushing.add_done_callback(partial(self._resolve, waiters))
+        return self._flushing
+
+    def _resolve(self, waiters, flushed):
+        self._flushing = None
+        if self._waiters:
+            # they have waited out a whole flush already
+            self.commit()
+        error = flushed.exception()
+        if error is not None:
+            for future in waiters:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        self.batches += 1
+        self.writes += len(waiters)
+        for future in waiters:
+            if not future.done():
+                future.set_result(None)
+
+
+# --- request parsing ---
+def _field(body, name, convert=None):
+    if name not in body:
+        raise HTTPError(400, f"Missing field: {name}")
+    try:
+        return convert(body[name]) if convert else body[name]
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"Invalid {name}")
+
+
+def _flag(value, name):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in FLAG_WORDS:
+        return FLAG_WORDS[value.strip().lower()]
+    raise HTTPError(400, f"Invalid {name}")
+
+
+def _account_fields(fields, currencies):
+    """/admin/change fields checked and converted to the types accounts hold (else 400)."""
+    clean = {}
+    for name, value in fields.items():
+        if name == "balance":
+            # bool is an int, and a string would be stored as is by the dict stores
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                raise HTTPError(400, "Invalid balance")
+            value = float(value)
+        elif name in ("activated", "is_admin"):
+            value = _flag(value, name)
+        elif name == "password":
+            if not isinstance(value, str) or not value:
+                raise HTTPError(400, "Invalid password")
+        elif name == "currency":
+            if not isinstance(value, str) or value.upper() not in currencies:
+                raise HTTPError(400, "Invalid currency")
+            value = value.upper()
+        elif name == "card":
+            if value is not None:
+                if not isinstance(value, dict) or value.keys() != set(CARD_FIELDS):
+                    raise HTTPError(400, f"Invalid card: give {', '.join(CARD_FIELDS)} or null")
+                value = {field: _field(value, field, int if field in ("number", "CVC") else str) for field in CARD_FIELDS}
+        else:
+            raise HTTPError(400, f"Unknown field: {name}")
+        clean[name] = value
+    return clean
+
+
+def _search_filters(query):
+    filters = {}
+    for name, value in query.items():
+        if name in ("activated", "is_admin"):
+            filters[name] = value.lower() in ("true", "yes", "1", "y")
+        elif name in ("min_balance", "max_balance"):
+            filters[name] = float(value)
+        elif name not in ("offset", "limit"):
+            filters[name] = value
+    return filters
+
+
+class Request:
+    def __init__(self, path, body, query, account=None, token=None):
+        self.path = path
+        self.body = body
+        self.query = query
+        self.account = account  # None for routes that need no session
+        self.token = token
+
+
+class BankService:
+    def __init__(self, db_dir=DB_DIR, storage="cached", window=0.005, max_batch=1000):
+        if storage not in ("cached", "compact"):
+            raise ValueError("The service needs an in-memory store: cached or compact")
+        # write_back="exit": mutations stay in memory until the group commit flushes them
+        self.store = open_store(db_dir, storage, write_back="exit")
+        ensure_database(self.store, db_dir)
+        self.features = Features(db_dir=db_dir, store=self.store)
+        self.admin = Admin(db_dir, store=self.store)
+        self.sessions = self.features.sessions
+        # read by /admin/events even with BANK_EVENTS=0: other processes may still capture
+        self.events = open_events(Path(db_dir) / "events")
+        # one worker: handlers and flushes keep their order and never share the cache
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="store")
+        self.commits = GroupCommit(self._flush, window, max_batch, self.executor)
+        self.requests = 0
+        self.started = time.time()
+        self.routes = {
+            ("POST", "/login"): (self.login, None),
+            ("POST", "/signup"): (self.signup, None),
+            ("POST", "/logout"): (self.logout, "user"),
+            ("GET", "/balance"): (self.balance, "user"),
+            ("GET", "/statement"): (self.statement, "user"),
+            ("POST", "/deposit"): (self.deposit, "user"),
+            ("POST", "/withdraw"): (self.withdraw, "user"),
+            ("POST", "/currency"): (self.currency, "user"),
+            ("POST", "/transfer"): (self.transfer, "user"),
+            ("GET", "/card"): (self.card, "user"),
+            ("POST", "/card/register"): (self.card_register, "user"),
+            ("POST", "/card/unregister"): (self.card_unregister, "user"),
+            ("POST", "/admin/create"): (self.admin_create, "admin"),
+            ("POST", "/admin/delete"): (self.admin_action, "admin"),
+            ("POST", "/admin/activate"): (self.admin_action, "admin"),
+            ("POST", "/admin/deactivate"): (self.admin_action, "admin"),
+            ("POST", "/admin/change"): (self.admin_change, "admin"),
+            ("POST", "/admin/bulk"): (self.admin_bulk, "admin"),
+            ("GET", "/admin/search"): (self.admin_search, "admin"),
+            ("GET", "/admin/events"): (self.admin_events, "admin"),
+            ("GET", "/stats"): (self.stats, None),
+        }
+
+    def _flush(self):
+        self.store.flush()
+        self.features.ledger.flush()
+        self.events.flush()
+
+    # --- handlers: each returns (result, wrote) ---
+    def login(self, req):
+        token = self.features.login(str(_field(req.body, "username")), str(_field(req.body, "password")))
+        if token is None:
+            return {"ok": False, "message": "Login failed."}, False
+        return {"ok": True, "message": f"Logged in as {req.body['username'].upper()}", "token": token}, False
+
+    def signup(self, req):
+        success, msg = self.admin.create_account(str(_field(req.body, "username")), str(_field(req.body, "password")), str(req.body.get("currency", "USD")), is_admin=False)
+        return {"ok": success, "message": msg}, success
+
+    def logout(self, req):
+        self.sessions.end(req.token)
+        return {"ok": True, "message": "Logged out."}, False
+
+    def balance(self, req):
+        acct = self.store.get(req.account)
+        if acct is None:
+            # deleted since the session was created
+            return {"ok": False, "message": "Account not found."}, False
+        return {"ok": True, "balance": acct.get("balance", 0), "currency": acct.get("currency", "USD")}, False
+
+    def statement(self, req):
+        return {"ok": True, "rows": list(self.features.ledger.statement(req.account, req.query.get("from"), req.query.get("to")))}, False
+
+    def deposit(self, req):
+        success, msg = self.features.deposit_amount(req.account, _field(req.body, "amount", float))
+        return {"ok": success, "message": msg}, success
+
+    def withdraw(self, req):
+        success, msg = self.features.withdraw_amount(req.account, _field(req.body, "amount", float))
+        return {"ok": success, "message": msg}, success
+
+    def currency(self, req):
+        success, msg = self.features.change_currency_to(req.account, str(_field(req.body, "currency")))
+        return {"ok": success, "message": msg}, success
+
+    def transfer(self, req):
+        success, msg = self.features.transfer_amount(req.account, str(_field(req.body, "to")), _field(req.body, "amount", float))
+        return {"ok": success, "message": msg}, success
+
+    def card(self, req):
+        acct = self.store.get(req.account)
+        if acct is None:
+            return {"ok": False, "message": "Account not found."}, False
+        card = acct.get("card")
+        return {"ok": card is not None, "card": card}, False
+
+    def card_register(self, req):
+        success, msg = self.features.add_card(
+            req.account,
+            _field(req.body, "number", int),
+            str(_field(req.body, "expiration")),
+            str(req.body.get("brand", "VISA")).upper(),
+            str(req.body.get("type", "CREDIT")).upper(),
+            _field(req.body, "cvc", int),
+        )
+        return {"ok": success, "message": msg}, success
+
+    def card_unregister(self, req):
+        success, msg = self.features.remove_card(req.account)
+        return {"ok": success, "message": msg}, success
+
+    def admin_create(self, req):
+        success, msg = self.admin.create_account(str(_field(req.body, "username")), str(_field(req.body, "password")),
+                                                 str(req.body.get("currency", "USD")), is_admin=_flag(req.body.get("is_admin", False), "is_admin"))
+        return {"ok": success, "message": msg}, success
+
+    def admin_action(self, req):
+        action = getattr(self.admin, f"{req.path.rsplit('/', 1)[1]}_account")
+        success, msg = action(str(_field(req.body, "username")))
+        return {"ok": success, "message": msg}, success
+
+    def admin_change(self, req):
+        fields = _field(req.body, "fields")
+        if not isinstance(fields, dict):
+            raise HTTPError(400, "Invalid fields")
+        fields = _account_fields(fields, self.features.conv.codes)
+        success, msg = self.admin.change_details(str(_field(req.body, "username")), **fields)
+        return {"ok": success, "message": msg}, success
+
+    def admin_bulk(self, req):
+        filters = req.body.get("filters") or {}
+        has_card = req.body.get("has_card")
+        predicate = filter_predicate(filters, has_card) if filters or has_card is not None else None
+        fields = req.body.get("fields")
+        if fields is not None:
+            if not isinstance(fields, dict):
+                raise HTTPError(400, "Invalid fields")
+            fields = _account_fields(fields, self.features.conv.codes)
+        try:
+            success, msg = self.admin.bulk_operation(str(_field(req.body, "action")), req.body.get("usernames"), predicate, fields, bool(req.body.get("dry_run", False)))
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        return {"ok": success, "message": msg}, success and not req.body.get("dry_run", False)
+
+    def admin_search(self, req):
+        try:
+            total, page = self.admin.search_accounts(int(req.query.get("offset", 0)), int(req.query.get("limit", 20)), **_search_filters(req.query))
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        return {"ok": True, "total": total, "accounts": [{"username": key, **acct} for key, acct in page]}, False
+
+    def admin_events(self, req):
+        try:
+            start = int(req.query["from"]) if "from" in req.query else None
+            events = list(islice(self.events.read(start), int(req.query.get("limit", 1000))))
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        return {"ok": True, "events": events, "next": events[-1]["seq"] + 1 if events else start}, False
+
+    def stats(self, req):
+        batches = self.commits.batches
+        return {
+            "ok": True,
+            "requests": self.requests,
+            "uptime": time.time() - self.started,
+            "sessions": len(self.sessions),
+            "commits": batches,
+            "committed_writes": self.commits.writes,
+            "writes_per_commit": self.commits.writes / batches if batches else 0,
+            "cache": self.store.stats(),
+        }, False
+
+    # --- dispatch ---
+    def _call(self, handler, role, req, headers):
+        # on the store thread: sessions and accounts are only read there
+        if role is not None:
+            auth = headers.get("authorization", "")
+            req.token = auth[7:].strip() if auth[:7].lower() == "bearer " else ""
+            req.account = self.sessions.validate(req.token)
+            if req.account is None:
+                raise HTTPError(401, "Not logged in")
+            if role == "admin" and not (self.store.get(req.account) or {}).get("is_admin", False):
+                raise HTTPError(403, "Admin only")
+        return handler(req)
+
+    async def handle(self, method, target, headers, body):
+        url = urlsplit(target)
+        route = self.routes.get((method, url.path))
+        if route is None:
+            raise HTTPError(404, f"No route for {method} {url.path}")
+        handler, role = route
+        query = dict(parse_qsl(url.query))
+        try:
+            body = json.loads(body) if body else {}
+        except ValueError:
+            raise HTTPError(400, "Body is not valid JSON")
+        if not isinstance(body, dict):
+            raise HTTPError(400, "Body must be a JSON object")
+        req = Request(url.path, body, query)
+        result, wrote = await asyncio.get_running_loop().run_in_executor(self.executor, self._call, handler, role, req, headers)
+        if wrote:
+            await self.commits.wait()
+        return result
+
+    async def serve_connection(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    method, target, version = line.decode("latin-1").split()
+                except ValueError:
+                    await self._respond(writer, 400, {"ok": False, "message": "Bad request line"}, close=True)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                length = headers.get("content-length", "") or "0"
+                # only plain digits: int() would also take "-5", "+5", " 5" or "1_000"
+                if not (length.isascii() and length.isdigit()):
+                    await self._respond(writer, 400, {"ok": False, "message": "Invalid Content-Length"}, close=True)
+                    break
+                length = int(length)
+                if length > MAX_BODY:
+                    await self._respond(writer, 413, {"ok": False, "message": "Body too large"}, close=True)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                self.requests += 1
+                try:
+                    status, result = 200, await self.handle(method.upper(), target, headers, body)
+                except HTTPError as e:
+                    status, result = e.status, {"ok": False, "message": str(e)}
+                except Exception as e:
+                    status, result = 500, {"ok": False, "message": f"Internal error: {e}"}
+                await self._respond(writer, status, result, close=not keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer, status, result, close=False):
+        payload = json.dumps(result).encode()
+        head = f"HTTP/1.1 {status} {STATUS[status]}\r\nContent-Type: application/json\r\nContent-Length: {len(payload)}\r\nConnection: {'close' if close else 'keep-alive'}\r\n\r\n"
+        writer.write(head.encode("latin-1") + payload)
+        await writer.drain()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self._flush()
+        self.sessions.close()
+        self.features.velocity.close()
+        self.store.close()
+
+
+async def serve(service, host="127.0.0.1", port=8080, ready=None):
+    server = await asyncio.start_server(service.serve_connection, host, port)
+    if os.name == "posix":
+        # stop cleanly on SIGTERM too, so pending writes are flushed
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, server.close)
+    if ready is not None:
+        ready(server.sockets[0].getsockname()[1])
+    try:
+        async with server:
+            await server.serve_forever()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        flushed = service.commits.commit()
+        while flushed is not None:
+            await asyncio.wait([flushed])
+            flushed = service.commits.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Smart Banking JSON service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080, help="0 picks a free port")
+    parser.add_argument("--db-dir", type=Path, default=DB_DIR)
+    parser.add_argument("--storage", choices=("cached", "compact"), default="cached")
+    parser.add_argument("--window", type=float, default=0.005, help="group commit window in seconds")
+    parser.add_argument("--max-batch", type=int, default=1000, help="flush early once this many writes wait")
+    args = parser.parse_args()
+    service = BankService(args.db_dir, args.storage, args.window, args.max_batch)
+    try:
+        asyncio.run(serve(service, args.host, args.port, lambda port: print(f"Listening on http://{args.host}:{port}", flush=True)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
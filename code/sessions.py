@@ -0,0 +1,149 @@
+from pathlib import Path
+import atexit
+import hashlib
+import json
+import os
+import secrets
+import threading
+import time
+from storage import commit_lock, file_signature, write_json_atomic
+
+SESSION_TTL_ENV = "BANK_SESSION_TTL"
+DEFAULT_TTL = 30 * 60
+
+_shared_sessions = {}
+
+
+def open_sessions(path, ttl=None):
+    path = Path(path).resolve()
+    if path not in _shared_sessions:
+        _shared_sessions[path] = SessionManager(path, ttl)
+    return _shared_sessions[path]
+
+
+def _digest(token):
+    # only hashes are kept, so sessions.json never holds a usable token
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class SessionManager:
+    """Login sessions keyed by opaque random tokens, with sliding expiry.
+
+    The table lives in memory, so validate() is a dict lookup plus an expiry check. Changes
+    are written to sessions.json lazily (at most every persist_interval seconds, and at
+    exit) and merged with what other processes wrote, so any number of terminals or
+    service workers can hold sessions at once and sessions survive a restart.
+    """
+
+    def __init__(self, path, ttl=None, persist_interval=5.0):
+        self.path = Path(path)
+        self.ttl = ttl if ttl is not None else float(os.getenv(SESSION_TTL_ENV) or DEFAULT_TTL)
+        self.persist_interval = persist_interval
+        self._sessions = {}  # token digest -> [account, expires]
+        self._ended = {}  # token digest -> expires, so other processes drop it too
+        self._dirty = False
+        self._sig = None
+        self._checked = time.monotonic()
+        self._lock = threading.RLock()
+        self._commit = commit_lock(self.path)
+        self._merge()
+        atexit.register(self.flush)
+
+    # --- persistence ---
+    def _merge(self):
+        """Fold sessions.json into the in-memory table if it changed since we last saw it."""
+        sig = file_signature(self.path)
+        if sig is None or sig == self._sig:
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except ValueError:
+            data = {}
+        now = time.time()
+        for digest, expires in data.get("ended", {}).items():
+            if expires > now:
+                self._ended[digest] = max(expires, self._ended.get(digest, 0))
+        for digest, (account, expires) in data.get("sessions", {}).items():
+            if expires <= now or digest in self._ended:
+                continue
+            mine = self._sessions.get(digest)
+            if mine is None or mine[1] < expires:
+                self._sessions[digest] = [account, expires]
+        for digest in self._ended:
+            self._sessions.pop(digest, None)
+        self._sig = sig
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            with self._commit:
+                self._merge()
+                now = time.time()
+                self._sessions = {d: s for d, s in self._sessions.items() if s[1] > now}
+                self._ended = {d: e for d, e in self._ended.items() if e > now}
+                write_json_atomic(self.path, {"sessions": self._sessions, "ended": self._ended})
+                self._sig = file_signature(self.path)
+            self._dirty = False
+            self._checked = time.monotonic()
+
+    def _tick(self):
+        # lazy upkeep: at most once per persist_interval, write our changes or pick up others'
+        if time.monotonic() - self._checked < self.persist_interval:
+            return
+        self._checked = time.monotonic()
+        if self._dirty:
+            self.flush()
+        else:
+            self._merge()
+
+    # --- sessions ---
+    def create(self, account):
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._sessions[_digest(token)] = [account, time.time() + self.ttl]
+            self._dirty = True
+            self._tick()
+        return token
+
+    def validate(self, token):
+        """The account a live session belongs to, or None. Extends the session's expiry."""
+        if not token:
+            return None
+        digest = _digest(token)
+        with self._lock:
+            self._tick()
+            session = self._sessions.get(digest)
+            if session is None:
+                # maybe created by another process since we last looked
+                self._merge()
+                session = self._sessions.get(digest)
+                if session is None:
+                    return None
+            now = time.time()
+            if session[1] <= now:
+                del self._sessions[digest]
+                self._dirty = True
+                return None
+            if session[1] - now < self.ttl / 2:
+                # only slide once half the lifetime is gone, to keep writes rare
+                session[1] = now + self.ttl
+                self._dirty = True
+            return session[0]
+
+    def end(self, token):
+        digest = _digest(token)
+        with self._lock:
+            session = self._sessions.pop(digest, None)
+            self._ended[digest] = session[1] if session else time.time() + self.ttl
+            self._dirty = True
+            self._tick()
+        return session is not None
+
+    def __len__(self):
+        now = time.time()
+        return sum(1 for _, expires in self._sessions.values() if expires > now)
+
+    def close(self):
+        self.flush()
@@ -0,0 +1,198 @@
+"""Whole-book jobs over the sharded account layout (BANK_STORAGE=sharded), plus resharding.
+
+Every job runs one worker process per shard file:
+    python shards.py revalue --to EUR
+    python shards.py export accounts.csv
+    python shards.py bulk deactivate --currency EUR --has-card n --max-balance 0 --dry-run
+    python shards.py reshard 16
+"""
+from collections import defaultdict
+from pathlib import Path
+import argparse
+import csv
+import os
+import shutil
+from accounts import from_minor, to_minor
+from admin import BULK_ACTIONS, commit_bulk, filter_predicate, select_bulk
+from currency_exchange import CurrencyConverter
+from events import capture_events
+from storage import JsonStore, ShardedStore, load_shard, open_store, read_manifest
+
+BASE_DIR = Path(__file__).resolve().parent
+DB_DIR = BASE_DIR.parent / "db"
+EXPORT_COLUMNS = ("username", "currency", "balance", "activated", "is_admin", "card_brand", "card_type")
+
+
+# --- per-shard workers (module level so they can be pickled) ---
+def revalue_shard(path):
+    """{currency: [accounts, balance in minor units]} for one shard."""
+    totals = defaultdict(lambda: [0, 0])
+    for acct in load_shard(path).values():
+        currency = acct.get("currency", "USD")
+        total = totals[currency]
+        total[0] += 1
+        total[1] += to_minor(acct.get("balance", 0), currency)
+    return dict(totals)
+
+
+def part_path(out, path):
+    return Path(f"{out}.{Path(path).stem}")
+
+
+def export_shard(path, out):
+    part = part_path(out, path)
+    count = 0
+    with open(part, "w", newline="") as f:
+        writer = csv.writer(f)
+        for key, acct in load_shard(path).items():
+            card = acct.get("card") or {}
+            writer.writerow((key, acct.get("currency", "USD"), acct.get("balance", 0), acct.get("activated", True), acct.get("is_admin", False), card.get("card", ""), card.get("type", "")))
+            count += 1
+    return count
+
+
+def bulk_shard(path, action, filters, has_card, fields, dry_run):
+    if not path.exists():
+        return 0
+    # a shard worker writes the shard file directly; db/ is the shard directory's parent
+    store = capture_events(JsonStore(path), Path(path).parent.parent)
+    selected, _ = select_bulk(store, action, predicate=filter_predicate(filters, has_card), fields=fields)
+    if selected and not dry_run:
+        commit_bulk(store, action, selected)
+    return len(selected)
+
+
+# --- jobs ---
+def revalue(store, converter, target="USD", workers=None):
+    """Value the whole book in `target`; returns ({currency: (accounts, balance)}, total in target)."""
+    totals = defaultdict(lambda: [0, 0])
+    for part in store.map_shards(revalue_shard, workers=workers):
+        for currency, (count, minor) in part.items():
+            totals[currency][0] += count
+            totals[currency][1] += minor
+    by_currency = {currency: (count, from_minor(minor, currency)) for currency, (count, minor) in sorted(totals.items())}
+    total = sum(converter.convert(balance, currency, target) for currency, (_, balance) in by_currency.items())
+    return by_currency, total
+
+
+def export(store, out, workers=None):
+    """Write every account (without passwords or card secrets) to one CSV file; returns the row count."""
+    parts = [part_path(out, path) for path in store.paths]
+    try:
+        counts = store.map_shards(export_shard, str(out), workers=workers)
+        with open(out, "w", newline="") as f:
+            csv.writer(f).writerow(EXPORT_COLUMNS)
+            for part in parts:
+                with open(part, "r", newline="") as src:
+                    shutil.copyfileobj(src, f)
+    finally:
+        for part in parts:
+            if part.exists():
+                os.remove(part)
+    return sum(counts)
+
+
+def bulk(store, action, filters, has_card=None, fields=None, dry_run=False, workers=None):
+    """Apply an admin bulk action to every account matching the filters; each shard commits on its own."""
+    return sum(store.map_shards(bulk_shard, action, filters, has_card, fields, dry_run, workers=workers))
+
+
+def reshard(db_dir, shards, source=None):
+    """Move every account into a new layout of `shards` files.
+
+    The new shards are written to shards.new and swapped in with two renames; if a crash
+    lands between them, the next run puts shards.old back first. With no sharded layout
+    yet, accounts are taken from database.db (or `source`, a storage mode). Run it while
+    nothing else has the database open.
+    """
+    db_dir = Path(db_dir)
+    shard_dir = db_dir / "shards"
+    new_dir = db_dir / "shards.new"
+    old_dir = db_dir / "shards.old"
+    if not shard_dir.exists() and old_dir.exists():
+        os.replace(old_dir, shard_dir)
+    if source is None and read_manifest(shard_dir) is not None:
+        data = ShardedStore(shard_dir).all()
+    else:
+        data = open_store(db_dir, source or "json").all()
+    for leftover in (new_dir, old_dir):
+        if leftover.exists():
+            shutil.rmtree(leftover)
+    ShardedStore(new_dir, shards).replace_all(data)
+    if shard_dir.exists():
+        os.replace(shard_dir, old_dir)
+    os.replace(new_dir, shard_dir)
+    if old_dir.exists():
+        shutil.rmtree(old_dir)
+    return len(data)
+
+
+def yes_no(value):
+    if value.lower() not in ("y", "n"):
+        raise argparse.ArgumentTypeError("expected y or n")
+    return value.lower() == "y"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db-dir", type=Path, default=DB_DIR)
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per shard, at most one per core)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("revalue", help="value every account in one currency")
+    p.add_argument("--to", default="USD")
+
+    p = sub.add_parser("export", help="write all accounts to CSV")
+    p.add_argument("out", type=Path)
+
+    p = sub.add_parser("bulk", help="activate/deactivate/delete/change every matching account")
+    p.add_argument("action", choices=["activate", "deactivate", "delete", "change"])
+    p.add_argument("--currency")
+    p.add_argument("--activated", type=yes_no)
+    p.add_argument("--admin", dest="is_admin", type=yes_no)
+    p.add_argument("--card-brand")
+    p.add_argument("--card-type")
+    p.add_argument("--min-balance", type=float)
+    p.add_argument("--max-balance", type=float)
+    p.add_argument("--has-card", type=yes_no)
+    p.add_argument("--set", action="append", default=[], metavar="FIELD=VALUE", help="for change (password, currency, balance)")
+    p.add_argument("--dry-run", action="store_true")
+
+    p = sub.add_parser("reshard", help="move every account into a new number of shards")
+    p.add_argument("shards", type=int)
+    p.add_argument("--from", dest="source", help="storage mode to read from when there are no shards yet (default json)")
+    args = parser.parse_args()
+
+    if args.command == "reshard":
+        count = reshard(args.db_dir, args.shards, args.source)
+        print(f"Moved {count} accounts into {args.shards} shards")
+        return
+    store = ShardedStore(args.db_dir / "shards")
+    if not store.exists():
+        parser.error(f"no sharded database in {args.db_dir} (create one with: shards.py reshard N)")
+
+    if args.command == "revalue":
+        by_currency, total = revalue(store, CurrencyConverter(args.db_dir / "currency.db"), args.to.upper(), args.workers)
+        for currency, (count, balance) in by_currency.items():
+            print(f"{currency:<6}{count:>10} accounts {balance:>20.2f}")
+        print(f"\nTotal: {total:.2f} {args.to.upper()}")
+    elif args.command == "export":
+        print(f"Exported {export(store, args.out, args.workers)} accounts to {args.out}")
+    elif args.command == "bulk":
+        filters = {}
+        for field in ("currency", "activated", "is_admin", "card_brand", "card_type", "min_balance", "max_balance"):
+            value = getattr(args, field)
+            if value is not None:
+                filters[field] = value.upper() if isinstance(value, str) else value
+        fields = {}
+        for item in args.set:
+            field, _, value = item.partition("=")
+            fields[field] = float(value) if field == "balance" else value
+        if args.action == "change" and not fields:
+            parser.error("change needs at least one --set FIELD=VALUE")
+        count = bulk(store, args.action, filters, args.has_card, fields, args.dry_run, args.workers)
+        print(f"{count} accounts {'would be ' if args.dry_run else ''}{BULK_ACTIONS[args.action]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""Binary snapshot format for database.db (and shard files).
+
+Instead of one JSON object per account, the accounts are stored column by column:
+
+    magic "BANKSNP1", then length-prefixed sections:
+    usernames, passwords        NUL-separated UTF-8 string tables
+    currencies                  NUL-separated table of distinct codes
+    currency ids                uint16 per account
+    balances                    float64 per account
+    flags                       uint8 per account: activated, is_admin, has card
+    card numbers, CVCs          uint64 / uint16 per card
+    expirations, brands, types  NUL-separated tables (brands and types deduplicated)
+    brand ids, type ids         uint8 per card
+    extras                      JSON for anything that does not fit the columns
+
+Loading splits each table once and zips the columns back into account dicts, so there
+is no per-character parsing. storage.py detects the format by the magic header and
+keeps writing a file in the format it already has (new files: BANK_SNAPSHOT=binary or
+json, default json). Convert with:
+
+    python snapshot.py ../db/database.db --to binary    (or --to json)
+"""
+from array import array
+from itertools import compress
+from pathlib import Path
+import argparse
+import gc
+import json
+import struct
+import sys
+
+MAGIC = b"BANKSNP1"
+SECTION = struct.Struct("<Q")
+FIELDS = ("password", "currency", "balance", "activated", "is_admin", "card")
+CARD_FIELDS = ("number", "expiration", "card", "type", "CVC")
+FIELD_SET, CARD_KEYS = frozenset(FIELDS), frozenset(CARD_FIELDS)
+ACTIVATED, IS_ADMIN, HAS_CARD = 1, 2, 4
+
+
+def is_snapshot(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except FileNotFoundError:
+        return False
+
+
+def _table(strings):
+    return "\0".join(strings).encode()
+
+
+def _split(blob, count):
+    return blob.decode().split("\0") if count else []
+
+
+def _fits_card(card):
+    return (
+        card.keys() == CARD_KEYS
+        and type(card["number"]) is int and 0 <= card["number"] < 1 << 64
+        and type(card["CVC"]) is int and 0 <= card["CVC"] < 1 << 16
+        and type(card["expiration"]) is str and type(card["card"]) is str and type(card["type"]) is str
+    )
+
+
+def _columns(data, strict):
+    names, passwords, flags = [], [], bytearray()
+    currency_ids, balances = array("H"), array("d")
+    numbers, cvcs, brand_ids, type_ids = array("Q"), array("H"), array("B"), array("B")
+    expirations = []
+    currencies, brands, kinds = {}, {}, {}
+    extras = {}
+    for key, acct in data.items():
+        password = acct.get("password")
+        currency = acct.get("currency", "USD")
+        balance = acct.get("balance", 0)
+        activated = acct.get("activated", True)
+        is_admin = acct.get("is_admin", False)
+        card = acct.get("card")
+        # anything unusual goes to the JSON extras section instead of the columns
+        if (
+            not acct.keys() <= FIELD_SET
+            or type(password) is not str or type(currency) is not str
+            or type(balance) not in (int, float) or type(activated) is not bool or type(is_admin) is not bool
+            or (card is not None and (type(card) is not dict or not _fits_card(card)))
+            or (strict and any("\0" in text for text in (key, password, currency, *(card and (card["expiration"], card["card"], card["type"]) or ()))))
+        ):
+            extras[key] = acct
+            continue
+        names.append(key)
+        passwords.append(password)
+        currency_ids.append(currencies.setdefault(currency, len(currencies)))
+        balances.append(balance)
+        if card is None:
+            flags.append(ACTIVATED * activated | IS_ADMIN * is_admin)
+        else:
+            flags.append(ACTIVATED * activated | IS_ADMIN * is_admin | HAS_CARD)
+            numbers.append(card["number"])
+            cvcs.append(card["CVC"])
+            expirations.append(card["expiration"])
+            brand_ids.append(brands.setdefault(card["card"], len(brands)))
+            type_ids.append(kinds.setdefault(card["type"], len(kinds)))
+    if len(brands) > 255 or len(kinds) > 255:
+        raise ValueError("Too many distinct card brands or types for a binary snapshot")
+    tables = [_table(names), _table(passwords), _table(currencies), _table(expirations), _table(brands), _table(kinds)]
+    counts = [len(names), len(passwords), len(currencies), len(expirations), len(brands), len(kinds)]
+    if not strict and any(table.count(b"\0") != max(count - 1, 0) for table, count in zip(tables, counts)):
+        # a NUL inside some string: redo it, checking every string this time
+        return _columns(data, strict=True)
+    names, passwords, currencies, expirations, brands, kinds = tables
+    return (
+        names, passwords, currencies, currency_ids.tobytes(), balances.tobytes(), bytes(flags),
+        numbers.tobytes(), cvcs.tobytes(), expirations, brands, kinds, brand_ids.tobytes(), type_ids.tobytes(),
+        json.dumps(extras).encode(),
+    )
+
+
+def dump(data, f):
+    """Write {username: account} to a binary file object."""
+    f.write(MAGIC)
+    for section in _columns(data, strict=False):
+        f.write(SECTION.pack(len(section)))
+        f.write(section)
+
+
+def _sections(f):
+    while True:
+        head = f.read(SECTION.size)
+        if not head:
+            return
+        yield f.read(SECTION.unpack(head)[0])
+
+
+def load(f):
+    """Read {username: account} from a binary file object positioned after the magic."""
+    (names, passwords, currencies, currency_ids, balances, flags, numbers, cvcs, expirations, brands, kinds, brand_ids, type_ids, extras) = _sections(f)
+    count = len(flags)
+    cards = len(brand_ids)
+    brands, kinds = _split(brands, cards), _split(kinds, cards)
+    # the collector would otherwise walk the growing heap many times over; nothing built
+    # here can form a cycle
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        card_column = [None] * count
+        with_card = compress(range(count), map(HAS_CARD.__and__, flags))
+        for i, number, expiration, brand, kind, cvc in zip(with_card, array("Q", numbers), _split(expirations, cards), brand_ids, type_ids, array("H", cvcs)):
+            card_column[i] = {"number": number, "expiration": expiration, "card": brands[brand], "type": kinds[kind], "CVC": cvc}
+        currency_column = map(_split(currencies, count).__getitem__, array("H", currency_ids))
+        activated, is_admin = (ACTIVATED & f != 0 for f in range(8)), (IS_ADMIN & f != 0 for f in range(8))
+        activated, is_admin = tuple(activated), tuple(is_admin)
+        data = {
+            key: {"password": password, "currency": currency, "balance": balance, "activated": activated[flag], "is_admin": is_admin[flag], "card": card}
+            for key, password, currency, balance, flag, card in zip(_split(names, count), _split(passwords, count), currency_column, array("d", balances), flags, card_column)
+        }
+    finally:
+        if enabled:
+            gc.enable()
+    data.update(json.loads(extras))
+    return data
+
+
+def convert(path, to, out=None):
+    """Rewrite a database file as `to` ("binary" or "json"); returns the number of accounts."""
+    from storage import read_database, write_database
+
+    data = read_database(path)
+    write_database(out or path, data, to)
+    return len(data)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert database.db (or a shard file) between JSON and the binary snapshot format.")
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--to", choices=("binary", "json"), required=True)
+    parser.add_argument("--out", type=Path, help="write here instead of replacing path")
+    args = parser.parse_args()
+    before = args.path.stat().st_size
+    count = convert(args.path, args.to, args.out)
+    after = (args.out or args.path).stat().st_size
+    print(f"{count} accounts: {before} -> {after} bytes", file=sys.stderr)
@@ -0,0 +1,1086 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import repeat
+from pathlib import Path
+import atexit
+import heapq
+import json
+import os
+import sqlite3
+import secrets
+import sys
+import time
+import zlib
+import instrumentation
+import snapshot
+from accounts import Account
+from indexes import AccountIndex, check_filters, index_values, scan_search
+from events import capture_events, diff
+from instrumentation import dump_json, instrument_store, load_json
+from locks import FileLock
+
+STORAGE_ENV = "BANK_STORAGE"
+WRITE_BACK_ENV = "BANK_WRITE_BACK"
+SHARDS_ENV = "BANK_SHARDS"
+SNAPSHOT_ENV = "BANK_SNAPSHOT"
+
+JOURNAL_BYTES = 64 << 20
+
+_shared_caches = {}
+
+
+def file_signature(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def write_atomic(path, write, binary=False):
+    """Write path through write(f) on a temp file, fsync it and rename it into place."""
+    path = Path(path)
+    # per-process temp name, so concurrent writers never share a half-written file
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb" if binary else "w") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    if os.name == "posix":
+        # make the rename itself durable
+        fd = os.open(path.parent, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def write_json_atomic(path, data, indent=4):
+    write_atomic(path, lambda f: dump_json(data, f, indent=indent))
+
+
+# --- database files: JSON or binary snapshot, told apart by the magic header ---
+def read_database(path):
+    with open(path, "rb") as f:
+        return read_database_file(f)
+
+
+def read_database_file(f):
+    if f.read(len(snapshot.MAGIC)) == snapshot.MAGIC:
+        return snapshot.load(f)
+    f.seek(0)
+    return load_json(f)
+
+
+def write_database(path, data, fmt=None, changed=None):
+    """Atomically write accounts in fmt; by default the format the file already has
+    (new files: BANK_SNAPSHOT, else JSON). Writers that know which keys they changed
+    pass them as `changed` (a set), which journals them for backup.py."""
+    if fmt is None:
+        fmt = "binary" if snapshot.is_snapshot(path) else "json" if Path(path).exists() else os.getenv(SNAPSHOT_ENV) or "json"
+    before = file_signature(path) if changed is not None else None
+    if fmt == "binary":
+        write_atomic(path, lambda f: snapshot.dump(data, f), binary=True)
+    elif fmt == "json":
+        write_json_atomic(path, data)
+    else:
+        raise ValueError(f"Unknown database format: {fmt}")
+    # past half the book, reading the whole file is no dearer than replaying the journal
+    if changed is not None and before is not None and len(changed) <= len(data) // 2:
+        _journal(Path(path), before, file_signature(path), data, changed)
+
+
+def _journal(path, before, after, data, changed):
+    """Append one write to <path>.changes: the file's signature before and after it, the
+    new value (None: deleted) of every changed account in file order, and the crc32 of
+    the order of all the usernames.
+
+    backup.py replays the lines since its last backup instead of re-reading the file,
+    as long as they chain from the signature it saw then to the one it sees now. A write
+    that is not journaled breaks the chain, so the next backup reads the file whole.
+    Callers hold the file's commit lock.
+    """
+    journal = path.with_name(path.name + ".changes")
+    size = file_signature(journal)[2] if journal.exists() else 0
+    if size > JOURNAL_BYTES:
+        # a fresh journal (and id): the next backup reads the file whole once
+        journal.unlink()
+        size = 0
+    # the scan is cheap next to the write itself, and puts new accounts in file order
+    accounts = {key: value for key, value in data.items() if key in changed}
+    accounts.update((key, None) for key in changed if key not in data)
+    with open(journal, "ab") as f:
+        if not size:
+            f.write((json.dumps({"journal": secrets.token_hex(8)}) + "\n").encode())
+        entry = {"before": before, "after": after, "accounts": accounts, "order": zlib.crc32("\0".join(data).encode())}
+        f.write((json.dumps(entry, separators=(",", ":")) + "\n").encode())
+
+
+def commit_lock(path):
+    """Lock serialising read-modify-write commits of `path` across processes (<path>.lock)."""
+    path = Path(path)
+    return FileLock(path.with_name(path.name + ".lock"))
+
+
+# --- change capture: stores call these around a commit, with its lock held ---
+def _before(events, data, keys, export=dict):
+    """Copies of the accounts a write is about to change (None: not capturing)."""
+    if events is None:
+        return None
+    return {key: export(data[key]) if key in data else None for key in keys}
+
+
+def _publish(events, before, data, export=dict):
+    """Publish the difference between `before` and what `data` now holds."""
+    if before:
+        events.publish([change for key, old in before.items() for change in diff(key, old, export(data[key]) if key in data else None)])
+
+
+def open_store(db_dir, mode=None, write_back=None):
+    mode = (mode or os.getenv(STORAGE_ENV) or "json").lower()
+    database_db = Path(db_dir) / "database.db"
+    if mode == "json":
+        store = JsonStore(database_db)
+    elif mode == "wal":
+        store = LogStore(database_db)
+    elif mode == "sqlite":
+        store = SqliteStore(Path(db_dir) / "database.sqlite")
+    elif mode == "sharded":
+        store = ShardedStore(Path(db_dir) / "shards")
+    elif mode in ("cached", "compact"):
+        # one cache per file, shared by every Features/Admin in the process
+        key = (mode, database_db.resolve())
+        if key not in _shared_caches:
+            cls = CachedStore if mode == "cached" else CompactStore
+            cache = cls(database_db, write_back or os.getenv(WRITE_BACK_ENV) or "immediate")
+            _shared_caches[key] = instrument_store(capture_events(cache, db_dir))
+        return _shared_caches[key]
+    else:
+        raise ValueError(f"Unknown storage mode: {mode}")
+    return instrument_store(capture_events(store, db_dir))
+
+
+class JsonStore:
+    """Whole-file storage: every call parses database.db and every mutation rewrites it.
+
+    Mutations hold the commit lock from load to rename, so writers in other processes
+    never lose each other's changes, and readers always see a complete file.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.events = None
+        self._commit = commit_lock(self.path)
+
+    def _load(self):
+        return read_database(self.path)
+
+    def _dump(self, data, changed=None):
+        write_database(self.path, data, changed=changed)
+
+    def exists(self):
+        return self.path.exists()
+
+    def get(self, key):
+        return self._load().get(key)
+
+    def get_many(self, keys):
+        data = self._load()
+        return {key: data[key] for key in keys if key in data}
+
+    def __contains__(self, key):
+        return key in self._load()
+
+    def all(self):
+        return self._load()
+
+    def items(self):
+        yield from self._load().items()
+
+    def replace_all(self, data):
+        with self._commit:
+            old = self._load() if self.events is not None and self.path.exists() else {}
+            before = _before(self.events, old, old.keys() | data.keys())
+            self._dump(data)
+            _publish(self.events, before, data)
+
+    def put_many(self, accounts):
+        with self._commit:
+            db = self._load()
+            before = _before(self.events, db, accounts)
+            db.update(accounts)
+            self._dump(db, set(accounts))
+            _publish(self.events, before, db)
+
+    def put(self, key, acct):
+        with self._commit:
+            db = self._load()
+            before = _before(self.events, db, (key,))
+            db[key] = acct
+            self._dump(db, {key})
+            _publish(self.events, before, db)
+
+    def update(self, key, fields):
+        with self._commit:
+            db = self._load()
+            before = _before(self.events, db, (key,))
+            db[key].update(fields)
+            self._dump(db, {key})
+            _publish(self.events, before, db)
+
+    def update_many(self, updates):
+        with self._commit:
+            db = self._load()
+            before = _before(self.events, db, updates)
+            for key, fields in updates.items():
+                db[key].update(fields)
+            self._dump(db, set(updates))
+            _publish(self.events, before, db)
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        with self._commit:
+            db = self._load()
+            before = _before(self.events, db, keys)
+            for key in keys:
+                db.pop(key, None)
+            self._dump(db, set(keys))
+            _publish(self.events, before, db)
+
+    def delete(self, key):
+        with self._commit:
+            db = self._load()
+            before = _before(self.events, db, (key,))
+            db.pop(key, None)
+            self._dump(db, {key})
+            _publish(self.events, before, db)
+
+    def search(self, filters, offset=0, limit=20):
+        return scan_search(self._load().items(), filters, offset, limit)
+
+    def close(self):
+        pass
+
+
+class CachedStore:
+    """database.db kept in memory and re-parsed only when the file's inode/mtime/size change.
+
+    Mutations, batches included, mark accounts dirty; write_back decides when they reach
+    disk: "immediate", an integer N (every N mutations, a batch counting as one) or "exit"
+    (on close or interpreter exit). Dirty
+    accounts are laid over a newer on-disk copy instead of being lost on reload.
+    """
+
+    def __init__(self, path, write_back="immediate"):
+        self.path = Path(path)
+        if write_back not in ("immediate", "exit"):
+            write_back = int(write_back)
+        self.write_back = write_back
+        self._data = None
+        self._sig = None
+        self._pinned = None
+        self._dirty = set()
+        self._deleted = set()
+        self._pending = 0
+        self._index = None
+        self._commit = commit_lock(self.path)
+        self.events = None
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        atexit.register(self.flush)
+
+    def _accounts(self):
+        sig = file_signature(self.path)
+        if self._data is not None and sig == self._sig:
+            self.hits += 1
+            return self._data
+        self.misses += 1
+        f, sig = self._open()
+        data = self._from_disk(read_database_file(f)) if f is not None else {}
+        self._pin(f)
+        for key in self._dirty:
+            data[key] = self._data[key]
+        for key in self._deleted:
+            data.pop(key, None)
+        self._data = data
+        self._sig = sig
+        self._index = None
+        return data
+
+    def _mutated(self, keys, deleted=False):
+        # one call per store operation, so a batch counts as one mutation towards write_back
+        for key in keys:
+            if self._index is not None:
+                self._reindex(key)
+            if deleted:
+                self._dirty.discard(key)
+                self._deleted.add(key)
+            else:
+                self._deleted.discard(key)
+                self._dirty.add(key)
+        self._pending += 1
+        if self.write_back == "immediate" or (self.write_back != "exit" and self._pending >= self.write_back):
+            self.flush()
+
+    def flush(self):
+        if not self._dirty and not self._deleted:
+            return
+        with self._commit:
+            # under the lock, so another process's flush cannot land between reload and write
+            data = self._accounts()
+            write_database(self.path, self._to_disk(data), changed=self._dirty | self._deleted)
+            f, self._sig = self._open()
+            self._pin(f)
+        self._dirty.clear()
+        self._deleted.clear()
+        self._pending = 0
+        self.flushes += 1
+
+    def _open(self):
+        """database.db opened for reading, with the signature of that very file."""
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return None, None
+        st = os.fstat(f.fileno())
+        return f, (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _pin(self, f):
+        # Writers replace database.db by rename, so a later version can get the inode of an
+        # earlier one back, with the same size and (coarse) mtime. Holding the loaded file
+        # open keeps its inode taken, so an equal signature means the same file. Windows
+        # cannot replace an open file, and does not reuse inode numbers like this anyway.
+        if self._pinned is not None:
+            self._pinned.close()
+        self._pinned = None
+        if f is not None:
+            if os.name == "posix":
+                self._pinned = f
+            else:
+                f.close()
+
+    # --- in-memory representation (overridden by CompactStore) ---
+    def _from_disk(self, data):
+        return data
+
+    def _to_disk(self, data):
+        return data
+
+    def _record(self, acct):
+        return dict(acct)
+
+    def _export(self, record):
+        return dict(record)
+
+    def _patch(self, record, fields):
+        record.update(fields)
+
+    def _index_values(self, record):
+        return index_values(record)
+
+    # --- secondary indexes (built on the first search, then kept up to date) ---
+    def _reindex(self, key):
+        record = self._data.get(key)
+        if record is None:
+            self._index.remove(key)
+        else:
+            self._index.add(key, *self._index_values(record))
+
+    def search(self, filters, offset=0, limit=20):
+        """Accounts matching filters (see indexes.FILTERS): (total, [(key, acct), ...])."""
+        data = self._accounts()
+        if self._index is None:
+            self._index = AccountIndex()
+            self._index.add_many((key, *self._index_values(record)) for key, record in data.items())
+        total, keys = self._index.search(filters, offset, limit)
+        return total, [(key, self._export(data[key])) for key in keys]
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "flushes": self.flushes, "dirty": len(self._dirty) + len(self._deleted)}
+
+    # --- store interface ---
+    def exists(self):
+        return self.path.exists() or bool(self._dirty)
+
+    def get(self, key):
+        record = self._accounts().get(key)
+        return self._export(record) if record is not None else None
+
+    def get_many(self, keys):
+        data = self._accounts()
+        return {key: self._export(data[key]) for key in keys if key in data}
+
+    def __contains__(self, key):
+        return key in self._accounts()
+
+    def all(self):
+        return {k: self._export(v) for k, v in self._accounts().items()}
+
+    def items(self):
+        # one account copied out at a time, not the whole book
+        for key, record in self._accounts().items():
+            yield key, self._export(record)
+
+    @contextmanager
+    def _capture(self, keys, everything=False):
+        # mutations only take the commit lock to flush; capturing holds it throughout, so the
+        # old values are the ones the write replaces and events keep the commit order
+        if self.events is None:
+            yield
+            return
+        with self._commit:
+            data = self._accounts()
+            before = _before(self.events, data, data.keys() | keys if everything else keys, self._export)
+            yield
+            _publish(self.events, before, self._data, self._export)
+
+    def replace_all(self, data):
+        with self._capture(data.keys(), everything=True):
+            old = self._accounts()
+            self._data = {k: self._record(v) for k, v in data.items()}
+            self._index = None
+            self._deleted.update(k for k in old if k not in self._data)
+            self._dirty.update(self._data)
+            self.flush()
+
+    def put(self, key, acct):
+        with self._capture((key,)):
+            self._accounts()[key] = self._record(acct)
+            self._mutated((key,))
+
+    def update(self, key, fields):
+        with self._capture((key,)):
+            self._patch(self._accounts()[key], fields)
+            self._mutated((key,))
+
+    def update_many(self, updates):
+        with self._capture(updates):
+            data = self._accounts()
+            for key, fields in updates.items():
+                self._patch(data[key], fields)
+            self._mutated(updates)
+
+    def put_many(self, accounts):
+        with self._capture(accounts):
+            data = self._accounts()
+            for key, acct in accounts.items():
+                data[key] = self._record(acct)
+            self._mutated(accounts)
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        with self._capture(keys):
+            data = self._accounts()
+            for key in keys:
+                data.pop(key, None)
+            self._mutated(keys, deleted=True)
+
+    def delete(self, key):
+        with self._capture((key,)):
+            self._accounts().pop(key, None)
+            self._mutated((key,), deleted=True)
+
+    def close(self):
+        self.flush()
+
+
+class CompactStore(CachedStore):
+    """CachedStore that keeps accounts as __slots__ Account records with integer minor-unit
+    balances, interned usernames and cards packed into tuples until someone reads them."""
+
+    def _from_disk(self, data):
+        return {sys.intern(key): Account.from_dict(acct) for key, acct in data.items()}
+
+    def _to_disk(self, data):
+        return {key: record.to_dict() for key, record in data.items()}
+
+    def _record(self, acct):
+        return Account.from_dict(acct)
+
+    def _export(self, record):
+        return record.export()
+
+    def _index_values(self, record):
+        card = record._card
+        values = (record.currency, bool(record.activated), bool(record.is_admin), card[2] if card else None, card[3] if card else None)
+        return values, record.balance
+
+    def records(self):
+        """Iterate (key, Account) pairs without building dicts, for full scans."""
+        return iter(self._accounts().items())
+
+
+class LogStore:
+    """database.db snapshot plus an append-only database.db.log of small mutation records.
+
+    Accounts live in memory; each mutation appends one JSON line to the log, so its cost
+    does not depend on the number of accounts. Once the log outgrows the snapshot,
+    compact() folds it back into database.db. Records carry absolute values, so replaying
+    a record that is already part of the snapshot is harmless.
+    """
+
+    def __init__(self, path, sync=True, compact_ratio=1.0, min_compact_bytes=1 << 20):
+        self.path = Path(path)
+        self.log_path = self.path.with_name(self.path.name + ".log")
+        self.sync = sync
+        self.compact_ratio = compact_ratio
+        self.min_compact_bytes = min_compact_bytes
+        self._log = None
+        self._index = None
+        self._logged = set()  # keys the log has changed since the snapshot
+        self.events = None
+        self._commit = commit_lock(self.path)
+        with self._commit:
+            self._reload()
+            # drop a torn record left behind by a crash mid-append
+            if self.log_path.exists() and self.log_path.stat().st_size > self._log_pos:
+                os.truncate(self.log_path, self._log_pos)
+
+    # --- replay ---
+    def _reload(self):
+        self._snap_sig = file_signature(self.path)
+        if self._snap_sig is None:
+            self._data = {}
+        else:
+            self._data = read_database(self.path)
+        self._index = None
+        self._logged = set()
+        self._log_pos = 0
+        self._replay()
+
+    def _replay(self):
+        try:
+            f = open(self.log_path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            f.seek(self._log_pos)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                self._apply(json.loads(line))
+                self._log_pos += len(line)
+
+    def _refresh(self):
+        # pick up changes made by another store instance or process
+        with self._commit:
+            if file_signature(self.path) != self._snap_sig:
+                self._reload()
+                return
+            try:
+                log_size = os.stat(self.log_path).st_size
+            except FileNotFoundError:
+                log_size = 0
+            if log_size < self._log_pos:
+                self._reload()
+            elif log_size > self._log_pos:
+                self._replay()
+
+    def _apply(self, rec):
+        op = rec["op"]
+        if op == "put":
+            self._data[rec["key"]] = dict(rec["value"])
+        elif op == "update":
+            self._data[rec["key"]].update(rec["fields"])
+        elif op == "delete":
+            self._data.pop(rec["key"], None)
+        elif op == "batch":
+            for key, fields in rec["updates"].items():
+                self._data[key].update(fields)
+        elif op == "put_many":
+            for key, acct in rec["accounts"].items():
+                self._data[key] = dict(acct)
+        elif op == "delete_many":
+            for key in rec["keys"]:
+                self._data.pop(key, None)
+        else:
+            raise ValueError(f"Unknown log record: {op}")
+        self._logged.update(self._keys(rec))
+        if self._index is not None:
+            for key in self._keys(rec):
+                acct = self._data.get(key)
+                if acct is None:
+                    self._index.remove(key)
+                else:
+                    self._index.add(key, *index_values(acct))
+
+    @staticmethod
+    def _keys(rec):
+        op = rec["op"]
+        return rec["updates"] if op == "batch" else rec["accounts"] if op == "put_many" else rec["keys"] if op == "delete_many" else (rec["key"],)
+
+    def _append(self, rec):
+        with self._commit:
+            self._refresh()
+            if rec["op"] == "update" and rec["key"] not in self._data:
+                raise KeyError(rec["key"])
+            if rec["op"] == "batch":
+                missing = next((key for key in rec["updates"] if key not in self._data), None)
+                if missing is not None:
+                    raise KeyError(missing)
+            before = _before(self.events, self._data, self._keys(rec))
+            if self._log is None:
+                self._log = open(self.log_path, "ab")
+            line = (json.dumps(rec, separators=(",", ":")) + "\n").encode()
+            start = time.perf_counter()
+            self._log.write(line)
+            self._log.flush()
+            if self.sync:
+                os.fsync(self._log.fileno())
+            if instrumentation.ENABLED:
+                instrumentation.record("log.append", time.perf_counter() - start, len(line))
+            self._apply(rec)
+            self._log_pos += len(line)
+            snap_bytes = self._snap_sig[2] if self._snap_sig else 0
+            if self._log_pos > max(self.min_compact_bytes, snap_bytes * self.compact_ratio):
+                self._write_snapshot(self._logged)
+            _publish(self.events, before, self._data)
+
+    # --- compaction ---
+    def _write_snapshot(self, changed=None):
+        write_database(self.path, self._data, changed=changed)
+        if self.log_path.exists():
+            os.truncate(self.log_path, 0)
+        self._snap_sig = file_signature(self.path)
+        self._logged = set()
+        self._log_pos = 0
+
+    def compact(self):
+        with self._commit:
+            self._refresh()
+            self._write_snapshot(self._logged)
+
+    # --- store interface ---
+    def exists(self):
+        return self.path.exists() or self.log_path.exists()
+
+    def get(self, key):
+        self._refresh()
+        acct = self._data.get(key)
+        return dict(acct) if acct is not None else None
+
+    def get_many(self, keys):
+        self._refresh()
+        return {key: dict(self._data[key]) for key in keys if key in self._data}
+
+    def __contains__(self, key):
+        self._refresh()
+        return key in self._data
+
+    def all(self):
+        self._refresh()
+        return {k: dict(v) for k, v in self._data.items()}
+
+    def items(self):
+        self._refresh()
+        for key, acct in self._data.items():
+            yield key, dict(acct)
+
+    def replace_all(self, data):
+        with self._commit:
+            if self.events is not None:
+                self._refresh()
+            before = _before(self.events, self._data, self._data.keys() | data.keys())
+            self._data = {k: dict(v) for k, v in data.items()}
+            self._index = None
+            self._write_snapshot()
+            _publish(self.events, before, self._data)
+
+    def put(self, key, acct):
+        self._append({"op": "put", "key": key, "value": acct})
+
+    def update(self, key, fields):
+        self._append({"op": "update", "key": key, "fields": fields})
+
+    def update_many(self, updates):
+        # a single record, so the whole batch is replayed or not at all
+        self._append({"op": "batch", "updates": updates})
+
+    def put_many(self, accounts):
+        self._append({"op": "put_many", "accounts": accounts})
+
+    def delete(self, key):
+        self._append({"op": "delete", "key": key})
+
+    def delete_many(self, keys):
+        self._append({"op": "delete_many", "keys": list(keys)})
+
+    def search(self, filters, offset=0, limit=20):
+        self._refresh()
+        if self._index is None:
+            self._index = AccountIndex()
+            self._index.add_many((key, *index_values(acct)) for key, acct in self._data.items())
+        total, keys = self._index.search(filters, offset, limit)
+        return total, [(key, dict(self._data[key])) for key in keys]
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        if self._log_pos:
+            self.compact()
+
+
+class SqliteStore:
+    """Accounts as rows of an SQLite table (WAL journal); updates touch a single row."""
+
+    COLUMNS = ("password", "currency", "balance", "activated", "is_admin", "card")
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.events = None
+        self._commit = commit_lock(self.path)
+        # wait for other writers instead of failing with "database is locked"
+        self.conn = sqlite3.connect(self.path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS accounts ("
+                "username TEXT PRIMARY KEY, password TEXT NOT NULL, currency TEXT NOT NULL, "
+                "balance REAL NOT NULL DEFAULT 0, activated INTEGER NOT NULL DEFAULT 1, "
+                "is_admin INTEGER NOT NULL DEFAULT 0, card TEXT)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_accounts_currency ON accounts (currency)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_accounts_flags ON accounts (activated, is_admin)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_accounts_balance ON accounts (balance)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_accounts_card ON accounts (json_extract(card, '$.card'), json_extract(card, '$.type'))")
+
+    @staticmethod
+    def _to_row(acct):
+        card = acct.get("card")
+        return (
+            acct["password"],
+            acct.get("currency", "USD"),
+            acct.get("balance", 0),
+            int(acct.get("activated", True)),
+            int(acct.get("is_admin", False)),
+            json.dumps(card) if card is not None else None,
+        )
+
+    @staticmethod
+    def _to_account(row):
+        password, currency, balance, activated, is_admin, card = row
+        return {
+            "password": password,
+            "currency": currency,
+            "balance": balance,
+            "activated": bool(activated),
+            "is_admin": bool(is_admin),
+            "card": json.loads(card) if card is not None else None,
+        }
+
+    @contextmanager
+    def _capture(self, keys, everything=False):
+        # SQLite's own lock ends with each transaction; capturing holds the commit lock
+        # across reading the old rows, the write and reading back what was stored
+        if self.events is None:
+            yield
+            return
+        with self._commit:
+            if everything:
+                before = self.all()
+                keys = before.keys() | keys
+            else:
+                keys = list(keys)
+                before = self.get_many(keys)
+            yield
+            after = self.get_many(keys)
+            self.events.publish([change for key in keys for change in diff(key, before.get(key), after.get(key))])
+
+    def exists(self):
+        return self.conn.execute("SELECT 1 FROM accounts LIMIT 1").fetchone() is not None
+
+    def get(self, key):
+        row = self.conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM accounts WHERE username = ?", (key,)).fetchone()
+        return self._to_account(row) if row else None
+
+    def get_many(self, keys):
+        keys = list(keys)
+        found = {}
+        # stay under SQLite's limit on bound parameters
+        for i in range(0, len(keys), 500):
+            part = keys[i : i + 500]
+            rows = self.conn.execute(f"SELECT username, {', '.join(self.COLUMNS)} FROM accounts WHERE username IN ({', '.join('?' * len(part))})", part)
+            found.update((row[0], self._to_account(row[1:])) for row in rows)
+        return found
+
+    def __contains__(self, key):
+        return self.conn.execute("SELECT 1 FROM accounts WHERE username = ?", (key,)).fetchone() is not None
+
+    def all(self):
+        rows = self.conn.execute(f"SELECT username, {', '.join(self.COLUMNS)} FROM accounts")
+        return {row[0]: self._to_account(row[1:]) for row in rows}
+
+    def items(self):
+        for row in self.conn.execute(f"SELECT username, {', '.join(self.COLUMNS)} FROM accounts"):
+            yield row[0], self._to_account(row[1:])
+
+    def replace_all(self, data):
+        with self._capture(data.keys(), everything=True), self.conn:
+            self.conn.execute("DELETE FROM accounts")
+            self.conn.executemany(
+                f"INSERT INTO accounts (username, {', '.join(self.COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((key,) + self._to_row(acct) for key, acct in data.items()),
+            )
+
+    def put(self, key, acct):
+        with self._capture((key,)), self.conn:
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO accounts (username, {', '.join(self.COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key,) + self._to_row(acct),
+            )
+
+    def put_many(self, accounts):
+        with self._capture(accounts), self.conn:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO accounts (username, {', '.join(self.COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((key,) + self._to_row(acct) for key, acct in accounts.items()),
+            )
+
+    def _encode_fields(self, fields):
+        fields = {k: v for k, v in fields.items() if k in self.COLUMNS}
+        if fields.get("card") is not None:
+            fields["card"] = json.dumps(fields["card"])
+        return fields
+
+    def update(self, key, fields):
+        fields = self._encode_fields(fields)
+        if not fields:
+            return
+        assignments = ", ".join(f"{k} = ?" for k in fields)
+        with self._capture((key,)), self.conn:
+            cur = self.conn.execute(f"UPDATE accounts SET {assignments} WHERE username = ?", (*fields.values(), key))
+        if cur.rowcount == 0:
+            raise KeyError(key)
+
+    def update_many(self, updates):
+        with self._capture(updates), self.conn:
+            for key, fields in updates.items():
+                fields = self._encode_fields(fields)
+                if fields:
+                    assignments = ", ".join(f"{k} = ?" for k in fields)
+                    self.conn.execute(f"UPDATE accounts SET {assignments} WHERE username = ?", (*fields.values(), key))
+
+    def delete(self, key):
+        with self._capture((key,)), self.conn:
+            self.conn.execute("DELETE FROM accounts WHERE username = ?", (key,))
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        with self._capture(keys), self.conn:
+            self.conn.executemany("DELETE FROM accounts WHERE username = ?", ((key,) for key in keys))
+
+    SEARCH_CLAUSES = {
+        "currency": "currency = ?",
+        "activated": "activated = ?",
+        "is_admin": "is_admin = ?",
+        "card_brand": "json_extract(card, '$.card') = ?",
+        "card_type": "json_extract(card, '$.type') = ?",
+        "min_balance": "balance >= ?",
+        "max_balance": "balance <= ?",
+    }
+
+    def search(self, filters, offset=0, limit=20):
+        check_filters(filters)
+        clauses = [self.SEARCH_CLAUSES[name] for name in filters]
+        params = [int(v) if isinstance(v, bool) else v for v in filters.values()]
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        order = "balance, username" if "min_balance" in filters or "max_balance" in filters else "username"
+        total = self.conn.execute(f"SELECT COUNT(*) FROM accounts{where}", params).fetchone()[0]
+        rows = self.conn.execute(
+            f"SELECT username, {', '.join(self.COLUMNS)} FROM accounts{where} ORDER BY {order} LIMIT ? OFFSET ?",
+            (*params, limit, offset),
+        )
+        return total, [(row[0], self._to_account(row[1:])) for row in rows]
+
+    def close(self):
+        self.conn.close()
+
+
+# --- sharded layout ---
+def shard_index(key, shards):
+    # crc32 rather than hash(): the same in every process and every run
+    return zlib.crc32(key.upper().encode()) % shards
+
+
+def shard_paths(shard_dir, shards):
+    return [Path(shard_dir) / f"shard-{i:03d}.db" for i in range(shards)]
+
+
+def read_manifest(shard_dir):
+    try:
+        with open(Path(shard_dir) / "manifest.json", "r") as f:
+            return json.load(f)["shards"]
+    except FileNotFoundError:
+        return None
+
+
+def load_shard(path):
+    try:
+        return read_database(path)
+    except FileNotFoundError:
+        return {}
+
+
+class ShardedStore:
+    """Accounts spread over N JSON shard files by crc32 of the uppercased username.
+
+    Point operations read and rewrite only the account's shard; all(), search() and
+    batched writes visit each shard at most once. manifest.json fixes N so every process
+    routes keys the same way; shards.py reshard changes it. map_shards() runs a
+    whole-book job with one worker process per shard.
+    """
+
+    def __init__(self, shard_dir, shards=None):
+        self.dir = Path(shard_dir)
+        existing = read_manifest(self.dir)
+        if existing is not None and shards not in (None, existing):
+            raise ValueError(f"{self.dir} holds {existing} shards, not {shards} (use shards.py reshard)")
+        self.shards = existing or shards or int(os.getenv(SHARDS_ENV) or 8)
+        self.paths = shard_paths(self.dir, self.shards)
+        self._locks = [commit_lock(path) for path in self.paths]
+        self.events = None
+
+    def _ensure_manifest(self):
+        if read_manifest(self.dir) is None:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            write_json_atomic(self.dir / "manifest.json", {"shards": self.shards, "hash": "crc32"})
+
+    def _lock(self, i):
+        self._ensure_manifest()
+        return self._locks[i]
+
+    def _path(self, key):
+        return self.paths[shard_index(key, self.shards)]
+
+    def _by_shard(self, keys):
+        groups = {}
+        for key in keys:
+            groups.setdefault(shard_index(key, self.shards), []).append(key)
+        return groups
+
+    def _write(self, i, data, changed=None):
+        write_database(self.paths[i], data, changed=changed)
+
+    # --- store interface ---
+    def exists(self):
+        return read_manifest(self.dir) is not None
+
+    def get(self, key):
+        return load_shard(self._path(key)).get(key)
+
+    def get_many(self, keys):
+        found = {}
+        for i, group in self._by_shard(keys).items():
+            shard = load_shard(self.paths[i])
+            found.update((key, shard[key]) for key in group if key in shard)
+        return found
+
+    def __contains__(self, key):
+        return key in load_shard(self._path(key))
+
+    def all(self):
+        data = {}
+        for path in self.paths:
+            data.update(load_shard(path))
+        return data
+
+    def items(self):
+        # only one shard in memory at a time
+        for path in self.paths:
+            yield from load_shard(path).items()
+
+    def replace_all(self, data):
+        parts = [{} for _ in range(self.shards)]
+        for key, acct in data.items():
+            parts[shard_index(key, self.shards)][key] = acct
+        for i, part in enumerate(parts):
+            with self._lock(i):
+                old = load_shard(self.paths[i]) if self.events is not None else {}
+                before = _before(self.events, old, old.keys() | part.keys())
+                self._write(i, part)
+                _publish(self.events, before, part)
+
+    def put(self, key, acct):
+        i = shard_index(key, self.shards)
+        with self._lock(i):
+            shard = load_shard(self.paths[i])
+            before = _before(self.events, shard, (key,))
+            shard[key] = acct
+            self._write(i, shard, {key})
+            _publish(self.events, before, shard)
+
+    def update(self, key, fields):
+        i = shard_index(key, self.shards)
+        with self._lock(i):
+            shard = load_shard(self.paths[i])
+            before = _before(self.events, shard, (key,))
+            shard[key].update(fields)
+            self._write(i, shard, {key})
+            _publish(self.events, before, shard)
+
+    def update_many(self, updates):
+        # one rewrite per touched shard; each shard commits (and publishes) on its own
+        for i, keys in self._by_shard(updates).items():
+            with self._lock(i):
+                shard = load_shard(self.paths[i])
+                before = _before(self.events, shard, keys)
+                for key in keys:
+                    shard[key].update(updates[key])
+                self._write(i, shard, set(keys))
+                _publish(self.events, before, shard)
+
+    def put_many(self, accounts):
+        for i, keys in self._by_shard(accounts).items():
+            with self._lock(i):
+                shard = load_shard(self.paths[i])
+                before = _before(self.events, shard, keys)
+                for key in keys:
+                    shard[key] = accounts[key]
+                self._write(i, shard, set(keys))
+                _publish(self.events, before, shard)
+
+    def delete(self, key):
+        i = shard_index(key, self.shards)
+        with self._lock(i):
+            shard = load_shard(self.paths[i])
+            before = _before(self.events, shard, (key,))
+            if shard.pop(key, None) is not None:
+                self._write(i, shard, {key})
+                _publish(self.events, before, shard)
+
+    def delete_many(self, keys):
+        for i, group in self._by_shard(keys).items():
+            with self._lock(i):
+                shard = load_shard(self.paths[i])
+                before = _before(self.events, shard, group)
+                for key in group:
+                    shard.pop(key, None)
+                self._write(i, shard, set(group))
+                _publish(self.events, before, shard)
+
+    def search(self, filters, offset=0, limit=20):
+        by_balance = "min_balance" in filters or "max_balance" in filters
+        total = 0
+        candidates = []
+        for path in self.paths:
+            count, page = scan_search(load_shard(path).items(), filters, 0, offset + limit)
+            total += count
+            candidates.extend(page)
+        order = (lambda pair: (pair[1].get("balance", 0), pair[0])) if by_balance else (lambda pair: pair[0])
+        return total, heapq.nsmallest(offset + limit, candidates, key=order)[offset:]
+
+    def map_shards(self, fn, *args, workers=None):
+        """Run fn(shard_path, *args) for every shard, one process per shard (at most `workers`)."""
+        workers = min(self.shards, workers or os.cpu_count() or 1)
+        if workers == 1:
+            return [fn(path, *args) for path in self.paths]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(fn, self.paths, *(repeat(arg) for arg in args)))
+
+    def close(self):
+        pass
@@ -0,0 +1,88 @@
+"""RateRefresher against the local stand-in server (fx_stub_server), no network needed.
+
+    python -m pytest -q test_fx_refresher.py
+"""
+import json
+import threading
+import time
+
+import pytest
+
+from currency_exchange import CurrencyConverter
+from fx_refresher import RateRefresher
+from fx_stub_server import serve
+
+RATES = {"EUR": 0.9, "GBP": 0.8, "JPY": 150.0}
+
+
+@pytest.fixture
+def stub():
+    server = serve(0, rates=RATES, drift=0.0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, f"http://127.0.0.1:{server.server_address[1]}/api/live"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def converter(tmp_path):
+    db = tmp_path / "currency.db"
+    db.write_text(json.dumps({"last_updated": "2000-01-01T00:00:00", "base": "USD", "rates": {"EUR": 1.0}}))
+    return CurrencyConverter(db_path=db)
+
+
+def test_refresh_once_swaps_rates(stub, converter):
+    _, url = stub
+    refresher = RateRefresher(converter, key="test", url=url)
+    old = converter.table
+    assert refresher.refresh_once()
+    # a whole new table, swapped in, while the old one is left as it was
+    assert converter.table is not old
+    assert old.rates == {"EUR": 1.0}
+    assert converter.get_rate("JPY") == 150.0
+    assert converter.convert(90, "EUR", "GBP") == pytest.approx(80)
+    # currency.db replaced atomically, and the snapshot recorded in the history
+    with open(converter.db_path, "r") as f:
+        assert json.load(f)["rates"] == RATES
+    assert not list(converter.db_path.parent.glob("*.tmp"))
+    assert converter.convert_at(150, "JPY", "EUR", time.time()) == pytest.approx(0.9)
+    metrics = refresher.metrics()
+    assert metrics["refreshes"] == 1 and metrics["failures"] == 0
+    assert metrics["last_latency"] > 0
+    assert metrics["staleness"] < 60
+    refresher.stop()
+
+
+def test_outage_keeps_rates_and_counts_failures(stub, converter):
+    server, url = stub
+    refresher = RateRefresher(converter, key="test", url=url)
+    assert refresher.refresh_once()
+    table = converter.table
+    server.shutdown()
+    server.server_close()
+    refresher.last_latency = None
+    for _ in range(3):
+        assert not refresher.refresh_once()
+    metrics = refresher.metrics()
+    assert metrics["refreshes"] == 1 and metrics["failures"] == 3
+    assert metrics["last_error"]
+    assert metrics["last_latency"] is not None
+    # the last good rates stay in use, and grow staler
+    assert converter.table is table
+    before = refresher.staleness()
+    time.sleep(0.05)
+    assert refresher.staleness() > before
+    refresher.stop()
+
+
+def test_rejected_key_is_a_failure(stub, converter):
+    _, url = stub
+    refresher = RateRefresher(converter, key="test", url=url)
+    refresher.key = ""  # the stub answers success=false without an access key
+    table = converter.table
+    assert not refresher.refresh_once()
+    assert "API request failed" in refresher.last_error
+    assert converter.table is table
+    assert refresher.staleness() > 365 * 24 * 3600
+    refresher.stop()
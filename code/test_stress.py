@@ -0,0 +1,21 @@
+"""Several processes depositing, withdrawing and signing up against one db/ at once, for
+every storage mode (the checks of benchmarks/stress.py, at test size).
+
+    python -m pytest -q test_stress.py
+"""
+import pytest
+
+from benchmarks.stress import check, run_workers, seed_db
+
+PROCESSES = 4
+OPS = 60
+SIGNUPS = 6
+
+
+@pytest.mark.parametrize("storage", ["json", "wal", "sqlite", "cached", "compact", "sharded"])
+def test_concurrent_writers_lose_nothing(tmp_path, storage):
+    accounts = seed_db(tmp_path, 8, storage)
+    net, created = run_workers(str(tmp_path), storage, accounts, PROCESSES, OPS, SIGNUPS)
+    # some operations really happened, and every one of them survived
+    assert any(net.values())
+    assert check(tmp_path, storage, accounts, net, created, SIGNUPS) == []
@@ -0,0 +1,364 @@
+"""Velocity limits: how often and how much an account may withdraw, and how many failed
+logins it may collect, within a sliding window.
+
+Each limit is kept in a SlidingWindow: per account a ring of `buckets` counters covering
+the window plus their running totals, in flat arrays at the account's slot. A check steps
+the ring forward to the current bucket (subtracting the buckets it passes from the
+totals) and reads the totals, so it costs the same with ten accounts or ten million, and
+an account takes a fixed 8 * (buckets + 1) * fields + 8 bytes per window however often
+it withdraws. Accounts whose window has
+emptied give their slot back at the next flush.
+
+Limits come from DEFAULT_LIMITS or the JSON file named by BANK_VELOCITY_LIMITS:
+
+    {"withdraw_window": 86400, "login_window": 900,
+     "limits": {"*": {"withdraw_count": 20, "withdraw_amount": 10000, "login_failures": 5},
+                "admin": {"login_failures": 3}, "JPY": {"withdraw_amount": 1500000},
+                "EUR/admin": {"withdraw_count": null}}}
+
+An account's limits are "*", then its type ("user" or "admin"), then its currency, then
+"CUR/type", each overriding the fields it names; null means unlimited. withdraw_amount is
+in the currency the key names, or the converter's base currency for "*" and bare types
+(converted at the converter's current rates, so again after fx_refresher swaps them).
+
+Like sessions.py, the counters live in memory and are merged with velocity.db lazily (at
+most every persist_interval seconds, and at exit), so other processes and restarts see
+them without any file access on the hot path. velocity.db holds the raw arrays, so a
+flush or reload is a few bulk copies rather than a parse per account.
+"""
+from array import array
+from pathlib import Path
+import atexit
+import json
+import os
+import struct
+import threading
+import time
+from accounts import from_minor, to_minor
+from storage import commit_lock, file_signature, write_atomic
+
+VELOCITY_LIMITS_ENV = "BANK_VELOCITY_LIMITS"
+DEFAULT_LIMITS = {
+    "withdraw_window": 24 * 3600,
+    "login_window": 15 * 60,
+    "limits": {
+        "*": {"withdraw_count": 20, "withdraw_amount": 10_000, "login_failures": 5},
+        "admin": {"login_failures": 3},
+    },
+}
+BUCKETS = 24
+LIMIT_FIELDS = ("withdraw_count", "withdraw_amount", "login_failures")
+MAGIC = b"BANKVEL1"
+SECTION = struct.Struct("<Q")
+
+_shared_velocity = {}
+
+
+def open_velocity(path, limits=None, converter=None):
+    path = Path(path).resolve()
+    if path not in _shared_velocity:
+        _shared_velocity[path] = VelocityLimits(path, limits or load_limits(), converter)
+    return _shared_velocity[path]
+
+
+def load_limits(path=None):
+    path = path or os.getenv(VELOCITY_LIMITS_ENV)
+    if not path:
+        return DEFAULT_LIMITS
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def describe(seconds):
+    for unit, size in (("d", 86400), ("h", 3600), ("min", 60)):
+        if seconds % size == 0:
+            return f"{seconds // size}{unit}"
+    return f"{seconds}s"
+
+
+class SlidingWindow:
+    """Per-key sums of `fields` values over the last `window` seconds, in `buckets` steps."""
+
+    def __init__(self, window, buckets=BUCKETS, fields=1):
+        self.window = window
+        self.buckets = buckets
+        self.fields = fields
+        self.width = window / buckets
+        self.stride = buckets * fields
+        self._zeros = array("q", bytes(8 * self.stride))
+        self._clear()
+
+    def _clear(self):
+        self.slots = {}
+        self._free = []
+        self._ring = array("q")  # value f of bucket b for a slot: slot * stride + b % buckets * fields + f
+        self._totals = array("q")  # slot * fields + f
+        self._last = array("q")  # newest bucket each slot has been stepped to
+
+    def bucket(self, now):
+        return int(now // self.width)
+
+    def _slot(self, key):
+        slot = self.slots.get(key)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+            else:
+                slot = len(self._last)
+                self._ring.extend(self._zeros)
+                self._totals.extend(self._zeros[: self.fields])
+                self._last.append(0)
+            self.slots[key] = slot
+        return slot
+
+    def _advance(self, slot, b):
+        last = self._last[slot]
+        if b <= last:
+            return
+        fields, start, base = self.fields, slot * self.stride, slot * self.fields
+        if b - last >= self.buckets:
+            # everything in the ring has slid out of the window
+            self._ring[start : start + self.stride] = self._zeros
+            self._totals[base : base + fields] = self._zeros[:fields]
+        else:
+            ring, totals = self._ring, self._totals
+            for t in range(last + 1, b + 1):
+                i = start + t % self.buckets * fields
+                for f in range(fields):
+                    totals[base + f] -= ring[i + f]
+                    ring[i + f] = 0
+        self._last[slot] = b
+
+    def totals(self, key, b):
+        """key's sums for the window ending at bucket b, one per field."""
+        slot = self.slots.get(key)
+        if slot is None:
+            return [0] * self.fields
+        self._advance(slot, b)
+        return self._totals[slot * self.fields : (slot + 1) * self.fields].tolist()
+
+    def add(self, key, b, values):
+        """Count values (one per field) for key in bucket b."""
+        slot = self._slot(key)
+        last = self._last[slot]
+        if b > last:
+            self._advance(slot, b)
+        elif b <= last - self.buckets:
+            return  # already outside the window
+        i, base = slot * self.stride + b % self.buckets * self.fields, slot * self.fields
+        for f, value in enumerate(values):
+            self._ring[i + f] += value
+            self._totals[base + f] += value
+
+    def discard(self, key):
+        slot = self.slots.pop(key, None)
+        if slot is not None:
+            self._release(slot)
+
+    def _release(self, slot):
+        start, base = slot * self.stride, slot * self.fields
+        self._ring[start : start + self.stride] = self._zeros
+        self._totals[base : base + self.fields] = self._zeros[: self.fields]
+        self._last[slot] = 0
+        self._free.append(slot)
+
+    def expire(self, now):
+        """Give back the slots of keys with nothing left in the window."""
+        cutoff = self.bucket(now) - self.buckets
+        last = self._last
+        for key, slot in [(key, slot) for key, slot in self.slots.items() if last[slot] <= cutoff]:
+            del self.slots[key]
+            self._release(slot)
+
+    # --- raw arrays, for velocity.db ---
+    def dump(self):
+        names = [""] * len(self._last)  # usernames are never empty, so "" marks a free slot
+        for key, slot in self.slots.items():
+            names[slot] = key
+        return ["\0".join(names).encode(), self._last.tobytes(), self._totals.tobytes(), self._ring.tobytes()]
+
+    def load(self, names, last, totals, ring):
+        self._clear()
+        self._last.frombytes(last)
+        self._totals.frombytes(totals)
+        self._ring.frombytes(ring)
+        for slot, key in enumerate(names.decode().split("\0") if self._last else []):
+            if key:
+                self.slots[key] = slot
+            else:
+                self._free.append(slot)
+
+    def __contains__(self, key):
+        return key in self.slots
+
+    def __len__(self):
+        return len(self.slots)
+
+
+class VelocityLimits:
+    """Sliding-window limits on withdrawals (count and amount) and failed logins per account."""
+
+    def __init__(self, path, limits=DEFAULT_LIMITS, converter=None, persist_interval=5.0):
+        self.path = Path(path)
+        self.limits = limits
+        self.converter = converter
+        self.persist_interval = persist_interval
+        self.windows = {
+            "withdraw": SlidingWindow(limits.get("withdraw_window", DEFAULT_LIMITS["withdraw_window"]), fields=2),
+            "login_failures": SlidingWindow(limits.get("login_window", DEFAULT_LIMITS["login_window"])),
+        }
+        self._resolved = {}  # (currency, type) -> {field: limit, amounts in minor units}
+        self._rates = None  # the converter's RateTable that _resolved was converted with
+        # changes velocity.db does not have yet: window -> key -> array of (bucket, *values),
+        # and the keys cleared before them
+        self._unsaved = {name: {} for name in self.windows}
+        self._cleared = {name: set() for name in self.windows}
+        self._sig = None
+        self._checked = time.monotonic()
+        self._lock = threading.RLock()
+        self._commit = commit_lock(self.path)
+        self._merge()
+        atexit.register(self.flush)
+
+    # --- limits ---
+    def limits_for(self, currency, is_admin=False):
+        kind = "admin" if is_admin else "user"
+        table = self.converter.table if self.converter is not None else None
+        if table is not self._rates:
+            # rates were swapped: base-currency limits have to be converted again
+            self._resolved = {}
+            self._rates = table
+        resolved = self._resolved.get((currency, kind))
+        if resolved is None:
+            resolved = {}
+            rules = self.limits.get("limits", {})
+            for name in ("*", kind, currency, f"{currency}/{kind}"):
+                for field, value in rules.get(name, {}).items():
+                    if field == "withdraw_amount" and value is not None:
+                        value = to_minor(value if name in (currency, f"{currency}/{kind}") else self._from_base(value, currency), currency)
+                    resolved[field] = value
+            self._resolved[(currency, kind)] = resolved
+        return resolved
+
+    def _from_base(self, amount, currency):
+        if self.converter is None:
+            return amount
+        try:
+            return self.converter.convert(amount, self.converter.base, currency)
+        except Exception:
+            return amount
+
+    # --- checks ---
+    def withdraw(self, account, units, currency="USD", is_admin=False, now=None):
+        """Record a withdrawal of `units` minor units, or return why it is over the limit."""
+        limits = self.limits_for(currency, is_admin)
+        window = self.windows["withdraw"]
+        b = window.bucket(time.time() if now is None else now)
+        with self._lock:
+            self._tick()
+            count, amount = window.totals(account, b)
+            max_count = limits.get("withdraw_count")
+            if max_count is not None and count >= max_count:
+                return f"Withdrawal limit reached: at most {max_count} withdrawals per {describe(window.window)}"
+            max_amount = limits.get("withdraw_amount")
+            if max_amount is not None and amount + units > max_amount:
+                return f"Withdrawal limit reached: at most {from_minor(max_amount, currency)} {currency} per {describe(window.window)}"
+            self._add("withdraw", account, b, (1, units))
+        return None
+
+    def login_allowed(self, account, currency="USD", is_admin=False, now=None):
+        limit = self.limits_for(currency, is_admin).get("login_failures")
+        if limit is None:
+            return True
+        window = self.windows["login_failures"]
+        with self._lock:
+            self._tick()
+            return window.totals(account, window.bucket(time.time() if now is None else now))[0] < limit
+
+    def login_failed(self, account, now=None):
+        window = self.windows["login_failures"]
+        with self._lock:
+            self._add("login_failures", account, window.bucket(time.time() if now is None else now), (1,))
+            self._tick()
+
+    def login_succeeded(self, account):
+        with self._lock:
+            if account in self.windows["login_failures"]:
+                self.windows["login_failures"].discard(account)
+                self._unsaved["login_failures"].pop(account, None)
+                self._cleared["login_failures"].add(account)
+                self._tick()
+
+    def _add(self, name, account, b, values):
+        self.windows[name].add(account, b, values)
+        changes = self._unsaved[name].get(account)
+        if changes is None:
+            changes = self._unsaved[name][account] = array("q")
+        changes.append(b)
+        changes.extend(values)
+
+    # --- persistence ---
+    def _header(self):
+        return {name: [window.window, window.buckets, window.fields] for name, window in self.windows.items()}
+
+    def _replay(self):
+        for name, window in self.windows.items():
+            for account in self._cleared[name]:
+                window.discard(account)
+            step = window.fields + 1
+            for account, changes in self._unsaved[name].items():
+                for i in range(0, len(changes), step):
+                    window.add(account, changes[i], changes[i + 1 : i + step])
+
+    def _merge(self):
+        """Reload velocity.db if another process wrote it, keeping our unsaved changes."""
+        sig = file_signature(self.path)
+        if sig is None or sig == self._sig:
+            return
+        with open(self.path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return
+            header = json.loads(f.read(SECTION.unpack(f.read(SECTION.size))[0]))
+            for name, shape in header.items():
+                sections = [f.read(SECTION.unpack(f.read(SECTION.size))[0]) for _ in range(4)]
+                # counters kept with other window settings no longer mean anything
+                if name in self.windows and shape == self._header()[name]:
+                    self.windows[name].load(*sections)
+        self._replay()
+        self._sig = sig
+
+    def flush(self):
+        with self._lock:
+            if not any(self._unsaved.values()) and not any(self._cleared.values()):
+                return
+            with self._commit:
+                self._merge()
+                now = time.time()
+                for window in self.windows.values():
+                    window.expire(now)
+                header = json.dumps(self._header()).encode()
+
+                def write(f):
+                    f.write(MAGIC)
+                    for section in [header, *(part for window in self.windows.values() for part in window.dump())]:
+                        f.write(SECTION.pack(len(section)))
+                        f.write(section)
+
+                write_atomic(self.path, write, binary=True)
+                self._sig = file_signature(self.path)
+            self._unsaved = {name: {} for name in self.windows}
+            self._cleared = {name: set() for name in self.windows}
+            self._checked = time.monotonic()
+
+    def _tick(self):
+        # lazy upkeep, as in SessionManager: at most once per persist_interval
+        if time.monotonic() - self._checked < self.persist_interval:
+            return
+        self._checked = time.monotonic()
+        if any(self._unsaved.values()) or any(self._cleared.values()):
+            self.flush()
+        else:
+            self._merge()
+
+    def close(self):
+        self.flush()